@@ -1,19 +1,30 @@
 use pyo3::{
-    PyAny, PyResult, Python,
+    Py, PyAny, PyResult, Python,
     types::{PyAnyMethods, PyModule},
 };
 
-use std::ffi::CString;
+use std::{ffi::CString, sync::Arc};
 use tokio::{spawn, task::spawn_blocking};
 
 #[tokio::main]
 async fn main() -> PyResult<()> {
-    let first =
-        spawn(async { agent_query(1, "What did we cover in RBES Phase 1?".to_string()).await });
+    // One pipeline, synced with the vault and saved once, before any query:
+    // agents syncing the same index dir at once would mix their files
+    let rag = Arc::new(build_pipeline().await?);
 
-    let second =
-        spawn(async { agent_query(1, "What Python concepts did I cover?".to_string()).await });
-    let third = spawn(async { agent_query(1, "How to build a RAG pipeline?".to_string()).await });
+    let agent = Arc::clone(&rag);
+    let first = spawn(async move {
+        agent_query(agent, "What did we cover in RBES Phase 1?".to_string()).await
+    });
+
+    let agent = Arc::clone(&rag);
+    let second = spawn(async move {
+        agent_query(agent, "What Python concepts did I cover?".to_string()).await
+    });
+
+    let agent = Arc::clone(&rag);
+    let third =
+        spawn(async move { agent_query(agent, "How to build a RAG pipeline?".to_string()).await });
 
     let (one, two, three) = tokio::join!(first, second, third);
     let one = one.unwrap();
@@ -27,8 +38,8 @@ async fn main() -> PyResult<()> {
     Ok(())
 }
 
-async fn agent_query(agent_id: usize, question: String) -> String {
-    let res = spawn_blocking(move || -> PyResult<_> {
+async fn build_pipeline() -> PyResult<Py<PyAny>> {
+    spawn_blocking(|| -> PyResult<_> {
         Python::attach(|py| -> PyResult<_> {
             let sys = py.import("sys")?;
             let path = sys.getattr("path")?;
@@ -62,15 +73,43 @@ async fn agent_query(agent_id: usize, question: String) -> String {
                 c"obsidian_ingestion",
             )?;
 
-            let rag_class_inst = rag_module.getattr("RAGPipeline")?.call1((1536,))?;
+            let index_dir = "/Users/hectorcryo/dev/intelligent-infrastructure/knowledge-search/index";
+            let embedding_cache =
+                "/Users/hectorcryo/dev/intelligent-infrastructure/knowledge-search/embedding_cache.sqlite";
+
+            // Reuse the saved index and only ingest the notes that changed since
+            let rag_class = rag_module.getattr("RAGPipeline")?;
+            let has_index: bool = rag_class
+                .call_method1("has_index", (index_dir,))?
+                .extract()?;
+            let rag_class_inst = if has_index {
+                rag_class.call_method1("load", (index_dir, true, embedding_cache))?
+            } else {
+                rag_class.call1((1536, embedding_cache))?
+            };
 
             let obs_class = obs_module
                 .getattr("ObsidianIngestion")?
                 .call1((&rag_class_inst,))?;
+            let stats = obs_class.call_method1("ingest_directory", (database_source,))?;
+            let files_changed: usize = stats.get_item("files_processed")?.extract::<usize>()?
+                + stats.get_item("files_removed")?.extract::<usize>()?;
+            if files_changed > 0 || !has_index {
+                let _ = rag_class_inst.call_method1("save", (index_dir,))?;
+            }
+
+            Ok(rag_class_inst.unbind())
+        })
+    })
+    .await
+    .unwrap()
+}
 
-            let _ = obs_class.call_method1("ingest_directory", (database_source,))?;
-
-            let result = rag_class_inst
+async fn agent_query(rag: Arc<Py<PyAny>>, question: String) -> String {
+    let res = spawn_blocking(move || -> PyResult<_> {
+        Python::attach(|py| -> PyResult<_> {
+            let result = rag
+                .bind(py)
                 .call_method1("query", (question,))?
                 .get_item("answer")?;
 
@@ -0,0 +1,129 @@
+"""Semantic answer cache: reuse an answer for a near-duplicate question.
+
+Questions are matched by the cosine similarity of their embeddings, found
+with a small `VectorStore` of cached question vectors. A hit needs a
+similarity of at least `threshold`. Entries expire after `ttl` seconds, the
+least recently used are evicted past `max_entries`, and `invalidate(doc_ids)`
+drops every answer built from any of those chunks. Re-ingesting an edited
+or deleted note retires its chunks, which invalidates the answers built on
+them. Newly added notes invalidate nothing; the TTL bounds how long an
+answer can miss them.
+"""
+from collections import OrderedDict
+from knowledge_search import VectorStore
+from typing import Dict, List, Optional, Set
+import threading
+import time
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class CachedAnswer:
+    def __init__(self, result: dict, created: float):
+        self.result = result
+        self.created = created
+
+
+class AnswerCache:
+    def __init__(self, dimensions: int, threshold: float = DEFAULT_THRESHOLD,
+                 ttl: Optional[float] = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.dimensions = dimensions
+        self.threshold = threshold
+        # Seconds an answer stays valid; None keeps answers until evicted
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._index = VectorStore(dimensions)
+        # Index row -> answer, least recently used first
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        # Chunk id -> rows whose answer used it
+        self._by_chunk: Dict[int, Set[int]] = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, embedding: List[float]) -> Optional[dict]:
+        """The cached result for the closest question, if it is close enough"""
+        with self._lock:
+            if self._entries:
+                results = self._index.search(embedding, 1)
+                if results and results[0].similarity >= self.threshold:
+                    row = results[0].index
+                    entry = self._entries[row]
+                    if self.ttl is not None and time.monotonic() - entry.created > self.ttl:
+                        self._drop(row)
+                        self.expirations += 1
+                    else:
+                        self._entries.move_to_end(row)
+                        self.hits += 1
+                        return dict(entry.result)
+            self.misses += 1
+            return None
+
+    def put(self, embedding: List[float], result: dict):
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            row = self._index.add(vector)
+            self._entries[row] = CachedAnswer(dict(result), time.monotonic())
+            for doc_id in result["chunk_ids"]:
+                self._by_chunk.setdefault(doc_id, set()).add(row)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            self._maybe_compact()
+
+    def invalidate(self, doc_ids: List[int]) -> int:
+        """Drop answers that used any of these chunks. Returns how many."""
+        with self._lock:
+            rows = set()
+            for doc_id in doc_ids:
+                rows |= self._by_chunk.get(doc_id, set())
+            for row in rows:
+                self._drop(row)
+            self.invalidations += len(rows)
+            self._maybe_compact()
+            return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._index = VectorStore(self.dimensions)
+            self._entries.clear()
+            self._by_chunk.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, row: int):
+        entry = self._entries.pop(row)
+        self._index.remove(row)
+        for doc_id in entry.result["chunk_ids"]:
+            rows = self._by_chunk.get(doc_id)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._by_chunk[doc_id]
+
+    def _maybe_compact(self):
+        # Removed rows still cost a scan; drop them once they outnumber live
+        # ones. Row ids survive compaction, so the maps stay valid.
+        if self._index.removed_count > max(len(self._entries), 64):
+            self._index.compact()
@@ -1,27 +1,222 @@
-use criterion::{BenchmarkId, Criterion, criterion_group, criterion_main};
-use knowledge_search::VectorStore;
+use criterion::{BatchSize, BenchmarkId, Criterion, Throughput, criterion_group, criterion_main};
+use knowledge_search::{Bm25Index, HnswIndex, HnswParams, SearchResult, VectorStore};
 use std::hint::black_box;
 
+/// Dimensions of the scale and k benches: a small embedding model keeps a
+/// million vectors at 1.5 GB.
+const SCALE_DIMS: usize = 384;
+
+/// Stores are built once per size, outside the timed closures, and shared
+/// by every bench that reads them.
+fn random_store(n: usize, dims: usize) -> VectorStore {
+    let mut store = VectorStore::new(dims);
+    let _ = store.add_batch(&random_vectors(n, dims, 7));
+    store
+}
+
+fn benchmark_add(c: &mut Criterion) {
+    const DIMS: usize = 1536;
+    const BATCH: usize = 1000;
+
+    let data = random_vectors(BATCH, DIMS, 3);
+    let mut group = c.benchmark_group("vector_add");
+    group.throughput(Throughput::Elements(BATCH as u64));
+    group.bench_function("add", |b| {
+        b.iter_batched_ref(
+            || VectorStore::new(DIMS),
+            |store| {
+                for vector in data.chunks_exact(DIMS) {
+                    let _ = store.add(black_box(vector));
+                }
+            },
+            BatchSize::SmallInput,
+        );
+    });
+    group.bench_function("add_batch", |b| {
+        b.iter_batched_ref(
+            || VectorStore::new(DIMS),
+            |store| store.add_batch(black_box(&data)),
+            BatchSize::SmallInput,
+        );
+    });
+    group.finish();
+}
+
+/// Search time against store size, reported as vectors scored per second
 fn benchmark_search_scaling(c: &mut Criterion) {
+    let queries = random_vectors(50, SCALE_DIMS, 11);
     let mut group = c.benchmark_group("vector_search_scaling");
-    for size in [500, 1000, 5000, 10000] {
-        group.bench_with_input(BenchmarkId::from_parameter(size), &size, |b, &size| {
-            let mut store = VectorStore::new(1536);
+    group.sample_size(20);
+    for size in [1_000, 10_000, 100_000, 1_000_000] {
+        let store = random_store(size, SCALE_DIMS);
+        group.throughput(Throughput::Elements(size as u64));
+        group.bench_with_input(BenchmarkId::from_parameter(size), &size, |b, _| {
+            let mut q = queries.chunks_exact(SCALE_DIMS).cycle();
+            b.iter(|| black_box(store.search(q.next().unwrap(), 6)));
+        });
+    }
+    group.finish();
+}
+
+fn benchmark_search_dimensions(c: &mut Criterion) {
+    const SIZE: usize = 10_000;
+
+    let mut group = c.benchmark_group("vector_search_dimensions");
+    group.throughput(Throughput::Elements(SIZE as u64));
+    for dims in [384, 768, 1536, 3072] {
+        let store = random_store(SIZE, dims);
+        let queries = random_vectors(50, dims, 11);
+        group.bench_with_input(BenchmarkId::from_parameter(dims), &dims, |b, &dims| {
+            let mut q = queries.chunks_exact(dims).cycle();
+            b.iter(|| black_box(store.search(q.next().unwrap(), 6)));
+        });
+    }
+    group.finish();
+}
+
+/// Heap upkeep per k, and a batch of queries scored in one pass
+fn benchmark_search_k(c: &mut Criterion) {
+    const SIZE: usize = 100_000;
+    const BATCH: usize = 32;
+
+    let store = random_store(SIZE, SCALE_DIMS);
+    let queries = random_vectors(BATCH, SCALE_DIMS, 11);
+    let mut group = c.benchmark_group("vector_search_k");
+    group.sample_size(20);
+    for k in [1, 6, 20, 100] {
+        group.throughput(Throughput::Elements(1));
+        group.bench_with_input(BenchmarkId::new("search", k), &k, |b, &k| {
+            let mut q = queries.chunks_exact(SCALE_DIMS).cycle();
+            b.iter(|| black_box(store.search(q.next().unwrap(), k)));
+        });
+        group.throughput(Throughput::Elements(BATCH as u64));
+        group.bench_with_input(BenchmarkId::new("search_batch", k), &k, |b, &k| {
+            b.iter(|| black_box(store.search_batch(&queries, k)));
+        });
+    }
+    group.finish();
+}
+
+/// Uniform noise in [-0.5, 0.5); the sin/cos data above is too regular to
+/// say anything about graph recall.
+fn random_vectors(n: usize, dims: usize, seed: u64) -> Vec<f32> {
+    let mut state = seed;
+    (0..n * dims)
+        .map(|_| {
+            state = state
+                .wrapping_mul(6_364_136_223_846_793_005)
+                .wrapping_add(1_442_695_040_888_963_407);
+            ((state >> 40) as f32 / (1u64 << 24) as f32) - 0.5
+        })
+        .collect()
+}
+
+fn recall_at_k(approx: &[Vec<SearchResult>], truth: &[Vec<SearchResult>]) -> f64 {
+    let (mut hits, mut total) = (0usize, 0usize);
+    for (found, expected) in approx.iter().zip(truth) {
+        hits += found
+            .iter()
+            .filter(|r| expected.iter().any(|e| e.index == r.index))
+            .count();
+        total += expected.len();
+    }
+    hits as f64 / total.max(1) as f64
+}
+
+/// HNSW latency per `ef_search`, next to brute force on the same data.
+/// Criterion only tracks time, so recall@k for each setting is printed
+/// alongside the timings.
+fn benchmark_hnsw_recall_latency(c: &mut Criterion) {
+    const DIMS: usize = 1536;
+    const K: usize = 10;
+    const QUERIES: usize = 50;
+
+    let mut group = c.benchmark_group("hnsw_search");
+    for size in [1000, 10000] {
+        let data = random_vectors(size, DIMS, 7);
+        let queries = random_vectors(QUERIES, DIMS, 11);
+
+        let mut flat = VectorStore::new(DIMS);
+        let _ = flat.add_batch(&data);
+        let mut index = HnswIndex::new(
+            DIMS,
+            HnswParams {
+                ef_construction: 100,
+                ..HnswParams::default()
+            },
+        );
+        let _ = index.add_batch(&data);
+        let truth = flat.search_batch(&queries, K).unwrap();
+
+        group.bench_with_input(BenchmarkId::new("brute_force", size), &size, |b, _| {
+            let mut q = queries.chunks_exact(DIMS).cycle();
+            b.iter(|| black_box(flat.search(q.next().unwrap(), K)));
+        });
+
+        for ef in [16, 64, 256] {
+            let approx = index.search_batch(&queries, K, ef).unwrap();
+            println!(
+                "hnsw_search/{size}/ef_{ef}: recall@{K} = {:.3}",
+                recall_at_k(&approx, &truth)
+            );
+
+            group.bench_with_input(BenchmarkId::new(format!("ef_{ef}"), size), &ef, |b, &ef| {
+                let mut q = queries.chunks_exact(DIMS).cycle();
+                b.iter(|| black_box(index.search_with_ef(q.next().unwrap(), K, ef)));
+            });
+        }
+    }
+    group.finish();
+}
+
+/// Chunk-sized synthetic documents over a skewed vocabulary: a few terms
+/// appear in most documents, most terms in few, as in real notes.
+fn synthetic_notes(n: usize, words: usize, seed: u64) -> Vec<String> {
+    let mut state = seed;
+    let mut next = move || {
+        state = state
+            .wrapping_mul(6_364_136_223_846_793_005)
+            .wrapping_add(1_442_695_040_888_963_407);
+        (state >> 33) as usize
+    };
+    (0..n)
+        .map(|_| {
+            (0..words)
+                .map(|_| {
+                    let (a, b) = (next() % 20_000, next() % 20_000);
+                    format!("w{}", a * b / 20_000)
+                })
+                .collect::<Vec<_>>()
+                .join(" ")
+        })
+        .collect()
+}
 
-            // Create and add 500 vectors
-            for i in 0..size {
-                let vec: Vec<f32> = (0..1536).map(|j| ((i + j) as f32 * 0.1).sin()).collect();
-                let _ = store.add(&vec);
-            }
+fn benchmark_bm25(c: &mut Criterion) {
+    const K: usize = 10;
 
-            // Create query vector
-            let query_vec: Vec<f32> = (0..1536).map(|j| (j as f32 * 0.2).cos()).collect();
+    let mut group = c.benchmark_group("bm25_search");
+    for size in [10_000, 100_000] {
+        let mut index = Bm25Index::default();
+        index.add_batch(&synthetic_notes(size, 80, 5));
+        // Mixes of common (low id) and rare (high id) terms
+        let queries: Vec<String> = synthetic_notes(50, 4, 13);
 
-            b.iter(|| black_box(store.search(&query_vec, 6)));
+        group.bench_with_input(BenchmarkId::from_parameter(size), &size, |b, _| {
+            let mut q = queries.iter().cycle();
+            b.iter(|| black_box(index.search(q.next().unwrap(), K)));
         });
     }
     group.finish();
 }
 
-criterion_group!(benches, benchmark_search_scaling);
+criterion_group!(
+    benches,
+    benchmark_add,
+    benchmark_search_scaling,
+    benchmark_search_dimensions,
+    benchmark_search_k,
+    benchmark_hnsw_recall_latency,
+    benchmark_bm25
+);
 criterion_main!(benches);
@@ -0,0 +1,95 @@
+"""Cost of crossing the PyO3 boundary of VectorStore, next to the Rust
+benches in similarity.rs. Needs pytest-benchmark:
+
+    pytest benches/ --benchmark-json=python_bench.json
+
+Each pair differs only in what crosses the boundary: a list copied element
+by element vs a NumPy buffer, result objects vs NumPy arrays.
+"""
+import numpy as np
+import pytest
+from knowledge_search import VectorStore
+
+pytest.importorskip("pytest_benchmark")
+
+DIMENSIONS = 1536
+SIZE = 10_000
+K = 6
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(7)
+    return rng.standard_normal((SIZE, DIMENSIONS), dtype=np.float32)
+
+
+@pytest.fixture(scope="module")
+def store(data):
+    store = VectorStore(DIMENSIONS)
+    store.add_many(data)
+    return store
+
+
+@pytest.fixture(scope="module")
+def query():
+    return np.random.default_rng(11).standard_normal(DIMENSIONS, dtype=np.float32)
+
+
+@pytest.mark.benchmark(group="add")
+def test_add_list(benchmark, data):
+    vectors = data[:1000].tolist()
+
+    def add_all():
+        store = VectorStore(DIMENSIONS)
+        for vector in vectors:
+            store.add(vector)
+    benchmark(add_all)
+
+
+@pytest.mark.benchmark(group="add")
+def test_add_numpy(benchmark, data):
+    vectors = data[:1000]
+
+    def add_all():
+        store = VectorStore(DIMENSIONS)
+        for vector in vectors:
+            store.add(vector)
+    benchmark(add_all)
+
+
+@pytest.mark.benchmark(group="add")
+def test_add_many(benchmark, data):
+    benchmark(lambda: VectorStore(DIMENSIONS).add_many(data[:1000]))
+
+
+@pytest.mark.benchmark(group="query")
+def test_search_list_query(benchmark, store, query):
+    benchmark(store.search, query.tolist(), K)
+
+
+@pytest.mark.benchmark(group="query")
+def test_search_numpy_query(benchmark, store, query):
+    benchmark(store.search, query, K)
+
+
+@pytest.mark.benchmark(group="results")
+@pytest.mark.parametrize("k", [6, 100, 1000])
+def test_search_result_objects(benchmark, store, query, k):
+    benchmark(store.search, query, k)
+
+
+@pytest.mark.benchmark(group="results")
+@pytest.mark.parametrize("k", [6, 100, 1000])
+def test_search_as_numpy(benchmark, store, query, k):
+    benchmark(store.search, query, k, as_numpy=True)
+
+
+@pytest.mark.benchmark(group="batch")
+def test_search_loop(benchmark, store, data):
+    queries = data[:32]
+    benchmark(lambda: [store.search(q, K) for q in queries])
+
+
+@pytest.mark.benchmark(group="batch")
+def test_search_many(benchmark, store, data):
+    benchmark(store.search_many, data[:32], K)
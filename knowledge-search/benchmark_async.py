@@ -0,0 +1,102 @@
+"""Concurrent queries: native asyncio (`aquery`) vs `asyncio.to_thread(query)`.
+
+Runs against the local fake server, so no API key is needed. Each question
+is one embedding request plus one chat request with a simulated generation
+time. Thread offload is capped by the default executor's thread count, while
+aquery is capped only by `max_concurrency`. The streaming run also reports
+the median time to first answer token, and the batched run sends the same
+burst through a QueryBatcher, one embedding request per batch.
+
+    python benchmark_async.py --questions 200 --chat-latency 0.5
+"""
+from fake_openai import FakeEmbeddingServer, fake_embedding
+from rag_pipeline import RAGPipeline
+from query_batcher import QueryBatcher
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+
+DIMENSIONS = 256
+
+
+def build_pipeline(server: FakeEmbeddingServer, docs: int, max_concurrency: int) -> RAGPipeline:
+    # Both the blocking and the async OpenAI clients read these
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    os.environ["OPENAI_BASE_URL"] = server.url
+    rag = RAGPipeline(dimensions=DIMENSIONS, max_concurrency=max_concurrency)
+
+    texts = [f"note {i} about ownership, borrowing and lifetimes" for i in range(docs)]
+    rag.vec_store.add_many(np.stack([fake_embedding(text, DIMENSIONS) for text in texts]))
+    rag.doc_store.add_documents(texts, ["bench.md"] * docs)
+    return rag
+
+
+async def run(label: str, make_call, questions: list) -> dict:
+    latencies = list()
+    first_tokens = list()
+
+    async def timed(question):
+        started = time.perf_counter()
+        result = await make_call(question)
+        latencies.append(time.perf_counter() - started)
+        if "first_token_s" in result.get("timings", {}):
+            first_tokens.append(result["timings"]["first_token_s"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(q) for q in questions))
+    wall = time.perf_counter() - started
+
+    result = {
+        "mode": label,
+        "wall_s": round(wall, 3),
+        "queries_per_s": round(len(questions) / wall, 1),
+        "p50_s": round(float(np.percentile(latencies, 50)), 3),
+        "p99_s": round(float(np.percentile(latencies, 99)), 3),
+    }
+    if first_tokens:
+        result["first_token_p50_s"] = round(float(np.percentile(first_tokens, 50)), 3)
+    return result
+
+
+async def streamed(rag: RAGPipeline, question: str) -> dict:
+    async for event in rag.aquery_stream(question, 6):
+        if event["type"] == "done":
+            return event
+
+
+async def main(args):
+    with FakeEmbeddingServer(dimensions=DIMENSIONS, latency=args.embed_latency,
+                             chat_latency=args.chat_latency) as server:
+        rag = build_pipeline(server, args.docs, args.max_concurrency)
+        # Distinct questions per mode so neither is served from the embedding cache
+        threaded = [f"thread question {i}" for i in range(args.questions)]
+        native = [f"async question {i}" for i in range(args.questions)]
+        streaming = [f"stream question {i}" for i in range(args.questions)]
+        batched = [f"batched question {i}" for i in range(args.questions)]
+        batcher = QueryBatcher(rag, max_batch=args.max_batch, max_delay=args.max_delay)
+
+        results = [
+            await run("aquery", lambda q: rag.aquery(q, 6), native),
+            await run("aquery_stream", lambda q: streamed(rag, q), streaming),
+            {**await run("QueryBatcher.aquery", lambda q: batcher.aquery(q, 6), batched),
+             **batcher.get_stats()},
+            await run("to_thread(query)", lambda q: asyncio.to_thread(rag.query, q, 6), threaded),
+        ]
+        await rag.aclose()
+
+    for result in results:
+        print(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-delay", type=float, default=0.005)
+    asyncio.run(main(parser.parse_args()))
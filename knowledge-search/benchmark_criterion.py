@@ -0,0 +1,50 @@
+"""Collect the latest `cargo bench` results into one JSON file.
+
+Criterion keeps each bench's estimates under the workspace's
+target/criterion/. This flattens them to one record per bench (nanoseconds
+per iteration, and elements per second where the bench declares a
+throughput) so results can be kept and diffed across releases, next to
+`pytest benches/ --benchmark-json=...`.
+
+    cargo bench && python benchmark_criterion.py --out rust_bench.json
+"""
+from pathlib import Path
+import argparse
+import json
+import platform
+
+
+def collect(criterion_dir: Path) -> list:
+    benches = list()
+    for meta_path in sorted(criterion_dir.glob("**/new/benchmark.json")):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(meta_path.with_name("estimates.json")) as f:
+            estimates = json.load(f)
+
+        record = {
+            "id": meta["full_id"],
+            "mean_ns": estimates["mean"]["point_estimate"],
+            "median_ns": estimates["median"]["point_estimate"],
+            "std_dev_ns": estimates["std_dev"]["point_estimate"],
+        }
+        throughput = meta.get("throughput") or {}
+        if "Elements" in throughput:
+            record["elements_per_s"] = throughput["Elements"] / record["mean_ns"] * 1e9
+        benches.append(record)
+    return benches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # The workspace root holds the target directory
+    parser.add_argument("--criterion-dir", default="../target/criterion")
+    parser.add_argument("--out", default="rust_bench.json")
+    args = parser.parse_args()
+
+    benches = collect(Path(args.criterion_dir))
+    if not benches:
+        raise SystemExit(f"no results under {args.criterion_dir}; run `cargo bench` first")
+    with open(args.out, "w") as f:
+        json.dump({"machine": platform.machine(), "benches": benches}, f, indent=2)
+    print(f"{len(benches)} benches written to {args.out}")
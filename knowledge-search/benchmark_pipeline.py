@@ -1,94 +1,273 @@
-import cProfile
-import pstats
-from rag_pipeline import RAGPipeline
+"""End-to-end latency and throughput of RAGPipeline on a synthetic vault.
+
+Runs against the local fake server with seeded latency distributions, so no
+API key is needed and the numbers repeat from run to run. With
+`--embedding-backend hashing` the vault and the questions are embedded by
+the local hashing embedder instead, and only chat goes to the fake server. For each vault
+size it drives `aquery` two ways:
+
+- closed loop: N callers, each asking again as soon as it is answered
+- open loop: Poisson arrivals at a fixed rate, whether or not earlier
+  queries are done. Latency counts from the scheduled arrival, so a backlog
+  shows up in the percentiles instead of slowing the load down.
+
+Stages (embedding, vector search, document fetch, prompt build, chat
+request) come from the pipeline's own metrics hooks, so the benchmark runs
+the real query code. Quantiles per stage, end-to-end p50/p95/p99 measured by
+the callers, counters and throughput per run go to JSON.
+`compare` flags stages that got slower, and runs whose throughput dropped,
+against a stored baseline and exits non-zero if there are any.
+
+    python benchmark_pipeline.py run --chunks 1000 100000 1000000 --out bench.json
+    python benchmark_pipeline.py run --embedding-backend hashing   # real local embeddings
+    python benchmark_pipeline.py compare baseline.json bench.json --tolerance 0.1
+"""
+from fake_openai import FakeEmbeddingServer, latency_distribution
+from rag_pipeline import MAX_CONCURRENCY, RAGPipeline
+from embedding_backends import HashingBackend
+from metrics import Metrics, exponential_buckets
+from typing import List
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
 import time
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+# Chunks per synthetic note, and notes' skewed vocabulary
+CHUNKS_PER_NOTE = 8
+VOCABULARY = 20_000
+# Vectors and texts generated per step, to bound memory at 1M chunks
+BUILD_BLOCK = 50_000
+# 1µs to ~190s, eight buckets per doubling: stage quantiles within ~5%
+FINE_BUCKETS = exponential_buckets(1e-6, 2 ** 0.125, 220)
+
+
+def summarize(samples: List[float]) -> dict:
+    ms = np.asarray(samples) * 1000
+    summary = {"count": len(samples), "mean_ms": round(float(ms.mean()), 4)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(float(np.percentile(ms, p)), 4)
+    return summary
+
+
+def stage_summary(metrics: Metrics) -> dict:
+    """The pipeline's own stage histograms, in the units of `summarize`"""
+    stages = dict()
+    for stage, stats in metrics.summary()["stages"].items():
+        summary = {"count": stats["count"],
+                   "mean_ms": round(stats["sum_s"] / stats["count"] * 1000, 4)}
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = round(stats[f"p{p}_s"] * 1000, 4)
+        stages[stage] = summary
+    return stages
+
+
+def build_vault(rag: RAGPipeline, chunks: int, seed: int, words: int):
+    """Texts drawn from a Zipf-skewed vocabulary so prompts are chunk-sized,
+    with random unit vectors, or their embeddings from a local backend"""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"term{i}" for i in range(VOCABULARY)])
+    backend = rag.embed_gen.backend
+    for start in range(0, chunks, BUILD_BLOCK):
+        n = min(BUILD_BLOCK, chunks - start)
+        vectors = rng.standard_normal((n, rag.vec_store.dimensions), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        terms = vocabulary[rng.zipf(1.3, size=(n, words)) % VOCABULARY]
+        texts = [" ".join(row) for row in terms.tolist()]
+        if isinstance(backend, HashingBackend):
+            # Straight to the array: a million chunks would only churn the embedding cache
+            vectors = backend.embed_array(texts)
+        sources = [f"note{(start + i) // CHUNKS_PER_NOTE}.md" for i in range(n)]
+        rag.vec_store.add_many(vectors)
+        rag.doc_store.add_documents(texts, sources)
+
+
+async def closed_loop(rag: RAGPipeline, questions: List[str], concurrency: int,
+                      top_k: int) -> List[float]:
+    latencies = list()
+    remaining = iter(questions)
+
+    async def caller():
+        for question in remaining:
+            started = time.perf_counter()
+            await rag.aquery(question, top_k)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return latencies
+
+
+async def open_loop(rag: RAGPipeline, questions: List[str], rate: float,
+                    top_k: int, seed: int) -> List[float]:
+    latencies = list()
+    arrivals = np.cumsum(np.random.default_rng(seed).exponential(1 / rate, len(questions)))
+    started = time.perf_counter()
 
+    async def arrive(question: str, due: float):
+        await rag.aquery(question, top_k)
+        latencies.append(time.perf_counter() - due)
 
-def profile_query_components(rag: RAGPipeline, question: str):
-    # Time embedding
-    start = time.perf_counter()
-    query_embedding = rag.embed_gen.embed_text(question)
-    embed_time = time.perf_counter() - start
-    
-    # Time search
-    start = time.perf_counter()
-    results = rag.vec_store.search(query_embedding, 6)
-    search_time = time.perf_counter() - start
-    
-    # Time document retrieval
-    start = time.perf_counter()
-    doc_ids = [r.index for r in results]
-    docs = rag.doc_store.get_documents(doc_ids)
-    retrieval_time = time.perf_counter() - start
-    
-    # Time LLM generation
-    context = "\n\n".join(docs)
-
-    system_prompt = """
-    You are a helpful assistant.
-    Answer questions based on the provided context.
-    """
-
-    user_message = f"""Context:
-    {context}
-
-    Question: {question}
-
-    Answer the question based on the context above.
-    If the context doesn't contain relevant information, say so.
-    """
-
-    start = time.perf_counter()
-    response = rag.ai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ]
-    )
-    llm_time = time.perf_counter() - start
-    
+    tasks = list()
+    for question, offset in zip(questions, arrivals.tolist()):
+        due = started + offset
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(arrive(question, due)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def measure(rag: RAGPipeline, label: str, load) -> dict:
+    # Each run's samples are its own
+    rag.metrics.reset()
+    started = time.perf_counter()
+    latencies = await load
+    wall = time.perf_counter() - started
+
+    stages = stage_summary(rag.metrics)
+    stages["total"] = summarize(latencies)
     return {
-        "embed_time": embed_time,
-        "search_time": search_time,
-        "retrieval_time": retrieval_time,
-        "llm_time": llm_time,
-        "total": embed_time + search_time + retrieval_time + llm_time
+        "run": label,
+        "queries": len(latencies),
+        "wall_s": round(wall, 4),
+        "throughput_qps": round(len(latencies) / wall, 2),
+        "stages": stages,
+        "counters": rag.metrics.summary()["counters"],
     }
 
+
+async def bench_scale(args, chunks: int) -> List[dict]:
+    # Room for every closed-loop caller, or the extra ones would queue on the pipeline
+    max_concurrency = max([MAX_CONCURRENCY] + args.concurrency)
+    rag = RAGPipeline(dimensions=args.dimensions, max_concurrency=max_concurrency,
+                      metrics=Metrics(FINE_BUCKETS), embedding_backend=args.embedding_backend)
+    started = time.perf_counter()
+    build_vault(rag, chunks, args.seed, args.chunk_words)
+    build_s = time.perf_counter() - started
+
+    runs = list()
+    try:
+        for concurrency in args.concurrency:
+            # Fresh questions per run, so none is served from the embedding cache
+            questions = [f"closed {concurrency} question {i}" for i in range(args.queries)]
+            load = closed_loop(rag, questions, concurrency, args.top_k)
+            runs.append(await measure(rag, f"closed/{concurrency}", load))
+        for rate in args.rates:
+            questions = [f"open {rate} question {i}" for i in range(args.queries)]
+            load = open_loop(rag, questions, rate, args.top_k, args.seed)
+            runs.append(await measure(rag, f"open/{rate:g}", load))
+    finally:
+        await rag.aclose()
+
+    for run in runs:
+        run["chunks"] = chunks
+        run["build_s"] = round(build_s, 3)
+    return runs
+
+
+async def run(args) -> dict:
+    # Both the blocking and the async OpenAI clients read these
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    embed_latency = latency_distribution(args.embed_latency, args.seed)
+    chat_latency = latency_distribution(args.chat_latency, args.seed + 1)
+    runs = list()
+    with FakeEmbeddingServer(dimensions=args.dimensions, latency=embed_latency,
+                             chat_latency=chat_latency) as server:
+        os.environ["OPENAI_BASE_URL"] = server.url
+        for chunks in args.chunks:
+            runs.extend(await bench_scale(args, chunks))
+            print(f"{chunks} chunks done", file=sys.stderr)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("command", "out")}
+    config["python"] = platform.python_version()
+    config["machine"] = platform.machine()
+    return {"config": config, "runs": runs}
+
+
+def compare(baseline: dict, current: dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    """Regressions of `current` against `baseline`: a stage percentile more
+    than `tolerance` (a fraction) and `min_delta_ms` slower, or throughput
+    more than `tolerance` lower. Runs only in one of them are skipped."""
+    base_runs = {(run["chunks"], run["run"]): run for run in baseline["runs"]}
+    regressions = list()
+    for run in current["runs"]:
+        key = (run["chunks"], run["run"])
+        base = base_runs.get(key)
+        if base is None:
+            continue
+        label = f"{key[0]} chunks {key[1]}"
+        if run["throughput_qps"] < base["throughput_qps"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {base['throughput_qps']} -> "
+                               f"{run['throughput_qps']} queries/s")
+        for stage, stats in run["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if base_stats is None:
+                continue
+            for p in PERCENTILES:
+                name = f"p{p}_ms"
+                old, new = base_stats[name], stats[name]
+                if new > old * (1 + tolerance) and new - old > min_delta_ms:
+                    regressions.append(f"{label}: {stage} {name} {old} -> {new}")
+    return regressions
+
+
 def main():
-    rag = RAGPipeline(dimensions=1536)
-    query_dict = dict()
-    query_dict[0] = "How does the RAG pipeline orchestrate the context retrieval?"
-    query_dict[1] = "What programming languages am I learning?"
-    query_dict[2] = "How do I convert a simple for loop in a one-liner comprehensive version in Python?"
-    query_dict[3] = "How does async relate to FFI?"
-    query_dict[4] = "How can I visit Mars?"
-
-    for i in range(5):
-        res = profile_query_components(rag, query_dict[i])
-        e_t = res["embed_time"]
-        s_t = res["search_time"]
-        r_t = res["retrieval_time"]
-        ll_t = res["llm_time"]
-        tt = res["total"]
-
-        print(f"Query {i}: {query_dict[i]}")
-        print(f"Embed query: {e_t}s")
-        print(f"Search:      {s_t}s")
-        print(f"Retrieve:    {r_t}s")
-        print(f"LLM gen:     {ll_t}s")
-        print(f"Total:       {tt}s")
-        print("============")
-    print(rag.embed_gen.get_cache_stats())
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="benchmark and write JSON results")
+    bench.add_argument("--chunks", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    bench.add_argument("--dimensions", type=int, default=256)
+    bench.add_argument("--chunk-words", type=int, default=80)
+    bench.add_argument("--queries", type=int, default=200, help="per run")
+    bench.add_argument("--top-k", type=int, default=6)
+    bench.add_argument("--concurrency", type=int, nargs="*", default=[1, 8, 64],
+                       help="closed-loop callers per run")
+    bench.add_argument("--rates", type=float, nargs="*", default=[20.0, 100.0],
+                       help="open-loop arrivals per second per run")
+    bench.add_argument("--embed-latency", default="lognormal:0.05:0.3",
+                       help="seconds, or uniform:LOW:HIGH, exp:MEAN, lognormal:MEDIAN:P99")
+    bench.add_argument("--chat-latency", default="lognormal:0.5:2.0")
+    bench.add_argument("--embedding-backend", default="openai", choices=["openai", "hashing"],
+                       help="openai: the fake server with --embed-latency; hashing: local")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--out", default="benchmark_results.json")
+
+    check = commands.add_parser("compare", help="flag regressions against a baseline")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    check.add_argument("--tolerance", type=float, default=0.10)
+    check.add_argument("--min-delta-ms", type=float, default=0.5,
+                       help="ignore slowdowns smaller than this")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        results = asyncio.run(run(args))
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        for result in results["runs"]:
+            total = result["stages"]["total"]
+            print(f"{result['chunks']:>8} chunks {result['run']:<12} "
+                  f"{result['throughput_qps']:>8} q/s  p50 {total['p50_ms']} ms  "
+                  f"p99 {total['p99_ms']} ms")
+        return
 
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.tolerance, args.min_delta_ms)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        sys.exit(1)
+    print("no regressions")
 
 
 if __name__ == "__main__":
-    profiler = cProfile.Profile()
-    profiler.enable()
     main()
-    profiler.disable()
-    stats = pstats.Stats(profiler)
-    stats.sort_stats('cumulative')
-    stats.print_stats(20)
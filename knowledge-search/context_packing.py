@@ -0,0 +1,145 @@
+"""Fit retrieved chunks into a token budget before they go into the prompt.
+
+Prompt tokens drive both the cost and the time to generate an answer, so
+instead of the top 6 chunks whatever their length, `pack_context` keeps
+some of those 6:
+
+1. drops near-duplicates: a chunk whose word 3-grams mostly appear in a
+   higher-ranked chunk adds nothing (overlapping sections, copied notes)
+2. always keeps the best hit, cut to the budget if it is longer, unless
+   not even its first word fits
+3. fills the rest of the budget greedily by similarity per token
+
+Token counts come from `count_tokens`, a local approximation of the chat
+model's BPE tokenizer. DocStore counts each chunk once when it is added.
+"""
+from typing import List, Optional, Sequence, Set
+import re
+
+# Tokens of retrieved context per prompt; ~6 typical chunks
+CONTEXT_TOKENS = 1500
+MAX_CONTEXT_CHUNKS = 6
+# Share of the smaller chunk's 3-grams found in the other that makes it a duplicate
+DUPLICATE_OVERLAP = 0.8
+
+# Pre-tokenizer splits like the GPT-4 family's: words with their leading
+# space, contractions, up to 3 digits, punctuation runs, whitespace. Words
+# come first since most pieces are words.
+_PIECE = re.compile(r" ?[^\W\d_]+|'(?:[sdmt]|ll|ve|re)| ?\d{1,3}| ?[^\s\w]+|\s+")
+# Common words are one token; longer pieces take about one per 4 characters
+_WHOLE_PIECE_CHARS = 7
+_CHARS_PER_TOKEN = 4
+
+
+def _piece_tokens(piece: str) -> int:
+    n = len(piece)
+    return 1 if n <= _WHOLE_PIECE_CHARS else -(-n // _CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str) -> int:
+    pieces = _PIECE.findall(text)
+    # One token per piece, plus the extra ones of long pieces
+    return len(pieces) + sum(_piece_tokens(piece) - 1 for piece in pieces
+                             if len(piece) > _WHOLE_PIECE_CHARS)
+
+
+def trim_to_tokens(text: str, budget: int) -> str:
+    """The longest prefix of `text` that `count_tokens` puts within `budget`"""
+    used = 0
+    for match in _PIECE.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > budget:
+            return text[:match.start()]
+    return text
+
+
+def shingles(text: str) -> Set[int]:
+    # Hashed word 3-grams of the chunk text; the "source: " prefix is shared by a note's chunks
+    words = text.partition(": ")[2].lower().split() or text.lower().split()
+    if len(words) < 3:
+        return {hash(tuple(words))}
+    return {hash(gram) for gram in zip(words, words[1:], words[2:])}
+
+
+def overlap(a: Set[int], b: Set[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+class PackedContext:
+    """The chunks chosen for one prompt, in rank order, and what packing saved"""
+
+    def __init__(self, id_text_pairs: List[tuple], tokens: int, unpacked_tokens: int,
+                 duplicates: int = 0):
+        self.id_text_pairs = id_text_pairs
+        self.tokens = tokens
+        # What the top MAX_CONTEXT_CHUNKS hits would have cost unpacked, the
+        # most `tokens` can be
+        self.unpacked_tokens = unpacked_tokens
+        self.duplicates = duplicates
+
+    @property
+    def doc_ids(self) -> List[int]:
+        return [doc_id for doc_id, _ in self.id_text_pairs]
+
+    @property
+    def texts(self) -> List[str]:
+        return [text for _, text in self.id_text_pairs]
+
+    def report(self, usage=None) -> dict:
+        """Token counts for a query result. `usage` is the chat response's,
+        which adds the prompt and answer tokens the API billed."""
+        report = {
+            "context_tokens": self.tokens,
+            "unpacked_context_tokens": self.unpacked_tokens,
+            "context_tokens_saved": self.unpacked_tokens - self.tokens,
+            "duplicates_removed": self.duplicates,
+        }
+        if usage is not None:
+            report["prompt_tokens"] = usage.prompt_tokens
+            report["completion_tokens"] = usage.completion_tokens
+        return report
+
+
+def pack_context(hits: Sequence[tuple], token_counts: Sequence[int],
+                 budget: Optional[int] = CONTEXT_TOKENS,
+                 max_chunks: int = MAX_CONTEXT_CHUNKS,
+                 duplicate_overlap: float = DUPLICATE_OVERLAP) -> PackedContext:
+    """Choose from the top `max_chunks` of `hits`, (doc_id, text, similarity)
+    best first, with each text's `token_counts`. A `budget` of None keeps
+    them unchanged. Only ever drops or cuts chunks, so it never costs more
+    than the unpacked context."""
+    if budget is not None and budget < 1:
+        raise ValueError(f"context budget must be at least 1 token, got {budget}")
+    hits = hits[:max_chunks]
+    unpacked = sum(token_counts[:max_chunks])
+    if budget is None or not hits:
+        return PackedContext([(doc_id, text) for doc_id, text, _ in hits], unpacked, unpacked)
+
+    distinct, seen = list(), list()
+    for i, (_, text, _) in enumerate(hits):
+        grams = shingles(text)
+        if all(overlap(grams, other) < duplicate_overlap for other in seen):
+            distinct.append(i)
+            seen.append(grams)
+
+    best = distinct[0]
+    doc_id, text, _ = hits[best]
+    tokens = token_counts[best]
+    if tokens > budget:
+        text = trim_to_tokens(text, budget)
+        tokens = count_tokens(text)
+    # An empty prompt context is no context; the caller answers without one
+    chosen = {best: (doc_id, text)} if text.strip() else dict()
+    used = tokens
+
+    # Greedy knapsack: the most similarity per token first
+    rest = sorted(distinct[1:], key=lambda i: -max(hits[i][2], 0.0) / max(token_counts[i], 1))
+    for i in rest:
+        if used + token_counts[i] <= budget:
+            chosen[i] = hits[i][:2]
+            used += token_counts[i]
+
+    return PackedContext([chosen[i] for i in sorted(chosen)], used, unpacked,
+                         len(hits) - len(distinct))
@@ -1,29 +1,259 @@
-from typing import List
+"""Compact document store, kept in lockstep with VectorStore indices.
+
+All document texts live in one contiguous UTF-8 buffer. An offsets array
+marks where each one starts and a source-id column points into a small
+table of source names, so a document costs ~17 bytes of overhead instead of
+a Python str and dict slot. Ids come from a counter and are never reused.
+Each document's token count (see `context_packing.count_tokens`) is taken
+once when it is added, so prompts can be packed without re-tokenizing.
+
+On disk the same columns are written back to back after a 64-byte header,
+so `DocStore.load(path, mmap=True)` maps the file and reads texts straight
+from the page cache:
+
+    offset  field
+    0       magic b"KSDOCS02"
+    8       count (u64)          documents, removed ones included
+    16      text_bytes (u64)
+    24      names_bytes (u64)    UTF-8 JSON list of source names
+    32      reserved (32 bytes)
+    64      offsets      int64[count + 1]
+            source_ids   int32[count]
+            token_counts int32[count]
+            removed      uint8[count], padded to 8 bytes
+            names        names_bytes
+            text         text_bytes
+
+Format 1 files, without token_counts, still load; their counts are taken
+on first use.
+"""
+from array import array
+from context_packing import count_tokens
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+from mmap import ACCESS_READ, mmap as MappedFile
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"KSDOCS02"
+MAGIC_V1 = b"KSDOCS01"
+HEADER = struct.Struct("<8sQQQ32x")
+
+
+class DocView(Mapping):
+    """Read-only `{doc_id: "source: text\\n"}` view over the live documents"""
+
+    def __init__(self, doc_store: "DocStore"):
+        self._doc_store = doc_store
+
+    def __getitem__(self, doc_id: int) -> str:
+        found = self._doc_store.get_document(doc_id)
+        if found is None:
+            raise KeyError(doc_id)
+        return found
+
+    def __iter__(self) -> Iterator[int]:
+        removed = self._doc_store._removed
+        return (doc_id for doc_id in range(len(removed)) if not removed[doc_id])
+
+    def __len__(self) -> int:
+        return len(self._doc_store)
+
+    def __contains__(self, doc_id) -> bool:
+        return self._doc_store.get_document(doc_id) is not None
 
 
 class DocStore():
     def __init__(self):
-        self.store = dict()
+        self._text = bytearray()
+        self._offsets = array('q', [0])
+        self._source_ids = array('i')
+        # None for a format 1 file until its counts are needed
+        self._token_counts = array('i')
+        self._removed = bytearray()
+        self._source_names: List[str] = list()
+        self._source_lookup = dict()
+        self._removed_count = 0
+        # Set while the columns are views into a mapped file
+        self._mapping: Optional[MappedFile] = None
 
-    def add_document(self, text: str, source_name: str):
-        next_key = None
-        if len(self.store) == 0:
-            next_key = 0
-        else:
-            next_key = list(self.store.keys())[-1] + 1
+    @property
+    def next_id(self) -> int:
+        return len(self._removed)
+
+    @property
+    def store(self) -> DocView:
+        return DocView(self)
+
+    def __len__(self) -> int:
+        return len(self._removed) - self._removed_count
+
+    def add_document(self, text: str, source_name: str) -> int:
+        return self.add_documents([text], [source_name])[0]
+
+    def add_documents(self, texts: Sequence[str], source_names: Sequence[str]) -> List[int]:
+        """Append documents in one go. Returns their ids, which match the
+        indices `VectorStore.add_many` assigns to the same batch."""
+        if len(texts) != len(source_names):
+            raise ValueError(
+                f"got {len(texts)} texts but {len(source_names)} source names")
+        self._make_owned()
 
-        self.store[next_key] = f"{source_name}: {text}\n"
-        return next_key
+        first = self.next_id
+        for text, source_name in zip(texts, source_names):
+            source_id = self._source_lookup.get(source_name)
+            if source_id is None:
+                source_id = len(self._source_names)
+                self._source_names.append(source_name)
+                self._source_lookup[source_name] = source_id
+            self._text += text.encode()
+            self._offsets.append(len(self._text))
+            self._source_ids.append(source_id)
+            self._token_counts.append(count_tokens(self._render_text(source_name, text)))
+        self._removed.extend(bytes(len(texts)))
+        return list(range(first, self.next_id))
+
+    def remove_document(self, doc_id: int) -> bool:
+        if not 0 <= doc_id < self.next_id or self._removed[doc_id]:
+            return False
+        self._removed[doc_id] = 1
+        self._removed_count += 1
+        return True
+
+    def is_removed(self, doc_id: int) -> bool:
+        return bool(self._removed[doc_id])
+
+    def removed_ids(self) -> List[int]:
+        return np.flatnonzero(np.frombuffer(self._removed, dtype=np.uint8)).tolist()
 
     def get_document(self, doc_id: int):
-        return self.store.get(doc_id)
-
-    def get_documents(self, doc_ids: List[int]):
-        results = list()
-        for id in doc_ids:
-            found = self.get_document(id)
-            if found is None:
-                continue
+        if not isinstance(doc_id, (int, np.integer)) or not 0 <= doc_id < self.next_id:
+            return None
+        if self._removed[doc_id]:
+            return None
+        return self._render(int(doc_id), self._offsets[doc_id], self._offsets[doc_id + 1])
+
+    def get_documents(self, doc_ids: Iterable[int]):
+        """Fetch many documents, skipping unknown and removed ids"""
+        if not isinstance(doc_ids, np.ndarray):
+            doc_ids = [i for i in doc_ids if isinstance(i, (int, np.integer))]
+        ids = np.asarray(doc_ids, dtype=np.int64)
+
+        # Validity and text bounds for the whole batch in one pass
+        ids = ids[(ids >= 0) & (ids < self.next_id)]
+        ids = ids[np.frombuffer(self._removed, dtype=np.uint8)[ids] == 0]
+        offsets = np.frombuffer(self._offsets, dtype=np.int64)
+        starts = offsets[ids]
+        ends = offsets[ids + 1]
+
+        return [self._render(doc_id, start, end)
+                for doc_id, start, end in zip(ids.tolist(), starts.tolist(), ends.tolist())]
+
+    def token_counts(self, doc_ids: Sequence[int]) -> List[int]:
+        """Tokens of each document as `get_document` renders it"""
+        if self._token_counts is None:
+            self._count_all_tokens()
+        return [int(self._token_counts[doc_id]) for doc_id in doc_ids]
+
+    def _count_all_tokens(self):
+        offsets = self._offsets
+        self._token_counts = array('i', (
+            count_tokens(self._render(doc_id, offsets[doc_id], offsets[doc_id + 1]))
+            for doc_id in range(self.next_id)))
+
+    def _render(self, doc_id: int, start: int, end: int) -> str:
+        source = self._source_names[self._source_ids[doc_id]]
+        return self._render_text(source, str(self._text[start:end], 'utf-8'))
+
+    @staticmethod
+    def _render_text(source: str, text: str) -> str:
+        return f"{source}: {text}\n"
+
+    def _make_owned(self):
+        # Copy-on-write: the first append after a mapped load copies the columns
+        if self._token_counts is None:
+            self._count_all_tokens()
+        if self._mapping is None:
+            return
+        self._text = bytearray(self._text)
+        self._offsets = array('q', self._offsets.tobytes())
+        self._source_ids = array('i', self._source_ids.tobytes())
+        self._token_counts = array('i', self._token_counts.tobytes())
+        self._mapping = None
+
+    def save(self, path: str):
+        # Write then rename so a crash never leaves a half-written file
+        names = json.dumps(self._source_names).encode()
+        count = self.next_id
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, count, len(self._text), len(names)))
+            f.write(np.asarray(self._offsets, dtype=np.int64).tobytes())
+            f.write(np.asarray(self._source_ids, dtype=np.int32).tobytes())
+            if self._token_counts is None:
+                self._count_all_tokens()
+            f.write(np.asarray(self._token_counts, dtype=np.int32).tobytes())
+            f.write(bytes(self._removed))
+            f.write(bytes(-count % 8))
+            f.write(names)
+            f.write(self._text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "DocStore":
+        """Open a store written by `save`. With `mmap` the text, offset and
+        source columns stay in the mapped file until the first append."""
+        with open(path, 'rb') as f:
+            if mmap:
+                raw = MappedFile(f.fileno(), 0, access=ACCESS_READ)
             else:
-                results.append(found)
-        return results
+                raw = f.read()
+
+        magic, count, text_bytes, names_bytes = HEADER.unpack_from(raw, 0)
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f"{path} is not a document store")
+        has_tokens = magic == MAGIC
+        layout, names_at = cls._layout(count, has_tokens)
+        text_at = names_at + names_bytes
+        if len(raw) != text_at + text_bytes:
+            raise ValueError(f"{path} is truncated or corrupt")
+
+        doc_store = cls()
+        offsets, source_ids, token_counts, removed = (
+            np.frombuffer(raw, dtype=dtype, count=n, offset=at) if at is not None else None
+            for dtype, n, at in layout)
+        doc_store._offsets = offsets
+        doc_store._source_ids = source_ids
+        doc_store._token_counts = token_counts
+        # Removals are rare and small; keep them writable
+        doc_store._removed = bytearray(removed.tobytes())
+        doc_store._removed_count = int(removed.sum())
+        doc_store._source_names = json.loads(bytes(raw[names_at:text_at]))
+        doc_store._source_lookup = {name: i for i, name in enumerate(doc_store._source_names)}
+        if mmap:
+            doc_store._text = memoryview(raw)[text_at:]
+            doc_store._mapping = raw
+        else:
+            doc_store._text = bytearray(raw[text_at:])
+            doc_store._offsets = array('q', offsets.tobytes())
+            doc_store._source_ids = array('i', source_ids.tobytes())
+            if has_tokens:
+                doc_store._token_counts = array('i', token_counts.tobytes())
+        return doc_store
+
+    @staticmethod
+    def _layout(count: int, has_tokens: bool = True) -> Tuple[list, int]:
+        offsets_at = HEADER.size
+        source_ids_at = offsets_at + 8 * (count + 1)
+        token_counts_at = source_ids_at + 4 * count if has_tokens else None
+        removed_at = source_ids_at + 4 * count * (2 if has_tokens else 1)
+        names_at = removed_at + count + (-count % 8)
+        layout = [(np.int64, count + 1, offsets_at),
+                  (np.int32, count, source_ids_at),
+                  (np.int32, count, token_counts_at),
+                  (np.uint8, count, removed_at)]
+        return layout, names_at
@@ -0,0 +1,224 @@
+"""Where embeddings come from.
+
+`EmbeddingGenerator` does the caching, deduplication and batching; a backend
+only turns one batch of texts into vectors:
+
+- `OpenAIBackend` calls the embeddings API (the default)
+- `HashingBackend` embeds locally and deterministically by feature hashing
+  character n-grams with NumPy. It needs no network or key, so large
+  synthetic vaults ingest at CPU speed for load tests and CI. Texts that
+  share spelling land close together, which is enough to exercise retrieval,
+  but it knows nothing of meaning.
+
+`make_backend` builds one from a config string, or from $EMBEDDING_BACKEND:
+"openai", "openai:text-embedding-3-large", "openai:text-embedding-3-small:512",
+"hashing" or "hashing:384".
+"""
+from abc import ABC, abstractmethod
+from openai import AsyncOpenAI, OpenAI, BadRequestError
+from metrics import DISABLED, Metrics
+from typing import List, Optional
+import asyncio
+import os
+import threading
+import numpy as np
+
+# Per-request limits of the embeddings endpoint
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
+
+OPENAI_MODEL = "text-embedding-3-small"
+HASHING_DIMENSIONS = 384
+BACKEND_ENV = "EMBEDDING_BACKEND"
+
+
+class EmbeddingBackend(ABC):
+    """Turns a batch of texts into vectors, in input order.
+
+    `model` names the vector space. `dimensions` is None when only the
+    model knows it."""
+
+    model: str
+    dimensions: Optional[int] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def cache_key(self) -> str:
+        """What the disk cache files vectors under: same key, same vectors"""
+        return self.model
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """`embed` on the event loop. Local backends compute in place."""
+        return self.embed(texts)
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+class OpenAIBackend(EmbeddingBackend):
+    def __init__(self, client: Optional[OpenAI] = None, model: str = OPENAI_MODEL,
+                 async_client: Optional[AsyncOpenAI] = None,
+                 dimensions: Optional[int] = None, metrics: Metrics = DISABLED):
+        # Pass a client to point at another endpoint, e.g. a local fake server.
+        # Either client is created on first use if not given.
+        super().__init__()
+        self._client = client
+        self._async_client = async_client
+        self.model = model
+        # Sent as the API's `dimensions` to shorten text-embedding-3 vectors
+        self.dimensions = dimensions
+        # Counts the tokens each response reports
+        self.metrics = metrics
+
+    @property
+    def cache_key(self) -> str:
+        # Shortened vectors differ from the full ones of the same model
+        return self.model if self.dimensions is None else f"{self.model}:{self.dimensions}"
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            self._client = OpenAI()
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI()
+        return self._async_client
+
+    @async_client.setter
+    def async_client(self, async_client: Optional[AsyncOpenAI]):
+        # None makes a new one on next use
+        self._async_client = async_client
+
+    def _options(self, texts: List[str]) -> dict:
+        options = {"input": texts, "model": self.model}
+        if self.dimensions is not None:
+            options["dimensions"] = self.dimensions
+        return options
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        try:
+            response = self.client.embeddings.create(**self._options(texts))
+        except BadRequestError:
+            # Over a limit the estimate missed: halve and retry. A single
+            # input that is still rejected is a real error.
+            if len(texts) == 1:
+                raise
+            mid = len(texts) // 2
+            return self.embed(texts[:mid]) + self.embed(texts[mid:])
+        finally:
+            self._count_request()
+
+        return self._embeddings(response)
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        try:
+            response = await self.async_client.embeddings.create(**self._options(texts))
+        except BadRequestError:
+            if len(texts) == 1:
+                raise
+            mid = len(texts) // 2
+            halves = await asyncio.gather(self.aembed(texts[:mid]), self.aembed(texts[mid:]))
+            return halves[0] + halves[1]
+        finally:
+            self._count_request()
+
+        return self._embeddings(response)
+
+    def _embeddings(self, response) -> List[List[float]]:
+        if response.usage is not None:
+            self.metrics.count("embedding_tokens", response.usage.total_tokens)
+        # The API tags each embedding with its input position
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in ordered]
+
+
+class HashingBackend(EmbeddingBackend):
+    """Feature hashing of the character n-grams of each lowercased text.
+
+    Every n-gram of the UTF-8 bytes, for each n in `ngrams`, hashes to a
+    dimension and a sign. Counts are damped with log1p and the vector is
+    scaled to unit length. A batch is hashed in a few NumPy passes over all
+    its bytes at once, and the same text embeds to the same vector in any
+    process or on any machine.
+    """
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS, ngrams: tuple = (3, 4, 5)):
+        if dimensions < 1:
+            raise ValueError("dimensions must be at least 1")
+        if not ngrams or min(ngrams) < 1:
+            raise ValueError("ngrams must be positive lengths")
+        super().__init__()
+        self.dimensions = dimensions
+        self.ngrams = tuple(sorted(ngrams))
+        self.model = f"hashing-{'-'.join(map(str, self.ngrams))}-{dimensions}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self._count_request()
+        return self.embed_array(texts).tolist()
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """float32 array of shape (len(texts), dimensions)"""
+        # A space on each side so a text's first and last words get n-grams of their own
+        encoded = [f" {text.lower()} ".encode() for text in texts]
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        owner = np.repeat(np.arange(len(texts)), lengths)
+        counts = np.zeros(len(texts) * self.dimensions)
+
+        for n in self.ngrams:
+            if len(data) < n:
+                continue
+            starts = len(data) - n + 1
+            # Polynomial hash of each window; uint64 arithmetic wraps
+            h = np.full(starts, n, dtype=np.uint64)
+            for k in range(n):
+                h = h * np.uint64(0x100000001B3) + data[k:k + starts]
+            h = _mix(h)
+            # Windows that run into the next text belong to neither
+            inside = owner[:starts] == owner[n - 1:]
+            buckets = (h % np.uint64(self.dimensions)).astype(np.int64)
+            signs = np.where(h >> np.uint64(63), -1.0, 1.0)
+            counts += np.bincount(owner[:starts][inside] * self.dimensions + buckets[inside],
+                                  weights=signs[inside], minlength=len(counts))
+
+        vectors = counts.reshape(len(texts), self.dimensions)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer: spreads every input bit over the high and low bits
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def make_backend(spec: Optional[str] = None, dimensions: Optional[int] = None,
+                 **openai_options) -> EmbeddingBackend:
+    """Backend named by `spec`, or by $EMBEDDING_BACKEND when None (default
+    "openai"). "hashing" without a size takes `dimensions`, so it fits the
+    store it feeds. `openai_options` (client, async_client, metrics) go to
+    OpenAIBackend."""
+    spec = spec or os.environ.get(BACKEND_ENV, "openai")
+    kind, _, rest = spec.partition(":")
+    if kind == "hashing":
+        if rest:
+            dimensions = int(rest)
+        return HashingBackend(dimensions or HASHING_DIMENSIONS)
+    if kind == "openai":
+        model, _, size = rest.partition(":")
+        return OpenAIBackend(model=model or OPENAI_MODEL,
+                             dimensions=int(size) if size else None, **openai_options)
+    raise ValueError(f"unknown embedding backend {spec!r}, expected 'openai' or 'hashing'")
@@ -0,0 +1,147 @@
+"""Persistent embedding cache shared across runs and processes.
+
+Embeddings live in a SQLite file keyed by sha256(model + normalized text) and
+stored as raw float32 blobs (6 KB for a 1536-dim vector). The database runs in
+WAL mode, so any number of threads and processes can read while one writes;
+each thread gets its own connection. When the stored vectors exceed
+`max_bytes`, the least recently used ones are evicted.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Evict down to this fraction of the cap so every insert near the cap
+# doesn't pay for an eviction pass
+EVICT_TO = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key BLOB PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), nbytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS embeddings_added AFTER INSERT ON embeddings BEGIN
+    UPDATE totals SET nbytes = nbytes + NEW.nbytes WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS embeddings_removed AFTER DELETE ON embeddings BEGIN
+    UPDATE totals SET nbytes = nbytes - OLD.nbytes WHERE id = 0;
+END;
+"""
+
+
+def cache_key(model: str, norm_text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{norm_text}".encode()).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 timeout: float = 30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL survives process crashes; a lost tail after a power
+            # failure only costs re-embedding those texts
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, model: str, norm_text: str) -> Optional[List[float]]:
+        return self.get_many(model, [norm_text]).get(norm_text)
+
+    def get_many(self, model: str, norm_texts: Iterable[str]) -> Dict[str, List[float]]:
+        keys = {cache_key(model, text): text for text in norm_texts}
+        if not keys:
+            return {}
+
+        conn = self._connect()
+        found = dict()
+        key_list = list(keys)
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk)
+            for key, blob in rows:
+                found[keys[key]] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, cache_key(model, text)) for text in found])
+        return found
+
+    def put(self, model: str, norm_text: str, vector: List[float]):
+        self.put_many(model, [(norm_text, vector)])
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]):
+        now = time.time()
+        rows = list()
+        for norm_text, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((cache_key(model, norm_text), model, blob, len(blob), now))
+        if not rows:
+            return
+
+        conn = self._connect()
+        with conn:
+            # Same key means same text and model, so an existing vector is kept
+            conn.executemany(
+                "INSERT INTO embeddings VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET last_used = excluded.last_used",
+                rows)
+            if self._total_bytes(conn) > self.max_bytes:
+                self._evict(conn)
+
+    def _total_bytes(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT nbytes FROM totals WHERE id = 0").fetchone()[0]
+
+    def _evict(self, conn: sqlite3.Connection):
+        excess = self._total_bytes(conn) - int(self.max_bytes * EVICT_TO)
+        rows = conn.execute(
+            "SELECT key, nbytes FROM embeddings ORDER BY last_used")
+        doomed = list()
+        for key, nbytes in rows:
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= nbytes
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+
+    def size_bytes(self) -> int:
+        return self._total_bytes(self._connect())
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM embeddings")
+
+    def close(self):
+        # Closes this thread's connection; other threads close theirs on exit
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -1,58 +1,321 @@
-from openai import OpenAI
-from typing import List
+from openai import AsyncOpenAI, OpenAI
+from embedding_backends import (MAX_BATCH_INPUTS, MAX_BATCH_TOKENS, OPENAI_MODEL,
+                                EmbeddingBackend, OpenAIBackend)
+from embedding_cache import EmbeddingCache
+from metrics import DISABLED, Metrics
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+import asyncio
 import re
+import sys
+import threading
+
+# A 1536-dim vector held as a list of Python floats is ~49 KB
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+FLOAT_BYTES = sys.getsizeof(0.0)
+
+
+def estimate_tokens(text: str) -> int:
+    # English averages ~4 chars per token; 3 keeps code and markup under the limit
+    return len(text) // 3 + 1
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by the memory its keys and vectors take up.
+
+    `max_entries` optionally caps the entry count as well.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 max_entries: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry_bytes(key: str, vector: List[float]) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(vector) + len(vector) * FLOAT_BYTES
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, vector: List[float]):
+        nbytes = self.entry_bytes(key, vector)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (vector, nbytes)
+            self.bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        # Never evicts the entry just added, even if it alone is over budget
+        while len(self._data) > 1 and (
+                self.bytes > self.max_bytes
+                or (self.max_entries is not None and len(self._data) > self.max_entries)):
+            _, (_, nbytes) = self._data.popitem(last=False)
+            self.bytes -= nbytes
+            self.evictions += 1
+
+    def resize(self, max_bytes: Optional[int] = None, max_entries: Optional[int] = None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self.max_entries = max_entries
+            self._evict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        # Membership checks don't count as a use
+        return key in self._data
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._data)
 
 
 class EmbeddingGenerator:
-    def __init__(self):
-        self.client = OpenAI()
-        self.cache = {}
+    def __init__(self, client: Optional[OpenAI] = None,
+                 model: str = OPENAI_MODEL,
+                 max_batch_inputs: int = MAX_BATCH_INPUTS,
+                 max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 disk_cache: Optional[EmbeddingCache] = None,
+                 cache_max_bytes: int = DEFAULT_CACHE_BYTES,
+                 async_client: Optional[AsyncOpenAI] = None,
+                 metrics: Metrics = DISABLED,
+                 backend: Optional[EmbeddingBackend] = None):
+        # Without a backend, embeds through the OpenAI API with `client`,
+        # `async_client` and `model`; pass a client to point at another
+        # endpoint, e.g. a local fake server. See embedding_backends.
+        self.backend = backend or OpenAIBackend(client, model, async_client, metrics=metrics)
+        # Shared with other runs and processes; checked after the in-memory cache
+        self.disk_cache = disk_cache
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.cache = LRUCache(cache_max_bytes)
+        # Times each API request and counts cache hits, misses and tokens
+        self.metrics = metrics
+        # Counters and the in-flight table are shared by worker threads
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
         self.cache_hits = 0
         self.cache_misses = 0
-        self.cache_max_size = 100
-
-    def embed_text(self, text: str) -> List[float]:
-        if not text or text.isspace():
-            raise ValueError("Text cannot be empty or whitespace")
+        self.disk_hits = 0
+        self.coalesced = 0
 
-        norm_text = self._normalize_text(text)
+    @property
+    def model(self) -> str:
+        return self.backend.model
 
-        if norm_text in self.cache: 
-            self.cache_hits += 1
-            return self.cache[norm_text]
+    @property
+    def dimensions(self) -> Optional[int]:
+        return self.backend.dimensions
 
-        response = self.client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
+    @property
+    def client(self) -> OpenAI:
+        """The OpenAI backend's client"""
+        return self.backend.client
 
-        embed_vector = response.data[0].embedding 
+    @property
+    def requests_sent(self) -> int:
+        return self.backend.requests
 
-        self.cache[norm_text] = embed_vector
-        self.cache_misses += 1
+    @property
+    def cache_max_size(self) -> Optional[int]:
+        """Optional cap on cached entries, on top of the byte budget"""
+        return self.cache.max_entries
 
-        if len(self.cache) > self.cache_max_size:
-            # Remove oldest entry 
-            self.cache.pop(next(iter(self.cache)))
+    @cache_max_size.setter
+    def cache_max_size(self, max_entries: Optional[int]):
+        self.cache.resize(max_entries=max_entries)
 
-        return embed_vector
+    def embed_text(self, text: str) -> List[float]:
+        return self.embed_batch([text])[0]
 
     def _normalize_text(self, text: str) -> str:
         return re.sub(r'\s+', ' ', text.lower().strip())
 
     def get_cache_stats(self) -> dict:
         stats = dict()
-        stats["hits"] = self.cache_hits
-        stats["misses"] = self.cache_misses
+        with self._lock:
+            stats["hits"] = self.cache_hits
+            stats["misses"] = self.cache_misses
+            stats["disk_hits"] = self.disk_hits
+            # Hits served by waiting on another caller's in-flight request
+            stats["coalesced"] = self.coalesced
+        stats["requests"] = self.requests_sent
         stats["size"] = len(self.cache)
+        stats["bytes"] = self.cache.bytes
+        stats["max_bytes"] = self.cache.max_bytes
+        stats["evictions"] = self.cache.evictions
         return stats
 
 
     def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        # OpenAI API can embed multiple texts in one call (more efficient)
-        embeds = list()
+        """Embed many texts with as few requests as the API limits allow.
+
+        Texts in the memory or disk cache are served from there; the rest are
+        deduplicated and sent in multi-input requests packed up to
+        `max_batch_inputs` inputs and `max_batch_tokens` estimated tokens.
+        A text another thread is already embedding waits for that request
+        instead of sending its own. Results come back in input order.
+        """
+        keys, found, owned, waiting = self._claim(texts)
+
+        try:
+            self._embed_owned(owned, found)
+        except BaseException as exc:
+            self._fail(owned, exc)
+            raise
+        finally:
+            self._release(owned)
+
+        for key, future in waiting.items():
+            found[key] = future.result()
 
+        # Read back from `found`, not the cache: the batch may not fit in it
+        return [found[key] for key in keys]
+
+    async def aembed_text(self, text: str) -> List[float]:
+        return (await self.aembed_batch([text]))[0]
+
+    async def aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        """`embed_batch` for the event loop: requests go through `async_client`
+        and waiting on another caller's in-flight request doesn't block the loop.
+        Shares caches and in-flight requests with the blocking path."""
+        keys, found, owned, waiting = self._claim(texts)
+
+        try:
+            await self._aembed_owned(owned, found)
+        except BaseException as exc:
+            self._fail(owned, exc)
+            raise
+        finally:
+            self._release(owned)
+
+        for key, future in waiting.items():
+            found[key] = await asyncio.wrap_future(future)
+
+        return [found[key] for key in keys]
+
+    def _claim(self, texts: List[str]) -> tuple:
+        """Split texts into cached, to-embed (owned by this call) and already
+        in flight elsewhere. Owned keys get an in-flight Future others can wait on."""
         for text in texts:
-            embeds.append(self.embed_text(text))
+            if not text or text.isspace():
+                raise ValueError("Text cannot be empty or whitespace")
+
+        keys = [self._normalize_text(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        owned: Dict[str, str] = {}  # normalized key -> first raw text
+        waiting: Dict[str, Future] = {}
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in found or key in owned or key in waiting:
+                    # Repeats inside one batch count as hits, as they would one at a time
+                    self.cache_hits += 1
+                    continue
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.cache_hits += 1
+                    found[key] = cached
+                elif key in self._inflight:
+                    self.cache_hits += 1
+                    self.coalesced += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    owned[key] = text
+                    self._inflight[key] = Future()
+        self.metrics.count("embedding_cache_hit", len(texts) - len(owned))
+        return keys, found, owned, waiting
+
+    def _fail(self, owned: Dict[str, str], exc: BaseException):
+        for key in owned:
+            if not self._inflight[key].done():
+                self._inflight[key].set_exception(exc)
+
+    def _release(self, owned: Dict[str, str]):
+        with self._lock:
+            for key in owned:
+                self._inflight.pop(key, None)
+
+    def _embed_owned(self, owned: Dict[str, str], found: Dict[str, List[float]]):
+        for batch in self._pending_batches(owned, found):
+            self._store_batch(batch, self._request_embeddings(batch), found)
+
+    async def _aembed_owned(self, owned: Dict[str, str], found: Dict[str, List[float]]):
+        batches = self._pending_batches(owned, found)
+        results = await asyncio.gather(*(self._arequest_embeddings(batch) for batch in batches))
+        for batch, embeds in zip(batches, results):
+            self._store_batch(batch, embeds, found)
+
+    def _pending_batches(self, owned: Dict[str, str], found: Dict[str, List[float]]) -> List[List[tuple]]:
+        """Resolve what the disk cache has; batch the rest for the API"""
+        pending = dict(owned)
+
+        if self.disk_cache is not None and pending:
+            # A local SQLite lookup: quick enough to run on the event loop too
+            stored = self.disk_cache.get_many(self.backend.cache_key, pending)
+            with self._lock:
+                self.disk_hits += len(stored)
+            for key, vector in stored.items():
+                self._resolve(key, vector, found)
+                del pending[key]
+
+        return self._token_budgeted_batches(list(pending.items()))
+
+    def _store_batch(self, batch: List[tuple], embeds: List[List[float]],
+                     found: Dict[str, List[float]]):
+        if self.disk_cache is not None:
+            self.disk_cache.put_many(self.backend.cache_key, zip([key for key, _ in batch], embeds))
+        with self._lock:
+            self.cache_misses += len(batch)
+        self.metrics.count("embedding_cache_miss", len(batch))
+        for (key, _), vector in zip(batch, embeds):
+            self._resolve(key, vector, found)
+
+    def _resolve(self, key: str, vector: List[float], found: Dict[str, List[float]]):
+        # Cache before waking waiters so later callers hit the cache instead
+        self.cache.put(key, vector)
+        found[key] = vector
+        self._inflight[key].set_result(vector)
+
+    def _token_budgeted_batches(self, items: List[tuple]) -> List[List[tuple]]:
+        batches = list()
+        batch = list()
+        batch_tokens = 0
+
+        for item in items:
+            tokens = estimate_tokens(item[1])
+            if batch and (len(batch) >= self.max_batch_inputs
+                          or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch = list()
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _request_embeddings(self, batch: List[tuple]) -> List[List[float]]:
+        with self.metrics.time("embedding_request"):
+            return self.backend.embed([text for _, text in batch])
 
-        return embeds
+    async def _arequest_embeddings(self, batch: List[tuple]) -> List[List[float]]:
+        with self.metrics.time("embedding_request"):
+            return await self.backend.aembed([text for _, text in batch])
@@ -1,7 +1,10 @@
 from dataclasses import dataclass 
-from typing import List
-from rag_pipeline import RAGPipeline
+from typing import List, Optional, Sequence
+from rag_pipeline import CHAT_MODEL, RAGPipeline
 from obsidian_ingestion import debug_query_with_ids, ObsidianIngestion
+import asyncio
+import re
+import numpy as np
 
 
 @dataclass
@@ -89,24 +92,33 @@ GROUND_TRUTH = [
     ), 
 ]
 
+# Cutoffs reported by run_evaluation; retrieval goes as deep as the largest
+DEFAULT_KS = (1, 3, 6, 10, 20)
+JUDGE_PROMPT = """Rate how well the answer addresses the question using only the context.
+Reply with a single digit from 1 (wrong or unsupported) to 5 (complete and supported).
+
+Question: {question}
+
+Context:
+{context}
+
+Answer: {answer}"""
+
+
 def evaluate_precision_at_k(
     retrieved_chunk_ids: List[int],
     relevant_chunk_ids: List[int],
     k: int
 ) -> float:
     """
-    Calculate Precision@k
+    Calculate Precision@k over the first k retrieved ids
     Returns: float between 0.0 and 1.0
     """
-    relevant = 0.0
     if len(relevant_chunk_ids) == 0:
-        return relevant
-
-    for id in retrieved_chunk_ids:
-        if id in relevant_chunk_ids:
-            relevant += 1.0
-
-    return relevant / (k * 1.0)
+        return 0.0
+    relevant = set(relevant_chunk_ids)
+    hits = sum(1 for id in retrieved_chunk_ids[:k] if id in relevant)
+    return hits / k
 
 def evaluate_recall_at_k(
     retrieved_chunk_ids: List[int],
@@ -114,18 +126,14 @@ def evaluate_recall_at_k(
     k: int
 ) -> float:
     """
-    Calculate Recall@k
+    Calculate Recall@k over the first k retrieved ids
     Returns: float between 0.0 and 1.0
     """
-    relevant = 0.0
     if len(relevant_chunk_ids) == 0:
-        return relevant
-
-    for id in retrieved_chunk_ids:
-        if id in relevant_chunk_ids:
-            relevant += 1.0
-
-    return relevant / len(relevant_chunk_ids)
+        return 0.0
+    relevant = set(relevant_chunk_ids)
+    hits = sum(1 for id in retrieved_chunk_ids[:k] if id in relevant)
+    return hits / len(relevant)
 
 def evaluate_rr(
     retrieved_chunk_ids: List[int],
@@ -135,63 +143,149 @@ def evaluate_rr(
     Calculate Mean Reciprocal Rank for single query
     Returns: float between 0.0 and 1.0
     """
-    for id in retrieved_chunk_ids:
-        if id in relevant_chunk_ids:
-            rank = retrieved_chunk_ids.index(id) + 1
+    relevant = set(relevant_chunk_ids)
+    for rank, id in enumerate(retrieved_chunk_ids, start=1):
+        if id in relevant:
             return 1.0 / rank
 
     return 0.0
 
+def evaluate_ndcg_at_k(
+    retrieved_chunk_ids: List[int],
+    relevant_chunk_ids: List[int],
+    k: int
+) -> float:
+    """
+    Calculate nDCG@k with binary relevance
+    Returns: float between 0.0 and 1.0
+    """
+    return retrieval_scores(retrieved_chunk_ids, relevant_chunk_ids, [k])[f"ndcg@{k}"]
+
+
+def retrieval_scores(
+    retrieved_chunk_ids: List[int],
+    relevant_chunk_ids: List[int],
+    ks: Sequence[int]
+) -> dict:
+    """
+    P@k, R@k and nDCG@k for every k in one pass over the ranking, plus RR
+    Returns: dict like {"precision@6": ..., "recall@6": ..., "ndcg@6": ..., "rr": ...}
+    """
+    relevant = set(relevant_chunk_ids)
+    depth = max(ks)
+    hits = np.array([id in relevant for id in retrieved_chunk_ids[:depth]], dtype=bool)
+    hits = np.pad(hits, (0, depth - len(hits)))
+    cumulative = np.cumsum(hits)
+    # Discount of rank r is 1 / log2(r + 1)
+    discounts = 1.0 / np.log2(np.arange(2, depth + 2))
+    dcg = np.cumsum(hits * discounts)
+    ideal = np.cumsum(discounts)
+
+    scores = dict()
+    for k in ks:
+        if not relevant:
+            # Nothing can be found for a query whose answer is not in the vault
+            scores[f"precision@{k}"] = scores[f"recall@{k}"] = scores[f"ndcg@{k}"] = 0.0
+            continue
+        scores[f"precision@{k}"] = float(cumulative[k - 1]) / k
+        scores[f"recall@{k}"] = float(cumulative[k - 1]) / len(relevant)
+        scores[f"ndcg@{k}"] = float(dcg[k - 1] / ideal[min(len(relevant), k) - 1])
+    first = np.flatnonzero(hits)
+    scores["rr"] = 1.0 / (first[0] + 1) if len(first) else 0.0
+    return scores
+
+
+def retrieve_rankings(rag: RAGPipeline, test_queries: List[TestQuery], depth: int) -> List[List[int]]:
+    """Chunk ids ranked for every query: one batched embedding call and one
+    `search_many` pass, with no chat completion"""
+    embeds = rag.embed_gen.embed_batch([tq.query for tq in test_queries])
+    block = np.asarray(embeds, dtype=np.float32)
+    indices, _ = rag.vec_store.search_many(block, depth, as_numpy=True)
+    return indices.tolist()
+
+
+async def judge_answers(rag: RAGPipeline, test_queries: List[TestQuery],
+                        top_k: int = 20) -> List[Optional[int]]:
+    """Answer every query and have the chat model grade each answer from 1
+    to 5, all queries at once. None where no grade could be read."""
+    async def judge(tq: TestQuery) -> Optional[int]:
+        result = await rag.aquery(tq.query, top_k=top_k)
+        prompt = JUDGE_PROMPT.format(question=tq.query, answer=result["answer"],
+                                     context="\n\n".join(result["context"]))
+        response = await rag.async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        grade = re.search(r"[1-5]", response.choices[0].message.content or "")
+        return int(grade.group()) if grade else None
+
+    return await asyncio.gather(*(judge(tq) for tq in test_queries))
+
 
 def run_evaluation(
     rag: RAGPipeline,
     test_queries: List[TestQuery],
-    k: int = 6
+    k: int = 6,
+    ks: Sequence[int] = DEFAULT_KS,
+    judge: bool = False,
+    verbose: bool = True
 ) -> dict:
     """
-    Run full evaluation across all test queries
-    Returns: dict with average metrics
+    Run full evaluation across all test queries.
+
+    Retrieval is scored without generating answers: the queries are embedded
+    in one batch and searched in one pass, `max(ks)` deep. With `judge=True`
+    every query is also answered and graded by the chat model, concurrently.
+    Returns: dict with average metrics; "precision@k", "recall@k" and "mrr"
+    are at `k`, and each metric is also reported at every cutoff in `ks`.
+    Raises ValueError for an empty `test_queries`, which has nothing to average
     """
-    # Loop through test queries
-    # For each: run RAG query, calculate P@k, R@k, MRR
-    # Return averages
-    evals = dict.fromkeys(["precision@k", "recall@k", "mrr"])
-
-    all_rr_scores = [] 
-    all_prcs_scores = []
-    all_recall_scores = []
-
-    for i, tq in enumerate(test_queries):
-        query_num = i + 1
-
-        result = rag.query(tq.query, top_k=20)
-        retrieved_ids = result["chunk_ids"]
-
-        rr = evaluate_rr(retrieved_ids, tq.relevant_chunk_ids)
-        prcs_k = evaluate_precision_at_k(retrieved_ids, tq.relevant_chunk_ids, k)
-        recall_k = evaluate_recall_at_k(retrieved_ids, tq.relevant_chunk_ids, k)
-
-        print(f"Query {query_num}: {tq.query}")
-        print(f"Precision@{k}: {prcs_k}")
-        print(f"Recall@{k}: {recall_k}")
-        print(f"Individual RR: {rr}")
-        print()
-
-        all_rr_scores.append(rr)
-        all_prcs_scores.append(prcs_k)
-        all_recall_scores.append(recall_k)
-
-    evals["precision@k"] = sum(all_prcs_scores) / len(all_prcs_scores)
-    evals["recall@k"] = sum(all_recall_scores) / len(all_recall_scores)
-    evals["mrr"] = sum(all_rr_scores) / len(all_rr_scores)
-    print("=== === === === ===")
+    if not test_queries:
+        raise ValueError("run_evaluation needs at least one test query")
+    ks = sorted(set(ks) | {k})
+    rankings = retrieve_rankings(rag, test_queries, max(ks))
+    per_query = [retrieval_scores(ranking, tq.relevant_chunk_ids, ks)
+                 for ranking, tq in zip(rankings, test_queries)]
+
+    if verbose:
+        for query_num, (tq, scores) in enumerate(zip(test_queries, per_query), start=1):
+            print(f"Query {query_num}: {tq.query}")
+            print(f"Precision@{k}: {scores[f'precision@{k}']}")
+            print(f"Recall@{k}: {scores[f'recall@{k}']}")
+            print(f"Individual RR: {scores['rr']}")
+            print()
+
+    evals = {name: sum(scores[name] for scores in per_query) / len(per_query)
+             for name in per_query[0]}
+    evals["precision@k"] = evals[f"precision@{k}"]
+    evals["recall@k"] = evals[f"recall@{k}"]
+    evals["mrr"] = evals.pop("rr")
+
+    if judge:
+        async def judge_all():
+            # The pipeline makes a connection pool for this loop; close it
+            # with the loop. It stays usable: the next loop gets a new pool.
+            try:
+                return await judge_answers(rag, test_queries)
+            finally:
+                await rag.aclose()
+        grades = [g for g in asyncio.run(judge_all()) if g is not None]
+        evals["judge_score"] = sum(grades) / len(grades) if grades else None
+    if verbose:
+        print("=== === === === ===")
     return evals
 
 
 if __name__ == "__main__":
-    rag = RAGPipeline(dimensions=1536)
-    ingestion = ObsidianIngestion(rag)
-    ingestion.ingest_directory("/Users/hectorcryo/Documents/Knowledge Engineering Vault/Knowledge-Engineering/")
+    index_dir = "index"
+    embedding_cache = "embedding_cache.sqlite"
+    if RAGPipeline.has_index(index_dir):
+        rag = RAGPipeline.load(index_dir, embedding_cache=embedding_cache)
+    else:
+        rag = RAGPipeline(dimensions=1536, embedding_cache=embedding_cache)
+        ingestion = ObsidianIngestion(rag)
+        ingestion.ingest_directory("/Users/hectorcryo/Documents/Knowledge Engineering Vault/Knowledge-Engineering/")
+        rag.save(index_dir)
 
     evaluations = run_evaluation(rag, GROUND_TRUTH)
     print(evaluations)
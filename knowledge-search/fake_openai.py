@@ -0,0 +1,252 @@
+"""Local stand-in for the OpenAI embeddings and chat endpoints.
+
+Serves POST /v1/embeddings and /v1/chat/completions on a background thread so tests and benchmarks can
+exercise EmbeddingGenerator without network access or an API key. Vectors are
+seeded from a hash of the input text, so the same text always embeds to the
+same vector. Requests over the input or token limits get a 400, like the real
+API. Chat completions answer with a fixed message after `chat_latency`
+seconds, standing in for generation time. With `stream=True` the answer is
+sent word by word as server-sent events, spread over `chat_latency`.
+Either latency may also be a function returning seconds, drawn per request;
+`latency_distribution` builds seeded ones for reproducible benchmarks.
+
+    with FakeEmbeddingServer() as server:
+        gen = EmbeddingGenerator(client=server.client())
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openai import AsyncOpenAI, OpenAI
+from typing import Callable, List, Union
+import base64
+import hashlib
+import itertools
+import json
+import math
+import threading
+import time
+import numpy as np
+
+
+CHAT_ANSWER = "Answer from the fake server."
+# z-score of the 99th percentile of a standard normal
+Z_99 = 2.326
+
+Latency = Union[float, Callable[[], float]]
+
+
+class _Server(ThreadingHTTPServer):
+    # Benchmarks open hundreds of connections at once; the default backlog is 5
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def fake_embedding(text: str, dimensions: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def latency_distribution(spec: str, seed: int = 0) -> Callable[[], float]:
+    """Seconds per request from a spec: `0.05` (constant), `uniform:LOW:HIGH`,
+    `exp:MEAN` or `lognormal:MEDIAN:P99`, the last a long-tailed stand-in
+    for API latency. Draws are seeded, so a run can be repeated."""
+    kind, _, params = spec.partition(":")
+    if not params:
+        seconds = float(kind)
+        return lambda: seconds
+    args = [float(p) for p in params.split(":")]
+    rng = np.random.default_rng(seed)
+    # Server threads draw concurrently; Generator is not thread-safe
+    lock = threading.Lock()
+
+    if kind == "uniform" and len(args) == 2:
+        draw = lambda: rng.uniform(args[0], args[1])
+    elif kind == "exp" and len(args) == 1:
+        draw = lambda: rng.exponential(args[0])
+    elif kind == "lognormal" and len(args) == 2:
+        median, p99 = args
+        if not 0 < median <= p99:
+            raise ValueError(f"lognormal needs 0 < median <= p99, got {spec!r}")
+        sigma = math.log(p99 / median) / Z_99
+        draw = lambda: rng.lognormal(math.log(median), sigma)
+    else:
+        raise ValueError(f"unknown latency distribution {spec!r}")
+
+    def sample() -> float:
+        with lock:
+            return float(draw())
+    return sample
+
+
+def _chat_usage(body: dict) -> dict:
+    # Same rough tokenizer as the embeddings endpoint
+    prompt = sum(len(message["content"]) // 4 + 1 for message in body["messages"])
+    completion = len(CHAT_ANSWER) // 4 + 1
+    return {"prompt_tokens": prompt, "completion_tokens": completion,
+            "total_tokens": prompt + completion}
+
+
+def _seconds(latency: Latency) -> float:
+    return latency() if callable(latency) else latency
+
+
+class FakeEmbeddingServer:
+    def __init__(self, dimensions: int = 1536, max_inputs: int = 2048,
+                 max_tokens: int = 300_000, latency: Latency = 0.0,
+                 chat_latency: Latency = 0.0):
+        self.dimensions = dimensions
+        # Seconds each request takes, to make overlapping requests observable
+        self.latency = latency
+        self.chat_latency = chat_latency
+        self.chat_requests = 0
+        # Requests being handled right now, and the most there have been at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        # Inputs of every request received, in arrival order
+        self.requests: List[List[str]] = list()
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def client(self) -> OpenAI:
+        return OpenAI(api_key="fake-key", base_url=self.url, max_retries=0)
+
+    def async_client(self, **kwargs) -> AsyncOpenAI:
+        return AsyncOpenAI(api_key="fake-key", base_url=self.url, max_retries=0, **kwargs)
+
+    def start(self) -> "FakeEmbeddingServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeEmbeddingServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _embed(self, body: dict) -> tuple:
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        with self._lock:
+            self.requests.append(list(inputs))
+        seconds = _seconds(self.latency)
+        if seconds:
+            time.sleep(seconds)
+
+        # Rough tokenizer: one token per 4 characters
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        if len(inputs) > self.max_inputs or tokens > self.max_tokens:
+            error = {"message": f"{len(inputs)} inputs / {tokens} tokens over the request limit",
+                     "type": "invalid_request_error"}
+            return 400, {"error": error}
+
+        data = list()
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, self.dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        usage = {"prompt_tokens": tokens, "total_tokens": tokens}
+        return 200, {"object": "list", "data": data, "model": body["model"], "usage": usage}
+
+    def _chat(self, body: dict) -> tuple:
+        with self._lock:
+            self.chat_requests += 1
+        seconds = _seconds(self.chat_latency)
+        if seconds:
+            time.sleep(seconds)
+        message = {"role": "assistant", "content": CHAT_ANSWER}
+        choice = {"index": 0, "message": message, "finish_reason": "stop"}
+        usage = _chat_usage(body)
+        return 200, {"id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                     "model": body["model"], "choices": [choice], "usage": usage}
+
+    def _chat_stream(self, body: dict):
+        """Yields the chunk payloads of a streamed answer, pacing them out"""
+        with self._lock:
+            self.chat_requests += 1
+        words = CHAT_ANSWER.split(" ")
+        pieces = [word + " " for word in words[:-1]] + [words[-1]]
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body["model"]}
+        seconds = _seconds(self.chat_latency)
+
+        yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                    "finish_reason": None}]}
+        for piece in pieces:
+            if seconds:
+                time.sleep(seconds / len(pieces))
+            yield {**base, "choices": [{"index": 0, "delta": {"content": piece},
+                                        "finish_reason": None}]}
+        yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if body.get("stream_options", {}).get("include_usage"):
+            yield {**base, "choices": [], "usage": _chat_usage(body)}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled clients reuse their connections
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    self._route()
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _route(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length))
+                if self.path.rstrip("/").endswith("/embeddings"):
+                    status, payload = server._embed(body)
+                elif self.path.rstrip("/").endswith("/chat/completions"):
+                    if body.get("stream"):
+                        self._send_events(server._chat_stream(body))
+                        return
+                    status, payload = server._chat(body)
+                else:
+                    status, payload = 404, {"error": {"message": f"no route {self.path}"}}
+
+                encoded = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def _send_events(self, payloads):
+                # Server-sent events over chunked encoding, flushed per event
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                events = (f"data: {json.dumps(p)}\n\n" for p in payloads)
+                for event in itertools.chain(events, ["data: [DONE]\n\n"]):
+                    data = event.encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,177 @@
+"""Stage timings and event counts, exported as Prometheus text or JSON lines.
+
+Timings go into fixed-bucket histograms. An observation is one bisect and
+two increments under a lock, and memory stays the same however much traffic
+there is. `DISABLED`, the default everywhere, records nothing. Its `time`
+returns one shared do-nothing context manager, so a hook costs a method call.
+
+    metrics = Metrics()
+    rag = RAGPipeline(dimensions=1536, metrics=metrics)
+    rag.query("How does WASM work?")
+    print(metrics.to_prometheus())
+"""
+from bisect import bisect_left
+from contextlib import nullcontext
+from numbers import Integral
+from typing import Dict, List
+import json
+import threading
+import time
+
+
+def exponential_buckets(start: float, factor: float, count: int) -> List[float]:
+    return [start * factor ** i for i in range(count)]
+
+
+# 10µs to ~170s, two buckets per doubling: quantiles are within ~20%
+DEFAULT_BUCKETS = exponential_buckets(1e-5, 2 ** 0.5, 49)
+DEFAULT_PREFIX = "knowledge_search"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Counts per bucket; the last bucket is everything above the top bound.
+    Not locked: `Metrics` serialises access."""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolating linearly inside the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """Seconds per stage and totals per event, shared by every thread and
+    task that records into it"""
+
+    enabled = True
+
+    def __init__(self, buckets: List[float] = DEFAULT_BUCKETS, prefix: str = DEFAULT_PREFIX):
+        self.buckets = sorted(buckets)
+        self.prefix = prefix
+        self.histograms: Dict[str, Histogram] = dict()
+        self.counters: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    def time(self, stage: str):
+        """Context manager recording the seconds its block takes"""
+        return _Timer(self, stage)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, event: str, amount: float = 1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def summary(self) -> dict:
+        """Count, total and estimated quantiles per stage, plus the counters"""
+        with self._lock:
+            stages = {
+                stage: {"count": h.count, "sum_s": h.sum,
+                        **{f"p{round(q * 100)}_s": h.quantile(q) for q in QUANTILES}}
+                for stage, h in self.histograms.items()
+            }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format: a `<prefix>_stage_seconds`
+        histogram labelled by stage and a `<prefix>_events_total` counter
+        labelled by event"""
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent per pipeline stage.",
+                 f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+
+            name = f"{self.prefix}_events_total"
+            lines += [f"# HELP {name} Pipeline events, e.g. cache hits and tokens.",
+                      f"# TYPE {name} counter"]
+            for event, value in sorted(self.counters.items()):
+                lines.append(f'{name}{{event="{event}"}} {_sample(value)}')
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self) -> str:
+        """One JSON object per stage and per event, stamped with the time"""
+        now = time.time()
+        summary = self.summary()
+        lines = [json.dumps({"ts": now, "stage": stage, **stats})
+                 for stage, stats in sorted(summary["stages"].items())]
+        lines += [json.dumps({"ts": now, "event": event, "value": value})
+                  for event, value in sorted(summary["counters"].items())]
+        return "".join(line + "\n" for line in lines)
+
+
+def _sample(value: float) -> str:
+    # Exact: token counts run past the 6 significant digits of `:g`
+    return str(int(value)) if isinstance(value, Integral) else repr(float(value))
+
+
+class DisabledMetrics(Metrics):
+    """Records nothing"""
+
+    enabled = False
+    _NO_TIMER = nullcontext()
+
+    def time(self, stage: str):
+        return self._NO_TIMER
+
+    def observe(self, stage: str, seconds: float):
+        pass
+
+    def count(self, event: str, amount: float = 1):
+        pass
+
+
+DISABLED = DisabledMetrics()
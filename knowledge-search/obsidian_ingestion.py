@@ -1,118 +1,425 @@
 from mistletoe.block_token import Heading, CodeFence
 from mistletoe.span_token import RawText
 from mistletoe import Document
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 from tqdm import tqdm
-from rag_pipeline import RAGPipeline, is_useful_chunk
+from rag_pipeline import RAGPipeline, is_useful_chunk, note_attributes
+from metrics import DISABLED, Metrics
 from pathlib import Path
-from concurrent.futures.thread import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
 import threading
+import hashlib
+import queue
+import re
+import time
 
+# Ingestion runs in threads, and forking a threaded process can deadlock
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+# Obsidian inline tags: `#rust`, `#week-15/day-2`; headings need a space after `#`
+TAG_PATTERN = re.compile(r"(?<![^\s(])#([\w/-]*[^\W\d][\w/-]*)")
 
-def walk_tree(node):
+
+def note_tags(text: str) -> List[str]:
+    """Distinct inline tags of a note, lowercased, in order of appearance"""
+    return list(dict.fromkeys(tag.lower() for tag in TAG_PATTERN.findall(text)))
+
+
+def walk_tree(node) -> str:
+    parts: List[str] = list()
+    _collect_text(node, parts)
+    # One join at the end instead of re-copying the text at every level
+    return "".join(parts)
+
+
+def _collect_text(node, parts: List[str]):
     if isinstance(node, RawText):
-        return node.content + "\n"
+        parts.append(node.content)
+        parts.append("\n")
+        return
 
-    text = ""
     children = getattr(node, 'children', None)
-    
+
     if children is not None:  # Explicit None check for type checker
         if isinstance(node, CodeFence):
-            text += node.language + "\n"
+            parts.append(node.language)
+            parts.append("\n")
         for child in children:  # Use the variable, not node.children
-            text += walk_tree(child)
-
-    return text
+            _collect_text(child, parts)
 
 
 class MarkdownChunker:
     """Chunks markdown files by heading boundaries"""
 
+    def __init__(self, split_levels: Tuple[int, ...] = (2,)):
+        # A chunk starts at every heading of these levels
+        self.split_levels = split_levels
+
     def chunk_file(self, filepath: str) -> List[str]:
         # Parse with mistletoe
         # Walk AST
         # Split at headings
         # Return list of text chunks
         with open(filepath, 'r') as f:
-            doc = Document(f)
+            return self.chunk_text(f.read())
+
+    def chunk_files(self, filepaths: List[str], processes: Optional[int] = None) -> Iterator[Tuple[str, List[str]]]:
+        """Chunk many files across a process pool, yielding (filepath, chunks)
+        in input order. Parsing is pure Python, so threads would not help."""
+        with ProcessPoolExecutor(processes, mp_context=POOL_CONTEXT) as executor:
+            yield from zip(filepaths, executor.map(self.chunk_file, filepaths, chunksize=8))
+
+    def chunk_text(self, text: str) -> List[str]:
+        doc = Document(text)
 
         chunks = list()
-        chunk = ""
+        parts: List[str] = list()
 
         children = getattr(doc, 'children', None)
         if children is None:
             return []
 
+        def flush():
+            chunk = "".join(parts)
+            if len(chunk.strip()) > 40:
+                chunks.append(chunk)
+            parts.clear()
 
         for node in children:
-            if isinstance(node, Heading) and node.level == 1:
-                chunk += walk_tree(node)
-                continue
-
-            if isinstance(node, Heading) and node.level == 2:
-                if len(chunk.strip()) > 40:
-                    chunks.append(chunk)
-                chunk = walk_tree(node)
-            else:
-                chunk += walk_tree(node)
-        if len(chunk.strip()) > 40:
-            chunks.append(chunk)
+            if isinstance(node, Heading) and node.level in self.split_levels:
+                flush()
+            _collect_text(node, parts)
+        flush()
         return chunks
 
 
+class FileJob:
+    """One vault file moving through the ingestion stages"""
+
+    def __init__(self, key: str, name: str, record: Optional[dict],
+                 retire: List[int], text: Optional[str] = None):
+        self.key = key
+        self.name = name
+        # Manifest entry to commit once every chunk has landed; None for deleted files
+        self.record = record
+        # Chunk ids from the previous version, retired when this one lands
+        self.retire = retire
+        self.text = text
+        self.chunks: List[str] = list()
+        self.remaining = 0
+        # (position in chunks, chunk, embedding) held back until the whole
+        # file is embedded; batches can finish out of order
+        self.staged: List[tuple] = list()
+
+
+class StageStats:
+    """Items processed and time spent working (not waiting on queues).
+    Each unit of work is also timed into `metrics` as `ingest_<name>`."""
+
+    def __init__(self, name: str, metrics: Metrics = DISABLED):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.metrics = metrics
+        self._lock = threading.Lock()
+
+    def record(self, items: int, started: float):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.items += items
+            self.busy += elapsed
+        self.metrics.observe(f"ingest_{self.name}", elapsed)
+        self.metrics.count(f"ingest_{self.name}_items", items)
+
+    def as_dict(self) -> dict:
+        return {"items": self.items, "busy_s": round(self.busy, 4),
+                "items_per_s": round(self.items / self.busy, 1) if self.busy else None}
+
+
+class PipelineStopped(Exception):
+    pass
+
+
 class ObsidianIngestion:
-    def __init__(self, rag_pipeline: RAGPipeline):
+    def __init__(self, rag_pipeline: RAGPipeline, batch_size: int = 100,
+                 embed_workers: int = 4, queue_size: int = 8,
+                 flush_after: float = 0.5, chunk_processes: Optional[int] = None):
         self.rag = rag_pipeline
         self.chunker = MarkdownChunker()
+        # Chunks per embeddings request, and the most requests in flight at once
+        self.batch_size = batch_size
+        self.embed_workers = embed_workers
+        # Bound on every inter-stage queue, which caps memory regardless of vault size
+        self.queue_size = queue_size
+        # Seconds an idle batcher waits before sending a partial batch
+        self.flush_after = flush_after
+        # Parse notes in this many worker processes; None parses on the chunk thread
+        self.chunk_processes = chunk_processes
 
     def ingest_directory(self, vault_path: str) -> dict:
-        stuff = Path(vault_path).rglob('*.md')
+        """Bring the index in line with the vault.
+
+        Files stream through bounded queues: discover -> chunk -> filter ->
+        embed -> add. Each file is searchable as soon as its last chunk is
+        embedded, and memory stays flat however big the vault is.
+
+        Only new and changed files are chunked and embedded; chunks of
+        changed and deleted files are retired once their replacement has
+        landed. `rag.manifest` records each file's mtime, size, content hash
+        and chunk ids between runs. A file's chunks go into the stores
+        together with its manifest entry, so a run that fails leaves no
+        chunks behind that the manifest does not know about.
+        """
         res_dict = dict.fromkeys(
-            ["files_processed", "chunks_created", "embeddings_generated"], 0)
-        all_chunks = list()
-        source_files = list()
+            ["files_processed", "files_unchanged", "files_removed",
+             "chunks_created", "chunks_retired", "embeddings_generated"], 0)
+        stages = {name: StageStats(name, self.rag.metrics)
+                  for name in ["discover", "chunk", "filter", "embed", "add"]}
+        stop = threading.Event()
+        errors: List[BaseException] = list()
+        files_q = queue.Queue(self.queue_size)
+        chunked_q = queue.Queue(self.queue_size)
+        filtered_q = queue.Queue(self.queue_size)
+        batches_q = queue.Queue(self.queue_size)
+        embedded_q = queue.Queue(self.queue_size)
+
+        def run(stage, *args):
+            try:
+                stage(*args)
+            except PipelineStopped:
+                pass
+            except BaseException as exc:
+                errors.append(exc)
+                stop.set()
+
+        stage_args = [
+            ("discover", self._discover, Path(vault_path), files_q, res_dict, stages["discover"]),
+            ("chunk", self._chunk, files_q, chunked_q, res_dict, stages["chunk"]),
+            ("filter", self._filter, chunked_q, filtered_q, stages["filter"]),
+            ("batch", self._batch, filtered_q, batches_q),
+        ]
+        stage_args += [("embed", self._embed, batches_q, embedded_q, stages["embed"])] * self.embed_workers
+        threads = [threading.Thread(target=run, name=f"ingest-{name}", args=(stage, *args, stop))
+                   for name, stage, *args in stage_args]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Stores are only touched from this thread
+            self._add(embedded_q, res_dict, stages["add"], stop)
+        except BaseException as exc:
+            errors.append(exc)
+            stop.set()
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        res_dict["stages"] = {name: stats.as_dict() for name, stats in stages.items()}
+        return res_dict
 
-        for file in stuff:
-            path_name = Path(file)
-            file_chunks = self.chunker.chunk_file(str(path_name))
-            res_dict["chunks_created"] += len(file_chunks)
-            res_dict["files_processed"] += 1 
+    def _discover(self, vault: Path, out: queue.Queue, res_dict: dict,
+                  stats: StageStats, stop: threading.Event):
+        # Snapshot: the add stage updates the manifest while this runs
+        known = dict(self.rag.manifest)
+        seen = set()
+
+        for file in sorted(vault.rglob('*.md')):
+            started = time.perf_counter()
+            key = file.relative_to(vault).as_posix()
+            seen.add(key)
+            stat = file.stat()
+            entry = known.get(key)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                res_dict["files_unchanged"] += 1
+                stats.record(1, started)
+                continue
 
-            all_chunks.extend(file_chunks)
-            source_files.extend([path_name.name] * len(file_chunks))
+            raw = file.read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()
+            if entry and entry["sha256"] == digest:
+                # Touched but not edited: keep the chunks, refresh the stat
+                entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+                res_dict["files_unchanged"] += 1
+                stats.record(1, started)
+                continue
+
+            text = raw.decode()
+            record = {"mtime": stat.st_mtime, "size": stat.st_size,
+                      "sha256": digest, "tags": note_tags(text), "chunk_ids": []}
+            retire = entry["chunk_ids"] if entry else []
+            res_dict["files_processed"] += 1
+            stats.record(1, started)
+            _put(out, FileJob(key, file.name, record, retire, text), stop)
+
+        # Deleted files flow through as jobs with nothing to chunk
+        for key in known.keys() - seen:
+            _put(out, FileJob(key, key, None, known[key]["chunk_ids"]), stop)
+        _put(out, None, stop)
+
+    def _chunk(self, inp: queue.Queue, out: queue.Queue, res_dict: dict,
+               stats: StageStats, stop: threading.Event):
+        def emit(job: FileJob, chunks: List[str], started: float):
+            job.chunks = chunks
+            job.text = None
+            res_dict["chunks_created"] += len(chunks)
+            stats.record(len(chunks), started)
+            _put(out, job, stop)
+
+        if not self.chunk_processes:
+            while (job := _get(inp, stop)) is not None:
+                started = time.perf_counter()
+                emit(job, self.chunker.chunk_text(job.text) if job.text is not None else [], started)
+            _put(out, None, stop)
+            return
+
+        # Up to queue_size files parse at once; results leave in vault order
+        pending = deque()
+        with ProcessPoolExecutor(self.chunk_processes, mp_context=POOL_CONTEXT) as executor:
+            while (job := _get(inp, stop)) is not None:
+                future = executor.submit(self.chunker.chunk_text, job.text) if job.text is not None else None
+                pending.append((job, future))
+                while pending and (len(pending) >= self.queue_size or pending[0][1] is None
+                                   or pending[0][1].done()):
+                    started = time.perf_counter()
+                    job, future = pending.popleft()
+                    emit(job, future.result() if future else [], started)
+            while pending:
+                started = time.perf_counter()
+                job, future = pending.popleft()
+                emit(job, future.result() if future else [], started)
+        _put(out, None, stop)
+
+    def _filter(self, inp: queue.Queue, out: queue.Queue, stats: StageStats,
+                stop: threading.Event):
+        while (job := _get(inp, stop)) is not None:
+            started = time.perf_counter()
+            total = len(job.chunks)
+            job.chunks = [c for c in job.chunks if c and c.strip() and is_useful_chunk(c)]
+            job.remaining = len(job.chunks)
+            stats.record(total, started)
+            _put(out, job, stop)
+        _put(out, None, stop)
+
+    def _batch(self, inp: queue.Queue, out: queue.Queue, stop: threading.Event):
+        """Regroup per-file chunks into fixed-size embedding batches.
+
+        A batch is a list of (job, position, chunk) with the chunk's position
+        in `job.chunks`; a job with no useful chunks rides along as
+        (job, None, None) so the add stage can still commit it.
+        """
+        batch = list()
+        while True:
+            try:
+                job = _get(inp, stop, timeout=self.flush_after)
+            except queue.Empty:
+                # Upstream is slow: send what we have so it becomes searchable
+                if batch:
+                    _put(out, batch, stop)
+                    batch = list()
+                continue
+            if job is None:
+                break
+            if not job.chunks:
+                batch.append((job, None, None))
+            for position, chunk in enumerate(job.chunks):
+                batch.append((job, position, chunk))
+                if len(batch) >= self.batch_size:
+                    _put(out, batch, stop)
+                    batch = list()
+        if batch:
+            _put(out, batch, stop)
+        for _ in range(self.embed_workers):
+            _put(out, None, stop)
+
+    def _embed(self, inp: queue.Queue, out: queue.Queue, stats: StageStats,
+               stop: threading.Event):
+        while (batch := _get(inp, stop)) is not None:
+            started = time.perf_counter()
+            texts = [chunk for _, _, chunk in batch if chunk is not None]
+            embeds = self.rag.embed_gen.embed_batch(texts) if texts else []
+            stats.record(len(texts), started)
+            _put(out, (batch, embeds), stop)
+        _put(out, None, stop)
+
+    def _add(self, inp: queue.Queue, res_dict: dict, stats: StageStats,
+             stop: threading.Event):
+        manifest = self.rag.manifest
+        finished_workers = 0
+        with tqdm(unit="chunk") as pbar:
+            while finished_workers < self.embed_workers:
+                item = _get(inp, stop)
+                if item is None:
+                    finished_workers += 1
+                    continue
+                started = time.perf_counter()
+                batch, embeds = item
+                pairs = [(job, position, chunk) for job, position, chunk in batch
+                         if chunk is not None]
+                for (job, position, chunk), embed in zip(pairs, embeds):
+                    job.staged.append((position, chunk, embed))
+                    job.remaining -= 1
+                res_dict["embeddings_generated"] += len(pairs)
+
+                # Files whose last chunk is in this batch land whole
+                done = [job for job in {id(job): job for job, _, _ in batch}.values()
+                        if not job.remaining]
+                # Each file's chunks get ids in the order they appear in it
+                staged = [(job, chunk, embed) for job in done
+                          for _, chunk, embed in sorted(job.staged, key=lambda item: item[0])]
+                if staged:
+                    # One FFI call per batch instead of one per chunk
+                    with self.rag.metrics.time("vector_add"):
+                        self.rag.vec_store.add_many(
+                            [embed for _, _, embed in staged],
+                            [note_attributes(job.key, job.record) for job, _, _ in staged])
+                    ids = self.rag.doc_store.add_documents(
+                        [chunk for _, chunk, _ in staged], [job.name for job, _, _ in staged])
+                    for (job, _, _), doc_id in zip(staged, ids):
+                        job.record["chunk_ids"].append(doc_id)
+
+                for job in done:
+                    job.staged = list()
+                    self.rag.remove_documents(job.retire)
+                    res_dict["chunks_retired"] += len(job.retire)
+                    if job.record is None:
+                        manifest.pop(job.key, None)
+                        res_dict["files_removed"] += 1
+                    else:
+                        manifest[job.key] = job.record
+                stats.record(len(pairs), started)
+                pbar.update(len(pairs))
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    # Blocks while the queue is full, but gives up once another stage failed
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event, timeout: Optional[float] = None):
+    """Next item, or queue.Empty once `timeout` passes with nothing to read"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+        if wait <= 0:
+            raise queue.Empty()
+        try:
+            return q.get(timeout=wait)
+        except queue.Empty:
+            continue
 
-        res_dict["embeddings_generated"] = len(all_chunks)
-        self._batch_embed_and_add(all_chunks, source_files)
-        return res_dict
 
-    def _batch_embed_and_add(self, chunks: List[str], source_files: List[str]):
-        valid_chunks = [c for c in chunks if c and c.strip() and is_useful_chunk(c)]
-        valid_sources = [source_files[i] for i in range(
-            len(chunks)) if chunks[i] and chunks[i].strip()]
-
-        if len(valid_chunks) < len(chunks):
-            print(f"Filtered out {len(chunks) -
-                  len(valid_chunks)} empty chunks")
-
-        n = 20
-        split_list = [valid_chunks[i:i + n]
-                      for i in range(0, len(valid_chunks), n)]
-        split_sources = [valid_sources[i:i + n]
-                         for i in range(0, len(valid_sources), n)]
-
-        with tqdm(total=len(valid_chunks)) as pbar:
-            with ThreadPoolExecutor() as executor:
-                print(f"Starting {len(split_list)} batches across 5 threads")
-                all_embeddings = list(executor.map(self.rag.embed_gen.embed_batch, split_list))
-                print(f"Completed all batches")
-
-                for batch_embeddings, sources, chunks in zip(all_embeddings, split_sources, split_list):
-                    for embedding, source, chunk in zip(batch_embeddings, sources, chunks):
-                        self.rag.vec_store.add(embedding)        # Fast: 40µs
-                        self.rag.doc_store.add_document(chunk, source)
-                        pbar.update(1)
-
-    
 def debug_query_with_ids(rag: RAGPipeline, query: str, top_k: int = 6) -> list:
     """Helper to see chunk IDs and their content for ground truth creation"""
     embedded_question = rag.embed_gen.embed_text(query)
@@ -0,0 +1,273 @@
+"""Offline sweep of retrieval settings against GROUND_TRUTH.
+
+Every chunking of the vault is embedded once, through the on-disk embedding
+cache, as are the test queries. After that no setting touches the API:
+worker processes rebuild the store for each combination of chunk filter
+thresholds, heading levels, top_k and hybrid weights, then score it like
+`evaluation.run_evaluation`. Each setting reports quality, search latency
+and the memory its vectors and texts take. Settings that no other beats on
+all three form the Pareto front.
+
+GROUND_TRUTH names chunk ids of the saved index. Under a different chunking,
+a chunk counts as relevant when it comes from the same note and contains, or
+is contained in, one of those chunks.
+
+    python parameter_sweep.py VAULT --split-levels 2 2,3 --min-chars 40 100 150 \
+        --top-k 6 10 --hybrid off rrf 0.5 --out sweep.json
+"""
+from dataclasses import asdict, dataclass
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from knowledge_search import Bm25Index, VectorStore, hybrid_search
+from docstore import DocStore
+from embeddings import EmbeddingGenerator
+from embedding_backends import make_backend
+from embedding_cache import EmbeddingCache
+from evaluation import GROUND_TRUTH, TestQuery, retrieval_scores
+from obsidian_ingestion import POOL_CONTEXT, MarkdownChunker
+from rag_pipeline import (DOCS_FILE, MAX_BULLET_FRACTION, MIN_ALPHA_CHARS,
+                          MIN_CHUNK_CHARS, is_useful_chunk)
+import argparse
+import json
+import re
+import time
+import numpy as np
+
+# Quality measures a sweep can rank by; each is averaged at the setting's top_k
+OBJECTIVES = ("ndcg", "recall", "precision", "mrr")
+
+
+@dataclass(frozen=True)
+class SweepConfig:
+    split_levels: Tuple[int, ...] = (2,)
+    min_chars: int = MIN_CHUNK_CHARS
+    max_bullet_fraction: float = MAX_BULLET_FRACTION
+    min_alpha: int = MIN_ALPHA_CHARS
+    top_k: int = 6
+    # None for vector search alone, "rrf", or "weighted" with `alpha`
+    fusion: Optional[str] = None
+    alpha: float = 0.5
+
+
+class Chunking:
+    """One chunking of the vault: texts, the notes they came from, their
+    embeddings, and per test query the chunks that count as relevant"""
+
+    def __init__(self, texts: List[str], sources: List[str], embeddings: np.ndarray,
+                 relevant: List[Set[int]]):
+        self.texts = texts
+        self.sources = sources
+        self.embeddings = embeddings
+        self.relevant = relevant
+
+
+def chunk_vault(vault: Path, split_levels: Tuple[int, ...]) -> Tuple[List[str], List[str]]:
+    chunker = MarkdownChunker(split_levels)
+    texts, sources = list(), list()
+    for file in sorted(vault.rglob("*.md")):
+        for chunk in chunker.chunk_text(file.read_text()):
+            texts.append(chunk)
+            sources.append(file.name)
+    return texts, sources
+
+
+def ground_truth_texts(doc_store: DocStore, test_queries: Sequence[TestQuery]) -> List[List[tuple]]:
+    """(note, text) of every relevant chunk of each query, from the saved index"""
+    truth = list()
+    for tq in test_queries:
+        pairs = list()
+        for document in doc_store.get_documents(tq.relevant_chunk_ids):
+            source, _, text = document.partition(": ")
+            pairs.append((source, _normalize(text)))
+        truth.append(pairs)
+    return truth
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def relevant_chunks(texts: List[str], sources: List[str],
+                    truth: List[List[tuple]]) -> List[Set[int]]:
+    by_source: Dict[str, List[int]] = dict()
+    for i, source in enumerate(sources):
+        by_source.setdefault(source, []).append(i)
+    normalized = [_normalize(text) for text in texts]
+
+    relevant = list()
+    for pairs in truth:
+        matches = set()
+        for source, text in pairs:
+            for i in by_source.get(source, []):
+                if text in normalized[i] or normalized[i] in text:
+                    matches.add(i)
+        relevant.append(matches)
+    return relevant
+
+
+def prepare(vault: Path, embed_gen: EmbeddingGenerator, split_levels: Sequence[Tuple[int, ...]],
+            test_queries: Sequence[TestQuery], truth: List[List[tuple]]) -> tuple:
+    """Chunk and embed the vault once per heading setting, and embed the queries"""
+    chunkings = dict()
+    for levels in split_levels:
+        texts, sources = chunk_vault(vault, levels)
+        embeddings = np.asarray(embed_gen.embed_batch(texts), dtype=np.float32)
+        chunkings[levels] = Chunking(texts, sources, embeddings,
+                                     relevant_chunks(texts, sources, truth))
+    queries = [tq.query for tq in test_queries]
+    query_vectors = np.asarray(embed_gen.embed_batch(queries), dtype=np.float32)
+    return chunkings, queries, query_vectors
+
+
+# Set in each worker by _init_worker, so the embeddings are sent once per process
+_chunkings: Dict[Tuple[int, ...], Chunking] = dict()
+_queries: List[str] = list()
+_query_vectors: Optional[np.ndarray] = None
+
+
+def _init_worker(chunkings: Dict[Tuple[int, ...], Chunking], queries: List[str],
+                 query_vectors: np.ndarray):
+    global _chunkings, _queries, _query_vectors
+    _chunkings, _queries, _query_vectors = chunkings, queries, query_vectors
+
+
+def evaluate_config(config: SweepConfig) -> dict:
+    chunking = _chunkings[config.split_levels]
+    kept = [i for i, text in enumerate(chunking.texts)
+            if is_useful_chunk(text, config.min_chars, config.max_bullet_fraction,
+                               config.min_alpha)]
+    dimensions = chunking.embeddings.shape[1]
+    store = VectorStore(dimensions)
+    keywords = Bm25Index()
+    if kept:
+        store.add_many(chunking.embeddings[kept])
+        if config.fusion is not None:
+            keywords.add_many([chunking.texts[i] for i in kept])
+
+    per_query, latencies = list(), list()
+    for question, vector, relevant in zip(_queries, _query_vectors, chunking.relevant):
+        started = time.perf_counter()
+        if not kept:
+            hits = []
+        elif config.fusion is None:
+            hits = [r.index for r in store.search(vector, config.top_k)]
+        else:
+            hits = [r.index for r in hybrid_search(store, keywords, vector, question, config.top_k,
+                                                   fusion=config.fusion, alpha=config.alpha)]
+        latencies.append(time.perf_counter() - started)
+        ranking = [kept[hit] for hit in hits]
+        per_query.append(retrieval_scores(ranking, relevant, [config.top_k]))
+
+    k = config.top_k
+    quality = {name: float(np.mean([scores[f"{name}@{k}"] for scores in per_query]))
+               for name in ("precision", "recall", "ndcg")}
+    quality["mrr"] = float(np.mean([scores["rr"] for scores in per_query]))
+    text_bytes = sum(len(chunking.texts[i].encode()) for i in kept)
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "config": asdict(config),
+        "chunks": len(kept),
+        **quality,
+        "search_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "search_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "memory_mb": (len(kept) * dimensions * 4 + text_bytes) / 1e6,
+    }
+
+
+def pareto_front(results: List[dict], objective: str) -> List[dict]:
+    """Results no other result matches or beats on quality, latency and
+    memory while beating it on at least one"""
+    def dominates(a: dict, b: dict) -> bool:
+        no_worse = (a[objective] >= b[objective] and a["search_p50_ms"] <= b["search_p50_ms"]
+                    and a["memory_mb"] <= b["memory_mb"])
+        better = (a[objective] > b[objective] or a["search_p50_ms"] < b["search_p50_ms"]
+                  or a["memory_mb"] < b["memory_mb"])
+        return no_worse and better
+    return [r for r in results if not any(dominates(other, r) for other in results)]
+
+
+def run_sweep(vault: str, embed_gen: EmbeddingGenerator, configs: List[SweepConfig],
+              test_queries: Sequence[TestQuery], truth: List[List[tuple]],
+              processes: Optional[int] = None, objective: str = "ndcg") -> List[dict]:
+    """Score every config; the best by `objective` first. Results on the
+    Pareto front have "pareto": True. `processes=1` runs in this process."""
+    split_levels = sorted({config.split_levels for config in configs})
+    state = prepare(Path(vault), embed_gen, split_levels, test_queries, truth)
+
+    if processes == 1:
+        _init_worker(*state)
+        results = [evaluate_config(config) for config in configs]
+    else:
+        with ProcessPoolExecutor(processes, mp_context=POOL_CONTEXT,
+                                 initializer=_init_worker, initargs=state) as executor:
+            results = list(executor.map(evaluate_config, configs))
+
+    front = {id(r) for r in pareto_front(results, objective)}
+    for result in results:
+        result["pareto"] = id(result) in front
+    return sorted(results, key=lambda r: (-r[objective], r["search_p50_ms"], r["memory_mb"]))
+
+
+def grid(split_levels: Sequence[Tuple[int, ...]], min_chars: Sequence[int],
+         max_bullet_fractions: Sequence[float], min_alphas: Sequence[int],
+         top_ks: Sequence[int], hybrids: Sequence[str]) -> List[SweepConfig]:
+    """Every combination. A hybrid setting is "off", "rrf" or a weighted
+    fusion's alpha, e.g. "0.5"."""
+    fusions = [(None, 0.5) if h == "off" else ("rrf", 0.5) if h == "rrf" else ("weighted", float(h))
+               for h in hybrids]
+    return [SweepConfig(levels, chars, bullets, alpha_chars, k, fusion, alpha)
+            for levels, chars, bullets, alpha_chars, k, (fusion, alpha)
+            in product(split_levels, min_chars, max_bullet_fractions, min_alphas, top_ks, fusions)]
+
+
+def format_table(results: List[dict], objective: str) -> str:
+    header = (f"{'':1} {objective:>6} {'P50 ms':>8} {'MB':>8} {'chunks':>6}  "
+              f"levels  min_chars  bullets  min_alpha  top_k  hybrid")
+    lines = [header]
+    for r in results:
+        c = r["config"]
+        hybrid = "off" if c["fusion"] is None else "rrf" if c["fusion"] == "rrf" else f"w{c['alpha']:g}"
+        lines.append(
+            f"{'*' if r['pareto'] else ' ':1} {r[objective]:6.3f} {r['search_p50_ms']:8.3f} "
+            f"{r['memory_mb']:8.2f} {r['chunks']:6}  {','.join(map(str, c['split_levels'])):<6}  "
+            f"{c['min_chars']:>9}  {c['max_bullet_fraction']:>7g}  {c['min_alpha']:>9}  "
+            f"{c['top_k']:>5}  {hybrid}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("vault")
+    parser.add_argument("--index", default="index", help="saved index GROUND_TRUTH refers to")
+    parser.add_argument("--embedding-cache", default="embedding_cache.sqlite")
+    parser.add_argument("--embedding-backend", default=None,
+                        help='"openai[:MODEL]" or "hashing[:DIMS]"; default $EMBEDDING_BACKEND or openai')
+    parser.add_argument("--split-levels", nargs="+", default=["2"],
+                        help="heading levels that start a chunk, comma separated")
+    parser.add_argument("--min-chars", type=int, nargs="+", default=[MIN_CHUNK_CHARS])
+    parser.add_argument("--max-bullet-fraction", type=float, nargs="+", default=[MAX_BULLET_FRACTION])
+    parser.add_argument("--min-alpha", type=int, nargs="+", default=[MIN_ALPHA_CHARS])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[6])
+    parser.add_argument("--hybrid", nargs="+", default=["off"],
+                        help='"off", "rrf" or a weighted fusion alpha such as 0.5')
+    parser.add_argument("--objective", choices=OBJECTIVES, default="ndcg")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--out", default="sweep.json")
+    args = parser.parse_args()
+
+    levels = [tuple(int(level) for level in spec.split(",")) for spec in args.split_levels]
+    configs = grid(levels, args.min_chars, args.max_bullet_fraction, args.min_alpha,
+                   args.top_k, args.hybrid)
+    truth = ground_truth_texts(DocStore.load(str(Path(args.index) / DOCS_FILE)), GROUND_TRUTH)
+    embed_gen = EmbeddingGenerator(disk_cache=EmbeddingCache(args.embedding_cache),
+                                   backend=make_backend(args.embedding_backend))
+
+    results = run_sweep(args.vault, embed_gen, configs, GROUND_TRUTH, truth,
+                        args.processes, args.objective)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(format_table(results, args.objective))
+    print(f"* Pareto front ({args.objective} vs search latency vs memory); "
+          f"{len(results)} settings written to {args.out}")
@@ -0,0 +1,101 @@
+from rag_pipeline import RAGPipeline
+from typing import List, Optional
+import asyncio
+
+# Queries gathered into one batch before it is sent without waiting further
+DEFAULT_MAX_BATCH = 32
+# Longest a query waits for others to join its batch, in seconds
+DEFAULT_MAX_DELAY = 0.005
+
+
+class PendingQuery:
+    def __init__(self, question: str, top_k: int, filter: Optional[dict],
+                 future: asyncio.Future):
+        self.question = question
+        self.top_k = top_k
+        self.filter = filter
+        self.future = future
+
+
+class QueryBatcher:
+    """Coalesces concurrent `aquery` calls on one RAGPipeline.
+
+    Questions that arrive within `max_delay` seconds of the first one in a
+    batch, up to `max_batch` of them, are embedded in one multi-input
+    request and scored in one `retrieve_many` pass. Each caller then gets
+    its own answer from `RAGPipeline.aanswer`. A lone query pays at most
+    `max_delay` on top of `aquery`.
+    """
+
+    def __init__(self, rag: RAGPipeline, max_batch: int = DEFAULT_MAX_BATCH,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        if max_delay < 0:
+            raise ValueError("max_delay cannot be negative")
+        self.rag = rag
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[PendingQuery] = list()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Flushed batches still running; held so they are not garbage collected
+        self._running = set()
+        self.batches = 0
+        self.queries = 0
+
+    async def aquery(self, question: str, top_k: int = 20,
+                     filter: Optional[dict] = None) -> dict:
+        """Same result as `RAGPipeline.aquery`"""
+        # Checked here so a bad question fails its own caller, not its whole batch
+        if not question or question.isspace():
+            raise ValueError("Text cannot be empty or whitespace")
+        future = self._enqueue(question, top_k, filter)
+        embedded_question, hits = await future
+        return await self.rag.aanswer(question, embedded_question, hits, filter)
+
+    def get_stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+        }
+
+    def _enqueue(self, question: str, top_k: int, filter: Optional[dict]) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(PendingQuery(question, top_k, filter, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, list()
+        if not batch:
+            return
+        self.batches += 1
+        self.queries += len(batch)
+        task = asyncio.ensure_future(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[PendingQuery]):
+        try:
+            embedded = await self.rag.embed_gen.aembed_batch([q.question for q in batch])
+            # One pass at the largest k; shorter lists are its prefixes
+            top_k = max(q.top_k for q in batch)
+            retrieved = self.rag.retrieve_many(embedded, top_k, [q.filter for q in batch])
+        except Exception as exc:
+            for query in batch:
+                if not query.future.done():
+                    query.future.set_exception(exc)
+            return
+
+        for query, vector, hits in zip(batch, embedded, retrieved):
+            # A caller cancelled while it waited has nobody to hand results to
+            if not query.future.done():
+                query.future.set_result((vector, hits[:query.top_k]))
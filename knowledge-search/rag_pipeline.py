@@ -1,48 +1,451 @@
 from embeddings import EmbeddingGenerator
+from embedding_backends import EmbeddingBackend, OpenAIBackend, make_backend
+from embedding_cache import EmbeddingCache
+from answer_cache import AnswerCache
+from context_packing import CONTEXT_TOKENS, PackedContext, pack_context
 from knowledge_search import VectorStore
 from docstore import DocStore
+from metrics import DISABLED, Metrics
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Union
+import asyncio
+import httpx
+import json
 import openai
+import os
+import time
+import numpy as np
+
+VECTORS_FILE = "vectors.ksvs"
+DOCS_FILE = "docs.ksds"
+MANIFEST_FILE = "manifest.json"
+CHAT_MODEL = "gpt-5-mini"  # Cheap and fast for testing
+# Queries in flight at once through aquery, and HTTP connections they may open
+MAX_CONCURRENCY = 64
+# is_useful_chunk thresholds: characters (was 40), share of bullet lines, letters
+MIN_CHUNK_CHARS = 100
+MAX_BULLET_FRACTION = 0.7
+MIN_ALPHA_CHARS = 50
 
 
 class RAGPipeline:
-    def __init__(self, dimensions: int):
+    def __init__(self, dimensions: int, embedding_cache: Optional[str] = None,
+                 max_concurrency: int = MAX_CONCURRENCY, metrics: Metrics = DISABLED,
+                 context_tokens: Optional[int] = CONTEXT_TOKENS,
+                 embedding_backend: Union[str, EmbeddingBackend, None] = None):
         # Initialize all your components
         # VectorStore, DocStore, EmbeddingGenerator, OpenAI client
+        # embedding_cache: path of an on-disk cache shared across runs
+        # metrics: records stage timings, cache hits and token counts when enabled
+        # context_tokens: budget of retrieved context per prompt (see context_packing);
+        # None sends the top 6 chunks as they are
+        # embedding_backend: an EmbeddingBackend or a spec such as "hashing" (see
+        # embedding_backends.make_backend); None reads $EMBEDDING_BACKEND, else OpenAI
+        if context_tokens is not None and context_tokens < 1:
+            raise ValueError(f"context_tokens must be at least 1, got {context_tokens}")
+        self.metrics = metrics
+        self.context_tokens = context_tokens
+        self.max_concurrency = max_concurrency
         self.doc_store = DocStore()
         self.vec_store = VectorStore(dimensions)
-        self.embed_gen = EmbeddingGenerator()
-        self.ai_client = openai.OpenAI()
+        disk_cache = EmbeddingCache(embedding_cache) if embedding_cache else None
+        # Chat clients are created on first use, so a local embedder can build an index offline
+        self._ai_client: Optional[openai.OpenAI] = None
+        # The async client's connection pool and the query slots belong to the
+        # event loop they were made in; see _bind_loop
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_client: Optional[openai.AsyncOpenAI] = None
+        self._query_slots: Optional[asyncio.Semaphore] = None
+        # Set when async embedding requests share the chat requests' connection pool
+        self._pooled_backend: Optional[OpenAIBackend] = None
+        if not isinstance(embedding_backend, EmbeddingBackend):
+            embedding_backend = make_backend(embedding_backend, dimensions, metrics=metrics)
+            if isinstance(embedding_backend, OpenAIBackend):
+                self._pooled_backend = embedding_backend
+        if embedding_backend.dimensions not in (None, dimensions):
+            raise ValueError(
+                f"embedding backend {embedding_backend.model} makes {embedding_backend.dimensions}-dim "
+                f"vectors but the vector store holds {dimensions}")
+        self.embed_gen = EmbeddingGenerator(disk_cache=disk_cache, metrics=metrics,
+                                            backend=embedding_backend)
+        # Vault file -> {mtime, size, sha256, chunk_ids}, kept by ObsidianIngestion
+        self.manifest = dict()
+        # Set to an AnswerCache to answer near-duplicate questions without the LLM
+        self.answer_cache: Optional[AnswerCache] = None
+
+    @property
+    def ai_client(self) -> openai.OpenAI:
+        if self._ai_client is None:
+            self._ai_client = openai.OpenAI()
+        return self._ai_client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        """The running event loop's client; only usable inside that loop"""
+        self._bind_loop()
+        return self._async_client
+
+    @property
+    def query_slots(self) -> asyncio.Semaphore:
+        """The running event loop's `max_concurrency` query slots"""
+        self._bind_loop()
+        return self._query_slots
+
+    def _bind_loop(self):
+        """Make the connection pool and query slots for the running loop.
+
+        Both hold loop-bound state (pooled connections, waiters), so a new
+        loop, e.g. the next `asyncio.run`, gets new ones. The old loop's are
+        dropped; `aclose` them before that loop ends to close connections.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        # One bounded connection pool for every async embedding and chat request
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        self._async_client = openai.AsyncOpenAI(
+            http_client=openai.DefaultAsyncHttpxClient(limits=limits))
+        self._query_slots = asyncio.Semaphore(self.max_concurrency)
+        self._loop = loop
+        if self._pooled_backend is not None:
+            self._pooled_backend.async_client = self._async_client
 
-    def add_document(self, text: str, source: str) -> int:
+    def save(self, index_dir: str):
+        """Persist both stores so the next run can skip re-embedding the vault"""
+        path = Path(index_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        self.vec_store.save(str(path / VECTORS_FILE))
+        self.doc_store.save(str(path / DOCS_FILE))
+        # Written last: a manifest never describes chunks the stores don't have
+        tmp_path = path / f"{MANIFEST_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, path / MANIFEST_FILE)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True,
+             embedding_cache: Optional[str] = None,
+             max_concurrency: int = MAX_CONCURRENCY,
+             metrics: Metrics = DISABLED,
+             context_tokens: Optional[int] = CONTEXT_TOKENS,
+             embedding_backend: Union[str, EmbeddingBackend, None] = None) -> "RAGPipeline":
+        path = Path(index_dir)
+        vec_store = VectorStore.open(str(path / VECTORS_FILE), mmap=mmap)
+        doc_store = DocStore.load(str(path / DOCS_FILE), mmap=mmap)
+        if vec_store.next_id != doc_store.next_id:
+            raise ValueError(
+                f"index at {index_dir} is inconsistent: "
+                f"{vec_store.next_id} vector ids vs {doc_store.next_id} document ids")
+
+        # Vector files from before format 2 have no tombstones; removed documents mark them
+        for doc_id in doc_store.removed_ids():
+            vec_store.remove(doc_id)
+
+        rag = cls(vec_store.dimensions, embedding_cache, max_concurrency, metrics, context_tokens,
+                  embedding_backend)
+        rag.vec_store = vec_store
+        rag.doc_store = doc_store
+        if (path / MANIFEST_FILE).exists():
+            with open(path / MANIFEST_FILE, 'r') as f:
+                rag.manifest = json.load(f)
+        # Nor has it attributes; they are rebuilt from the manifest
+        for key, record in rag.manifest.items():
+            attributes = note_attributes(key, record)
+            for doc_id in record["chunk_ids"]:
+                vec_store.set_attributes(doc_id, attributes)
+        return rag
+
+    @staticmethod
+    def has_index(index_dir: str) -> bool:
+        path = Path(index_dir)
+        return (path / VECTORS_FILE).exists() and (path / DOCS_FILE).exists()
+
+    def add_document(self, text: str, source: str, attributes: Optional[dict] = None) -> int:
+        """`attributes` are stored with the vector for filtered queries"""
         embedding = self.embed_gen.embed_text(text)
         doc_id = self.doc_store.add_document(text, source)
-        vec_idx = self.vec_store.add(embedding)
+        vec_idx = self.vec_store.add(embedding, attributes)
         assert doc_id == vec_idx
         return doc_id
 
-    def query(self, question: str, top_k: int = 20) -> dict:
-        embedded_question = self.embed_gen.embed_text(question)
-        results = self.vec_store.search(embedded_question, top_k)
-        retrieved_docs = [item.index for item in results]
-        retrieved_texts = self.doc_store.get_documents(retrieved_docs)
+    def remove_documents(self, doc_ids: List[int]):
+        for doc_id in doc_ids:
+            if self.doc_store.remove_document(doc_id):
+                self.vec_store.remove(doc_id)
+        # Answers built on retired chunks are stale
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(doc_ids)
 
-        id_text_pairs = [
-            (doc_id, text)
-            for doc_id, text in zip(retrieved_docs, retrieved_texts)
-        ]
+    def compact(self, min_removed_fraction: float = 0.0) -> int:
+        """Free the vector slots of retired chunks once they make up at least
+        `min_removed_fraction` of the store. Chunk ids do not change.
+        Returns the number of slots freed."""
+        if self.vec_store.fragmentation()["removed_fraction"] < min_removed_fraction:
+            return 0
+        return self.vec_store.compact()
+
+    def query(self, question: str, top_k: int = 20,
+              filter: Optional[dict] = None) -> dict:
+        """`filter` limits retrieval to chunks whose attributes match, e.g.
+        `{"folder": "week-15"}` (see `VectorStore.search`). Filtered queries
+        skip the answer cache."""
+        with self.metrics.time("query"):
+            with self.metrics.time("embed"):
+                embedded_question = self.embed_gen.embed_text(question)
+            cached = self._cached_answer(question, embedded_question, filter)
+            if cached is not None:
+                return cached
+            hits = self._retrieve(embedded_question, top_k, filter)
+            context = self._pack(hits)
+            if not context.id_text_pairs:
+                return self._no_context(question)
+
+            messages = self._prompt(question, context)
+            with self.metrics.time("llm"):
+                response = self.ai_client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages
+                )
+            result = self._answer(question, context, response)
+            self._count_usage(response.usage)
+            return self._remember(embedded_question, result, filter)
+
+    async def aquery(self, question: str, top_k: int = 20,
+                     filter: Optional[dict] = None) -> dict:
+        """`query` on the event loop. Embedding and chat requests share
+        `async_client`'s connection pool, and at most `max_concurrency`
+        queries are in flight; the rest wait their turn."""
+        with self.metrics.time("query"):
+            async with self.query_slots:
+                with self.metrics.time("embed"):
+                    embedded_question = await self.embed_gen.aembed_text(question)
+                # Cache lookup, search and document fetch are in-memory and take microseconds
+                cached = self._cached_answer(question, embedded_question, filter)
+                if cached is not None:
+                    return cached
+                hits = self._retrieve(embedded_question, top_k, filter)
+                return await self._agenerate(question, embedded_question, hits, filter)
+
+    async def aanswer(self, question: str, embedded_question: List[float],
+                      hits: List[tuple], filter: Optional[dict] = None) -> dict:
+        """The generation half of `aquery`, for a question already embedded
+        and searched (see `retrieve_many` and `QueryBatcher`)."""
+        cached = self._cached_answer(question, embedded_question, filter)
+        if cached is not None:
+            return cached
+        async with self.query_slots:
+            return await self._agenerate(question, embedded_question, hits, filter)
+
+    async def _agenerate(self, question: str, embedded_question: List[float],
+                         hits: List[tuple], filter: Optional[dict]) -> dict:
+        context = self._pack(hits)
+        if not context.id_text_pairs:
+            return self._no_context(question)
+        messages = self._prompt(question, context)
+        with self.metrics.time("llm"):
+            response = await self.async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages
+            )
+        result = self._answer(question, context, response)
+        self._count_usage(response.usage)
+        return self._remember(embedded_question, result, filter)
+
+    def query_stream(self, question: str, top_k: int = 20,
+                     filter: Optional[dict] = None) -> Iterator[dict]:
+        """`query`, streamed. Yields a "context" event with the retrieved
+        chunk ids and texts as soon as search is done, a "token" event per
+        piece of answer text as it arrives, then a "done" event holding the
+        full result of `query` plus timings (retrieval, first token, total)."""
+        trace = AnswerTrace(question)
+        with self.metrics.time("embed"):
+            embedded_question = self.embed_gen.embed_text(question)
+        cached = self._cached_answer(question, embedded_question, filter)
+        if cached is not None:
+            yield from trace.replay(cached)
+            return
+        hits = self._retrieve(embedded_question, top_k, filter)
+        context = self._pack(hits)
+        yield trace.context(context)
+        if not context.id_text_pairs:
+            yield trace.token(self._no_context(question)["answer"])
+            yield trace.done()
+            return
+
+        messages = self._prompt(question, context)
+        started = time.perf_counter()
+        # Closed even if the caller stops reading early
+        with self.ai_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        ) as stream:
+            for chunk in stream:
+                text = self._stream_text(chunk, trace, started)
+                if text:
+                    yield trace.token(text)
+        self.metrics.observe("llm", time.perf_counter() - started)
+        self._remember(embedded_question, trace.result(), filter)
+        yield trace.done()
+
+    async def aquery_stream(self, question: str, top_k: int = 20,
+                            filter: Optional[dict] = None) -> AsyncIterator[dict]:
+        """`query_stream` on the event loop, with the same events. Holds one
+        of the `max_concurrency` query slots until the answer is complete.
+
+        A caller that stops before the "done" event should close the
+        generator, e.g. with `contextlib.aclosing`, to free its slot and
+        connection at once rather than when it is garbage collected."""
+        trace = AnswerTrace(question)
+        async with self.query_slots:
+            with self.metrics.time("embed"):
+                embedded_question = await self.embed_gen.aembed_text(question)
+            cached = self._cached_answer(question, embedded_question, filter)
+            if cached is None:
+                hits = self._retrieve(embedded_question, top_k, filter)
+                context = self._pack(hits)
+                yield trace.context(context)
+                if context.id_text_pairs:
+                    messages = self._prompt(question, context)
+                    started = time.perf_counter()
+                    async with await self.async_client.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    ) as stream:
+                        async for chunk in stream:
+                            text = self._stream_text(chunk, trace, started)
+                            if text:
+                                yield trace.token(text)
+                    self.metrics.observe("llm", time.perf_counter() - started)
+                    self._remember(embedded_question, trace.result(), filter)
+                else:
+                    yield trace.token(self._no_context(question)["answer"])
+        # Yielded without the slot, so a caller that stops at "done" holds none
+        if cached is not None:
+            for event in trace.replay(cached):
+                yield event
+        else:
+            yield trace.done()
+
+    def _cached_answer(self, question: str, embedded_question: List[float],
+                       filter: Optional[dict]) -> Optional[dict]:
+        # Cached answers were built from unfiltered context
+        if self.answer_cache is None or filter is not None:
+            return None
+        cached = self.answer_cache.get(embedded_question)
+        if cached is not None:
+            cached["query"] = question
+            if "tokens" in cached:
+                # Nothing is billed for a cached answer
+                cached["tokens"] = {**cached["tokens"], "prompt_tokens": 0,
+                                    "completion_tokens": 0, "cached": True}
+        self.metrics.count("answer_cache_miss" if cached is None else "answer_cache_hit")
+        return cached
+
+    def _remember(self, embedded_question: List[float], result: dict,
+                  filter: Optional[dict]) -> dict:
+        if self.answer_cache is not None and filter is None:
+            self.answer_cache.put(embedded_question, result)
+        return result
+
+    async def aclose(self):
+        """Close the connection pool made in the running loop, if any. Async
+        calls after this make a new one. A pool made in another loop is left
+        alone: it is not this loop's to close."""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        await self._async_client.close()
+        self._loop = self._async_client = self._query_slots = None
+        if self._pooled_backend is not None:
+            self._pooled_backend.async_client = None
+
+    def _retrieve(self, embedded_question: List[float], top_k: int,
+                  filter: Optional[dict] = None) -> List[tuple]:
+        """(doc_id, text, similarity) of the best `top_k` chunks, best first"""
+        with self.metrics.time("search"):
+            results = self.vec_store.search(embedded_question, top_k, filter=filter)
+        texts = self._fetch_texts(item.index for item in results)
+        return self._with_texts(results, texts)
+
+    def retrieve_many(self, embedded_questions: List[List[float]], top_k: int,
+                      filters: Optional[List[Optional[dict]]] = None) -> List[List[tuple]]:
+        """`_retrieve` for many questions at once: the unfiltered ones are
+        scored in one `search_many` pass, and every hit's text comes back
+        from one document fetch."""
+        filters = filters or [None] * len(embedded_questions)
+        results: List[list] = [[] for _ in embedded_questions]
+        unfiltered = [i for i, filter in enumerate(filters) if filter is None]
+        with self.metrics.time("search"):
+            if unfiltered:
+                block = np.asarray([embedded_questions[i] for i in unfiltered], dtype=np.float32)
+                for i, hits in zip(unfiltered, self.vec_store.search_many(block, top_k)):
+                    results[i] = hits
+            for i, filter in enumerate(filters):
+                if filter is not None:
+                    results[i] = self.vec_store.search(embedded_questions[i], top_k, filter=filter)
+
+        texts = self._fetch_texts(item.index for hits in results for item in hits)
+        return [self._with_texts(hits, texts) for hits in results]
 
-        if not id_text_pairs:
-            return {
-                "answer": "No relevant information found after filtering.",
-                "context": [],
-                "chunk_ids": [],
-                "query": question
-            }
-        # ... LLM call stays same but use top_6_texts ...
-        top_6_pairs = id_text_pairs[:6]
-        top_6_ids = [doc_id for doc_id, _ in top_6_pairs]
-        top_6_texts = [text for _, text in top_6_pairs]
-        context = "\n\n".join(top_6_texts)
+    def _fetch_texts(self, doc_ids: Iterable[int]) -> Dict[int, str]:
+        """Text of each live document among `doc_ids`, in one fetch"""
+        doc_store = self.doc_store
+        with self.metrics.time("fetch"):
+            # get_documents skips dead ids, so ask only for live ones to keep ids and texts paired
+            live = [doc_id for doc_id in dict.fromkeys(doc_ids)
+                    if 0 <= doc_id < doc_store.next_id and not doc_store.is_removed(doc_id)]
+            return dict(zip(live, doc_store.get_documents(live)))
+
+    @staticmethod
+    def _with_texts(results, texts: Dict[int, str]) -> List[tuple]:
+        # A vector whose document is gone has no text to offer
+        return [(item.index, texts[item.index], item.similarity)
+                for item in results if item.index in texts]
+
+    def _pack(self, hits: List[tuple]) -> PackedContext:
+        with self.metrics.time("pack"):
+            token_counts = self.doc_store.token_counts([doc_id for doc_id, _, _ in hits])
+            context = pack_context(hits, token_counts, self.context_tokens)
+        self.metrics.count("context_tokens_saved", context.unpacked_tokens - context.tokens)
+        return context
+
+    def _prompt(self, question: str, context: PackedContext) -> List[dict]:
+        with self.metrics.time("prompt"):
+            return self._messages(question, context.texts)
+
+    def _count_usage(self, usage):
+        if usage is not None:
+            self.metrics.count("llm_prompt_tokens", usage.prompt_tokens)
+            self.metrics.count("llm_completion_tokens", usage.completion_tokens)
+
+    def _stream_text(self, chunk, trace: "AnswerTrace", started: float) -> str:
+        """A streamed chunk's text. Counts the tokens of the closing usage
+        chunk and times the first piece of text."""
+        usage = getattr(chunk, "usage", None)
+        self._count_usage(usage)
+        if usage is not None:
+            trace.usage = usage
+        text = _delta_text(chunk)
+        if text and not trace.parts:
+            self.metrics.observe("llm_first_token", time.perf_counter() - started)
+        return text
+
+    @staticmethod
+    def _no_context(question: str) -> dict:
+        return {
+            "answer": "No relevant information found after filtering.",
+            "context": [],
+            "chunk_ids": [],
+            "query": question
+        }
+
+    @staticmethod
+    def _messages(question: str, texts: List[str]) -> List[dict]:
+        context = "\n\n".join(texts)
 
         system_prompt = """
         You are a helpful assistant.
@@ -58,22 +461,103 @@ class RAGPipeline:
         If the context doesn't contain relevant information, say so.
         """
 
-        response = self.ai_client.chat.completions.create(
-            model="gpt-5-mini",  # Cheap and fast for testing
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
 
+    @staticmethod
+    def _answer(question: str, context: PackedContext, response) -> dict:
         return {
             "answer": response.choices[0].message.content,
-            "context": top_6_texts,
-            "chunk_ids": top_6_ids,
-            "query": question
+            "context": context.texts,
+            "chunk_ids": context.doc_ids,
+            "query": question,
+            "tokens": context.report(response.usage)
+        }
+
+class AnswerTrace:
+    """Builds the events of one streamed answer and times them"""
+
+    def __init__(self, question: str):
+        self.question = question
+        self.started = time.perf_counter()
+        self.timings = dict()
+        self.id_text_pairs: List[tuple] = list()
+        self.packed: Optional[PackedContext] = None
+        # The closing chunk's token usage, when the stream reports it
+        self.usage = None
+        # A replayed answer's token report, from when it was first built
+        self.tokens: Optional[dict] = None
+        self.parts: List[str] = list()
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def context(self, packed: PackedContext) -> dict:
+        self.timings["retrieve_s"] = self._elapsed()
+        self.packed = packed
+        self.id_text_pairs = packed.id_text_pairs
+        return {
+            "type": "context",
+            "chunk_ids": [doc_id for doc_id, _ in self.id_text_pairs],
+            "context": [text for _, text in self.id_text_pairs],
+            "query": self.question
+        }
+
+    def token(self, text: str) -> dict:
+        if not self.parts:
+            # What the user waits on before anything appears
+            self.timings["first_token_s"] = self._elapsed()
+        self.parts.append(text)
+        return {"type": "token", "text": text}
+
+    def replay(self, result: dict) -> List[dict]:
+        """Events for an answer that is already complete, e.g. a cached one"""
+        pairs = list(zip(result["chunk_ids"], result["context"]))
+        self.tokens = result.get("tokens")
+        return [self.context(PackedContext(pairs, 0, 0)), self.token(result["answer"]), self.done()]
+
+    def result(self) -> dict:
+        """The answer so far, shaped like the return value of `query`"""
+        result = {
+            "answer": "".join(self.parts),
+            "context": [text for _, text in self.id_text_pairs],
+            "chunk_ids": [doc_id for doc_id, _ in self.id_text_pairs],
+            "query": self.question
         }
+        if self.tokens is not None:
+            result["tokens"] = self.tokens
+        elif self.packed is not None and self.packed.id_text_pairs:
+            result["tokens"] = self.packed.report(self.usage)
+        return result
+
+    def done(self) -> dict:
+        self.timings["total_s"] = self._elapsed()
+        return {"type": "done", **self.result(), "timings": self.timings}
+
+
+def _delta_text(chunk) -> str:
+    # Role-only and usage-only chunks carry no text
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def note_attributes(key: str, record: dict) -> dict:
+    """Filterable attributes of a vault note's chunks, from its manifest entry"""
+    folder = PurePosixPath(key).parent.as_posix()
+    return {
+        "source": key,
+        "folder": "" if folder == "." else folder,
+        "tags": record.get("tags", []),
+        "modified": int(record["mtime"]),
+    }
+
 
-def is_useful_chunk(chunk_text: str) -> bool:
+def is_useful_chunk(chunk_text: str, min_chars: int = MIN_CHUNK_CHARS,
+                    max_bullet_fraction: float = MAX_BULLET_FRACTION,
+                    min_alpha: int = MIN_ALPHA_CHARS) -> bool:
     """Filter out metadata and sparse chunks"""
      
     # 1. Skip YAML frontmatter and property sections
@@ -85,18 +569,18 @@ def is_useful_chunk(chunk_text: str) -> bool:
         return False
 
     # 2. Minimum content threshold (test 80, 100, 150 chars)
-    if len(chunk_text.strip()) < 100:  # Increase from 40
+    if len(chunk_text.strip()) < min_chars:
         return False
 
     # 3. Skip mostly-bullets with little prose
     lines = chunk_text.split('\n')
     bullet_lines = sum(1 for l in lines if l.strip().startswith(('-', '*', '+')))
-    if bullet_lines / max(len(lines), 1) > 0.7:  # >70% bullets
+    if bullet_lines / max(len(lines), 1) > max_bullet_fraction:
         return False
      
     # 4. Require some alphabetic content (not just punctuation/numbers)
     alpha_chars = sum(c.isalpha() for c in chunk_text)
-    if alpha_chars < 50:  # At least 50 letters
+    if alpha_chars < min_alpha:
         return False
     
     return True
@@ -1,25 +1,53 @@
-from typing import List
+from typing import AsyncIterator, List
 from rag_pipeline import RAGPipeline
+from answer_cache import AnswerCache
+from metrics import DISABLED, Metrics
+from query_batcher import QueryBatcher
 from obsidian_ingestion import ObsidianIngestion
 import asyncio
 
 
 class Coordinator:
     # consider adding a vault_path arg later
-    def __init__(self):
-        self.rag = RAGPipeline(dimensions=1536)
+    def __init__(self, index_dir: str = "index",
+                 embedding_cache: str = "embedding_cache.sqlite",
+                 metrics: Metrics = DISABLED):
+        if RAGPipeline.has_index(index_dir):
+            # Reuse the saved index instead of re-embedding the whole vault
+            self.rag = RAGPipeline.load(index_dir, embedding_cache=embedding_cache, metrics=metrics)
+        else:
+            self.rag = RAGPipeline(dimensions=1536, embedding_cache=embedding_cache, metrics=metrics)
+        # Repeated questions skip the LLM; re-ingesting a note drops answers built on it
+        self.rag.answer_cache = AnswerCache(self.rag.vec_store.dimensions)
+
+        # Only notes added, edited or deleted since the last run are processed
         ingestor = ObsidianIngestion(self.rag)
-        ingestor.ingest_directory("/users/hectorcryo/Documents/Knowledge Engineering Vault/Knowledge-Engineering/")
+        stats = ingestor.ingest_directory("/users/hectorcryo/Documents/Knowledge Engineering Vault/Knowledge-Engineering/")
+        if stats["files_processed"] or stats["files_removed"] or not RAGPipeline.has_index(index_dir):
+            self.rag.save(index_dir)
+        # Timings of each streamed answer: retrieve_s, first_token_s, total_s
+        self.timings: List[dict] = list()
+        # Questions asked together share one embedding request and one search pass
+        self.batcher = QueryBatcher(self.rag)
     
     async def agent_query(self, question: str) -> str:
-        res = await asyncio.to_thread(self.rag.query, question, 6)
+        # Native async: waiting on the API holds no thread
+        res = await self.rag.aquery(question, 6)
         answer = res["answer"]
         return answer
 
+    async def agent_query_stream(self, question: str) -> AsyncIterator[str]:
+        """Answer text as it is generated, so the caller can show it at once"""
+        async for event in self.rag.aquery_stream(question, 6):
+            if event["type"] == "token":
+                yield event["text"]
+            elif event["type"] == "done":
+                self.timings.append(event["timings"])
+
     async def agent_queries(self, questions: List[str]) -> List[str]:
-        coroutines = [self.agent_query(q) for q in questions]
+        coroutines = [self.batcher.aquery(q, 6) for q in questions]
         res = await asyncio.gather(*coroutines)
-        return res
+        return [r["answer"] for r in res]
 
 async def main():
     questions = [
@@ -30,6 +58,11 @@ async def main():
     ]
 
     coord = Coordinator()
+    async for token in coord.agent_query_stream(questions[0]):
+        print(token, end="", flush=True)
+    print()
+    print(coord.timings[-1])
+
     results = await coord.agent_queries(questions)
     print(results)
 
@@ -0,0 +1,634 @@
+//! Keyword search: Okapi BM25 over an inverted index.
+//!
+//! Each term keeps a posting list of (document, term frequency) pairs in
+//! document order, plus the largest frequency and the shortest document it
+//! has seen. Together those bound the score the term can add to any one
+//! document. Search is document-at-a-time with `MaxScore` pruning: terms are
+//! ordered by that bound, and once the k-th best score beats the summed
+//! bounds of the weakest terms, those terms stop producing candidates and
+//! are only looked up (by binary search) for documents the stronger terms
+//! found. Common, low-idf terms end up skipping most of their postings.
+//!
+//! [`hybrid_search`] runs a [`VectorStore`] search and a BM25 search for the
+//! same question and fuses the two rankings.
+
+use crate::{SearchResult, TopK, VectorStore, VectorStoreError, into_sorted, push_top_k};
+use std::collections::{BinaryHeap, HashMap};
+use std::ops::Range;
+
+/// Constant of reciprocal rank fusion; 60 is the value from the original paper.
+pub const DEFAULT_RRF_K: f32 = 60.0;
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub struct Bm25Params {
+    /// Term frequency saturation
+    pub k1: f32,
+    /// Document length normalization, from 0 (none) to 1 (full)
+    pub b: f32,
+}
+
+impl Default for Bm25Params {
+    fn default() -> Self {
+        Self { k1: 1.2, b: 0.75 }
+    }
+}
+
+struct Postings {
+    docs: Vec<u32>,
+    freqs: Vec<u32>,
+    max_freq: u32,
+    min_len: u32,
+}
+
+impl Postings {
+    fn new() -> Self {
+        Self {
+            docs: Vec::new(),
+            freqs: Vec::new(),
+            max_freq: 0,
+            min_len: u32::MAX,
+        }
+    }
+}
+
+pub struct Bm25Index {
+    params: Bm25Params,
+    terms: HashMap<String, usize>,
+    postings: Vec<Postings>,
+    doc_lens: Vec<u32>,
+    total_len: u64,
+    /// Tombstones by index, as in [`VectorStore`]
+    removed: Vec<bool>,
+    removed_count: usize,
+}
+
+/// Position of one query term in its posting list during a search.
+struct Cursor<'a> {
+    postings: &'a Postings,
+    idf: f32,
+    upper_bound: f32,
+    pos: usize,
+}
+
+impl Cursor<'_> {
+    fn doc(&self) -> Option<usize> {
+        self.postings.docs.get(self.pos).map(|&d| d as usize)
+    }
+
+    fn freq(&self) -> u32 {
+        self.postings.freqs[self.pos]
+    }
+
+    /// Skip to the first posting at or after `doc`.
+    fn advance_to(&mut self, doc: usize) {
+        let rest = &self.postings.docs[self.pos..];
+        self.pos += rest.partition_point(|&d| (d as usize) < doc);
+    }
+}
+
+/// How [`hybrid_search`] combines the vector and keyword rankings.
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub enum Fusion {
+    /// Sum of `1 / (k + rank)` over the rankings a document appears in.
+    /// Only ranks matter, so the two score scales need no calibration.
+    Rrf { k: f32 },
+    /// `alpha * vector + (1 - alpha) * keyword`, each min-max scaled to
+    /// [0, 1] over its own candidates.
+    Weighted { alpha: f32 },
+}
+
+impl Bm25Index {
+    #[must_use]
+    pub fn new(params: Bm25Params) -> Self {
+        Self {
+            params,
+            terms: HashMap::new(),
+            postings: Vec::new(),
+            doc_lens: Vec::new(),
+            total_len: 0,
+            removed: Vec::new(),
+            removed_count: 0,
+        }
+    }
+
+    #[must_use]
+    pub fn params(&self) -> Bm25Params {
+        self.params
+    }
+
+    /// Number of documents in the index, removed ones included
+    #[must_use]
+    pub fn len(&self) -> usize {
+        self.doc_lens.len()
+    }
+
+    #[must_use]
+    pub fn is_empty(&self) -> bool {
+        self.doc_lens.is_empty()
+    }
+
+    /// Number of distinct terms
+    #[must_use]
+    pub fn vocabulary_size(&self) -> usize {
+        self.terms.len()
+    }
+
+    #[must_use]
+    pub fn removed_count(&self) -> usize {
+        self.removed_count
+    }
+
+    #[must_use]
+    pub fn is_removed(&self, index: usize) -> bool {
+        self.removed.get(index).copied().unwrap_or(false)
+    }
+
+    /// Index a document. Returns its index, which matches the index
+    /// [`VectorStore::add`] gives the same document when both are fed in order.
+    ///
+    /// # Panics
+    ///
+    /// Panics past `u32::MAX` documents or tokens in one document
+    pub fn add(&mut self, text: &str) -> usize {
+        let index = self.doc_lens.len();
+        let doc = u32::try_from(index).expect("more than u32::MAX documents");
+
+        // Lowercase once and count borrowed slices; only new terms allocate
+        let text = text.to_lowercase();
+        let mut counts: HashMap<&str, u32> = HashMap::new();
+        for token in tokenize(&text) {
+            *counts.entry(token).or_default() += 1;
+        }
+        let len = u32::try_from(counts.values().map(|&c| u64::from(c)).sum::<u64>())
+            .expect("more than u32::MAX tokens in one document");
+
+        for (term, freq) in counts {
+            let id = if let Some(&id) = self.terms.get(term) {
+                id
+            } else {
+                self.postings.push(Postings::new());
+                self.terms.insert(term.to_owned(), self.postings.len() - 1);
+                self.postings.len() - 1
+            };
+            let postings = &mut self.postings[id];
+            postings.docs.push(doc);
+            postings.freqs.push(freq);
+            postings.max_freq = postings.max_freq.max(freq);
+            postings.min_len = postings.min_len.min(len);
+        }
+
+        self.doc_lens.push(len);
+        self.total_len += u64::from(len);
+        index
+    }
+
+    /// Index many documents. Returns the range of indices assigned to them.
+    pub fn add_batch<S: AsRef<str>>(&mut self, texts: &[S]) -> Range<usize> {
+        let start = self.len();
+        for text in texts {
+            self.add(text.as_ref());
+        }
+        start..self.len()
+    }
+
+    /// Exclude a document from future searches. Returns false if it was
+    /// already removed. Its postings stay until the index is rebuilt, so
+    /// document frequencies still count it.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if `index` is not in the index
+    pub fn remove(&mut self, index: usize) -> Result<bool, VectorStoreError> {
+        if index >= self.len() {
+            return Err(VectorStoreError::OutOfRange {
+                index,
+                len: self.len(),
+            });
+        }
+        if self.removed.len() < self.len() {
+            self.removed.resize(self.len(), false);
+        }
+        if self.removed[index] {
+            return Ok(false);
+        }
+        self.removed[index] = true;
+        self.removed_count += 1;
+        Ok(true)
+    }
+
+    /// Top-k documents by BM25 score for `query` (highest first). Documents
+    /// sharing no term with the query are never returned.
+    #[must_use]
+    pub fn search(&self, query: &str, k: usize) -> Vec<SearchResult> {
+        if k == 0 || self.is_empty() {
+            return Vec::new();
+        }
+        let avg_len = self.average_len();
+        let mut cursors = self.cursors(query, avg_len);
+
+        // Weakest first; bounds[i] is what terms 0..=i can add at most together
+        cursors.sort_by(|a, b| a.upper_bound.total_cmp(&b.upper_bound));
+        let bounds: Vec<f32> = cursors
+            .iter()
+            .scan(0.0, |sum, c| {
+                *sum += c.upper_bound;
+                Some(*sum)
+            })
+            .collect();
+
+        let mut heap: TopK = BinaryHeap::new();
+        let mut threshold = 0.0f32;
+        // Terms before this one cannot lift a document into the top k alone
+        let mut first_essential = 0;
+
+        while let Some(doc) = cursors[first_essential..]
+            .iter()
+            .filter_map(Cursor::doc)
+            .min()
+        {
+            let skip = self.is_removed(doc);
+            let len = self.doc_lens[doc];
+            let mut score = 0.0;
+            for cursor in &mut cursors[first_essential..] {
+                if cursor.doc() == Some(doc) {
+                    if !skip {
+                        score += self.term_score(cursor.idf, cursor.freq(), len, avg_len);
+                    }
+                    cursor.pos += 1;
+                }
+            }
+            if skip {
+                continue;
+            }
+
+            // Strongest non-essential term first; stop once even their full
+            // bounds could not reach the threshold
+            for i in (0..first_essential).rev() {
+                if heap.len() == k && score + bounds[i] <= threshold {
+                    break;
+                }
+                let cursor = &mut cursors[i];
+                cursor.advance_to(doc);
+                if cursor.doc() == Some(doc) {
+                    score += self.term_score(cursor.idf, cursor.freq(), len, avg_len);
+                }
+            }
+
+            if heap.len() < k || score > threshold {
+                push_top_k(
+                    &mut heap,
+                    SearchResult {
+                        index: doc,
+                        similarity: score,
+                    },
+                    k,
+                );
+                if heap.len() == k {
+                    threshold = heap.peek().map_or(0.0, |r| r.0.similarity);
+                    while first_essential < cursors.len() && bounds[first_essential] <= threshold {
+                        first_essential += 1;
+                    }
+                }
+            }
+        }
+
+        into_sorted(heap)
+    }
+
+    /// One cursor per distinct query term that occurs in the index.
+    fn cursors(&self, query: &str, avg_len: f32) -> Vec<Cursor<'_>> {
+        let query = query.to_lowercase();
+        let mut ids: Vec<usize> = tokenize(&query)
+            .filter_map(|token| self.terms.get(token).copied())
+            .collect();
+        ids.sort_unstable();
+        ids.dedup();
+
+        ids.into_iter()
+            .map(|id| {
+                let postings = &self.postings[id];
+                let weight = self.idf(postings.docs.len());
+                Cursor {
+                    postings,
+                    idf: weight,
+                    upper_bound: self.term_score(
+                        weight,
+                        postings.max_freq,
+                        postings.min_len,
+                        avg_len,
+                    ),
+                    pos: 0,
+                }
+            })
+            .collect()
+    }
+
+    #[allow(clippy::cast_precision_loss)]
+    fn average_len(&self) -> f32 {
+        (self.total_len as f32 / self.len() as f32).max(1.0)
+    }
+
+    /// Lucene's variant, which never goes negative for very common terms.
+    #[allow(clippy::cast_precision_loss)]
+    fn idf(&self, doc_freq: usize) -> f32 {
+        let docs = (self.len() - self.removed_count) as f32;
+        let df = doc_freq as f32;
+        ((docs - df + 0.5) / (df + 0.5) + 1.0).ln().max(0.0)
+    }
+
+    /// Grows with `freq` and shrinks with `len`, so the largest frequency
+    /// and the shortest document of a posting list bound it.
+    #[allow(clippy::cast_precision_loss)]
+    fn term_score(&self, idf: f32, freq: u32, len: u32, avg_len: f32) -> f32 {
+        let Bm25Params { k1, b } = self.params;
+        let tf = freq as f32;
+        let norm = k1 * (1.0 - b + b * len as f32 / avg_len);
+        idf * tf * (k1 + 1.0) / (tf + norm)
+    }
+}
+
+impl Default for Bm25Index {
+    fn default() -> Self {
+        Self::new(Bm25Params::default())
+    }
+}
+
+/// Alphanumeric runs; everything else separates tokens. Callers lowercase
+/// the text first.
+fn tokenize(text: &str) -> impl Iterator<Item = &str> {
+    text.split(|c: char| !c.is_alphanumeric())
+        .filter(|token| !token.is_empty())
+}
+
+/// Run a vector search and a keyword search for the same question and fuse
+/// them. Each retriever contributes its top `candidates` (at least `k`);
+/// the fused top k come back best first, in the `similarity` field.
+///
+/// Both indexes must number documents the same way, as they do when every
+/// chunk is added to both in order and removed from both.
+///
+/// # Errors
+///
+/// Returns an Error if `query_vector` has the wrong dimensions
+pub fn hybrid_search(
+    vectors: &VectorStore,
+    keywords: &Bm25Index,
+    query_vector: &[f32],
+    query_text: &str,
+    k: usize,
+    candidates: usize,
+    fusion: Fusion,
+) -> Result<Vec<SearchResult>, VectorStoreError> {
+    let depth = candidates.max(k);
+    let semantic = vectors.search(query_vector, depth)?;
+    let lexical = keywords.search(query_text, depth);
+
+    let mut fused: HashMap<usize, f32> = HashMap::new();
+    match fusion {
+        Fusion::Rrf { k: rrf_k } => {
+            for ranking in [&semantic, &lexical] {
+                for (rank, result) in (1usize..).zip(ranking.iter()) {
+                    // Ranks past 2^24 round, which moves the score by far less than rrf_k
+                    #[allow(clippy::cast_precision_loss)]
+                    let rank = rank as f32;
+                    *fused.entry(result.index).or_default() += 1.0 / (rrf_k + rank);
+                }
+            }
+        }
+        Fusion::Weighted { alpha } => {
+            for (ranking, weight) in [(&semantic, alpha), (&lexical, 1.0 - alpha)] {
+                let (lo, hi) = ranking.iter().fold((f32::MAX, f32::MIN), |(lo, hi), r| {
+                    (lo.min(r.similarity), hi.max(r.similarity))
+                });
+                for result in ranking {
+                    let scaled = if hi > lo {
+                        (result.similarity - lo) / (hi - lo)
+                    } else {
+                        1.0
+                    };
+                    *fused.entry(result.index).or_default() += weight * scaled;
+                }
+            }
+        }
+    }
+
+    // Ties broken by index so results don't depend on hash order
+    let mut results: Vec<SearchResult> = fused
+        .into_iter()
+        .map(|(index, similarity)| SearchResult { index, similarity })
+        .collect();
+    results.sort_by(|a, b| {
+        b.similarity
+            .total_cmp(&a.similarity)
+            .then(a.index.cmp(&b.index))
+    });
+    results.truncate(k);
+    Ok(results)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn corpus() -> Bm25Index {
+        let mut index = Bm25Index::default();
+        index.add_batch(&[
+            "Rust ownership and borrowing rules",
+            "Python asyncio event loop and coroutines",
+            "Rust async runtimes: tokio and the event loop",
+            "Baking cookies at 350 degrees",
+            "borrowing books from the library",
+        ]);
+        index
+    }
+
+    /// Score every document that shares a term with the query, no pruning.
+    fn exhaustive(index: &Bm25Index, query: &str, k: usize) -> Vec<SearchResult> {
+        let avg_len = index.average_len();
+        let cursors = index.cursors(query, avg_len);
+        let mut scores = vec![0.0f32; index.len()];
+        let mut hit = vec![false; index.len()];
+        for cursor in &cursors {
+            for (&doc, &freq) in cursor.postings.docs.iter().zip(&cursor.postings.freqs) {
+                let doc = doc as usize;
+                scores[doc] += index.term_score(cursor.idf, freq, index.doc_lens[doc], avg_len);
+                hit[doc] = !index.is_removed(doc);
+            }
+        }
+        let mut heap: TopK = BinaryHeap::new();
+        for (doc, score) in scores.into_iter().enumerate() {
+            if hit[doc] {
+                push_top_k(
+                    &mut heap,
+                    SearchResult {
+                        index: doc,
+                        similarity: score,
+                    },
+                    k,
+                );
+            }
+        }
+        into_sorted(heap)
+    }
+
+    /// Zipf-ish synthetic corpus so some terms are very common.
+    fn synthetic(docs: usize, seed: u64) -> (Bm25Index, Vec<String>) {
+        let mut state = seed;
+        let mut next = move || {
+            state = state
+                .wrapping_mul(6_364_136_223_846_793_005)
+                .wrapping_add(1_442_695_040_888_963_407);
+            (state >> 33) as usize
+        };
+        let mut index = Bm25Index::default();
+        for _ in 0..docs {
+            let len = 5 + next() % 40;
+            let text: Vec<String> = (0..len)
+                .map(|_| format!("t{}", (next() % 500) * (next() % 500) / 500))
+                .collect();
+            index.add(&text.join(" "));
+        }
+        let queries = (0..50)
+            .map(|_| {
+                (0..=next() % 4)
+                    .map(|_| format!("t{}", next() % 300))
+                    .collect::<Vec<_>>()
+                    .join(" ")
+            })
+            .collect();
+        (index, queries)
+    }
+
+    #[test]
+    fn test_ranks_matching_documents() {
+        let index = corpus();
+        let results = index.search("rust borrowing", 3);
+
+        assert_eq!(results[0].index, 0);
+        assert!(results.iter().all(|r| r.index != 3));
+        assert!(
+            results
+                .windows(2)
+                .all(|w| w[0].similarity >= w[1].similarity)
+        );
+    }
+
+    #[test]
+    fn test_tokenizer_ignores_case_and_punctuation() {
+        let index = corpus();
+        let results = index.search("TOKIO!!", 5);
+
+        assert_eq!(results.len(), 1);
+        assert_eq!(results[0].index, 2);
+        assert!(index.search("unknown words", 5).is_empty());
+    }
+
+    #[test]
+    fn test_removed_document_not_returned() {
+        let mut index = corpus();
+        assert!(index.remove(0).unwrap());
+        assert!(!index.remove(0).unwrap());
+        assert!(index.remove(5).is_err());
+
+        assert!(index.search("ownership", 5).is_empty());
+        assert_eq!(index.removed_count(), 1);
+    }
+
+    #[test]
+    fn test_pruned_search_matches_exhaustive() {
+        let (mut index, queries) = synthetic(3000, 3);
+        for doc in (0..3000).step_by(7) {
+            index.remove(doc).unwrap();
+        }
+
+        for query in &queries {
+            for k in [1, 10] {
+                let pruned = index.search(query, k);
+                let full = exhaustive(&index, query, k);
+                assert_eq!(pruned.len(), full.len(), "query {query}");
+                for (p, f) in pruned.iter().zip(&full) {
+                    assert!((p.similarity - f.similarity).abs() < 1e-4, "query {query}");
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn test_rrf_favors_documents_in_both_rankings() {
+        let keywords = corpus();
+        let mut vectors = VectorStore::new(2);
+        // Vector ranking: 3, 2, 0, ...; keyword ranking for "event loop": 1 and 2
+        vectors
+            .add_batch(&[0.5, 0.5, 0.0, 1.0, 0.9, 0.1, 1.0, 0.0, 0.0, 1.0])
+            .unwrap();
+
+        let fused = hybrid_search(
+            &vectors,
+            &keywords,
+            &[1.0, 0.0],
+            "event loop",
+            2,
+            5,
+            Fusion::Rrf { k: DEFAULT_RRF_K },
+        )
+        .unwrap();
+
+        assert_eq!(fused[0].index, 2);
+        assert_eq!(fused.len(), 2);
+    }
+
+    #[test]
+    #[allow(clippy::cast_precision_loss)]
+    fn test_rrf_ranks_past_u16() {
+        let n = 70_000;
+        let mut keywords = Bm25Index::default();
+        keywords.add_batch(&vec!["rust"; n]);
+        let mut vectors = VectorStore::new(2);
+        let block: Vec<f32> = (0..n).flat_map(|i| [1.0, i as f32 / n as f32]).collect();
+        vectors.add_batch(&block).unwrap();
+
+        let rrf_k = DEFAULT_RRF_K;
+        let fused = hybrid_search(
+            &vectors,
+            &keywords,
+            &[1.0, 0.0],
+            "rust",
+            n,
+            n,
+            Fusion::Rrf { k: rrf_k },
+        )
+        .unwrap();
+
+        assert_eq!(fused.len(), n);
+        assert!(fused[0].similarity <= 2.0 / (rrf_k + 1.0));
+        // Only a rank beyond u16::MAX in both lists scores this low
+        let last = fused[n - 1].similarity;
+        assert!(last < 2.0 / (rrf_k + 65_536.0), "lowest fused score {last}");
+    }
+
+    #[test]
+    fn test_weighted_fusion_extremes() {
+        let keywords = corpus();
+        let mut vectors = VectorStore::new(2);
+        vectors
+            .add_batch(&[0.5, 0.5, 0.0, 1.0, 0.9, 0.1, 1.0, 0.0, 0.0, 1.0])
+            .unwrap();
+        // Vectors favor 1 and 4 (tied), keywords only know 3
+        let top = |alpha| {
+            hybrid_search(
+                &vectors,
+                &keywords,
+                &[0.0, 1.0],
+                "cookies",
+                1,
+                5,
+                Fusion::Weighted { alpha },
+            )
+            .unwrap()[0]
+                .index
+        };
+
+        assert_eq!(top(1.0), 1);
+        assert_eq!(top(0.0), 3);
+    }
+}
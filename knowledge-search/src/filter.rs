@@ -0,0 +1,467 @@
+use std::collections::{BTreeMap, HashMap};
+
+/// One value of a vector's attribute. A key may hold several, like a note's
+/// tags. Dates are stored as integers (Unix seconds, or `YYYYMMDD`).
+#[derive(Debug, Clone, PartialEq, Eq, PartialOrd, Ord, Hash)]
+pub enum AttributeValue {
+    Text(String),
+    Int(i64),
+}
+
+impl From<&str> for AttributeValue {
+    fn from(value: &str) -> Self {
+        Self::Text(value.to_owned())
+    }
+}
+
+impl From<String> for AttributeValue {
+    fn from(value: String) -> Self {
+        Self::Text(value)
+    }
+}
+
+impl From<i64> for AttributeValue {
+    fn from(value: i64) -> Self {
+        Self::Int(value)
+    }
+}
+
+/// Predicate over vector attributes, evaluated to a [`Bitmap`] of the rows
+/// it matches before any vector is scored.
+#[derive(Debug, Clone, PartialEq)]
+pub enum Filter {
+    /// Some value of `key` equals this one
+    Eq(String, AttributeValue),
+    /// Some value of `key` is one of these
+    AnyOf(String, Vec<AttributeValue>),
+    /// Some integer value of `key` lies in `min..=max`; `None` leaves that
+    /// side open
+    Range {
+        key: String,
+        min: Option<i64>,
+        max: Option<i64>,
+    },
+    And(Vec<Filter>),
+    Or(Vec<Filter>),
+    Not(Box<Filter>),
+}
+
+/// Fixed-length set of row indices, one bit per row.
+#[derive(Debug, Clone, PartialEq, Eq)]
+pub struct Bitmap {
+    words: Vec<u64>,
+    len: usize,
+}
+
+impl Bitmap {
+    /// No rows set
+    #[must_use]
+    pub fn new(len: usize) -> Self {
+        Self {
+            words: vec![0; len.div_ceil(64)],
+            len,
+        }
+    }
+
+    /// Every row set
+    #[must_use]
+    pub fn full(len: usize) -> Self {
+        let mut bitmap = Self {
+            words: vec![u64::MAX; len.div_ceil(64)],
+            len,
+        };
+        bitmap.clear_tail();
+        bitmap
+    }
+
+    /// Number of rows covered, set or not
+    #[must_use]
+    pub fn len(&self) -> usize {
+        self.len
+    }
+
+    #[must_use]
+    pub fn is_empty(&self) -> bool {
+        self.len == 0
+    }
+
+    #[must_use]
+    pub fn contains(&self, row: usize) -> bool {
+        row < self.len && self.words[row / 64] & (1 << (row % 64)) != 0
+    }
+
+    /// Set `row`; rows past the end are ignored
+    pub fn insert(&mut self, row: usize) {
+        if row < self.len {
+            self.words[row / 64] |= 1 << (row % 64);
+        }
+    }
+
+    pub fn remove(&mut self, row: usize) {
+        if row < self.len {
+            self.words[row / 64] &= !(1 << (row % 64));
+        }
+    }
+
+    /// Number of rows set
+    #[must_use]
+    pub fn count_ones(&self) -> usize {
+        self.words.iter().map(|w| w.count_ones() as usize).sum()
+    }
+
+    /// Set rows in ascending order. Empty words are skipped 64 rows at a time.
+    pub fn iter_ones(&self) -> impl Iterator<Item = usize> + '_ {
+        self.words.iter().enumerate().flat_map(|(i, &word)| {
+            let mut rest = word;
+            std::iter::from_fn(move || {
+                if rest == 0 {
+                    return None;
+                }
+                let bit = rest.trailing_zeros() as usize;
+                rest &= rest - 1;
+                Some(i * 64 + bit)
+            })
+        })
+    }
+
+    pub fn intersect(&mut self, other: &Bitmap) {
+        for (word, other) in self.words.iter_mut().zip(&other.words) {
+            *word &= other;
+        }
+    }
+
+    pub fn union(&mut self, other: &Bitmap) {
+        for (word, other) in self.words.iter_mut().zip(&other.words) {
+            *word |= other;
+        }
+    }
+
+    pub fn invert(&mut self) {
+        for word in &mut self.words {
+            *word = !*word;
+        }
+        self.clear_tail();
+    }
+
+    fn clear_tail(&mut self) {
+        if let Some(last) = self.words.last_mut()
+            && !self.len.is_multiple_of(64)
+        {
+            *last &= (1 << (self.len % 64)) - 1;
+        }
+    }
+}
+
+/// Attribute values per key, each with the ascending rows that hold it.
+/// Posting lists rather than bitmaps: a vault with thousands of source
+/// files would otherwise keep thousands of store-sized bitmaps.
+#[derive(Debug, Default)]
+pub(crate) struct AttributeIndex {
+    postings: HashMap<String, BTreeMap<AttributeValue, Vec<u32>>>,
+    /// Values held by each row, so replacing them visits only that row's
+    /// posting lists. Shorter than the store when the last rows have none.
+    by_row: Vec<Vec<(String, AttributeValue)>>,
+}
+
+impl AttributeIndex {
+    /// Replace `row`'s values for every key in `attributes`; other keys
+    /// keep theirs. A key listed more than once gets all of its values.
+    ///
+    /// # Panics
+    ///
+    /// Panics past `u32::MAX` rows
+    pub(crate) fn set(&mut self, row: usize, attributes: &[(String, AttributeValue)]) {
+        let posting_row = u32::try_from(row).expect("more than u32::MAX vectors");
+        if self.by_row.len() <= row {
+            self.by_row.resize_with(row + 1, Vec::new);
+        }
+        let held = &mut self.by_row[row];
+
+        // A row being added has nothing to replace
+        if !held.is_empty() {
+            let (replaced, kept): (Vec<_>, Vec<_>) = std::mem::take(held)
+                .into_iter()
+                .partition(|(key, _)| attributes.iter().any(|(given, _)| given == key));
+            *held = kept;
+            for (key, value) in replaced {
+                let Some(values) = self.postings.get_mut(&key) else {
+                    continue;
+                };
+                if let Some(rows) = values.get_mut(&value) {
+                    if let Ok(pos) = rows.binary_search(&posting_row) {
+                        rows.remove(pos);
+                    }
+                    if rows.is_empty() {
+                        values.remove(&value);
+                    }
+                }
+                if values.is_empty() {
+                    self.postings.remove(&key);
+                }
+            }
+        }
+
+        for (key, value) in attributes {
+            let rows = self
+                .postings
+                .entry(key.clone())
+                .or_default()
+                .entry(value.clone())
+                .or_default();
+            // Rows are usually set in the order they are added, so this is a push
+            if let Err(pos) = rows.binary_search(&posting_row) {
+                rows.insert(pos, posting_row);
+                held.push((key.clone(), value.clone()));
+            }
+        }
+    }
+
+    /// Move rows to `moved[row]`, dropping those mapped to None. The new
+    /// rows must keep the old rows' order.
+    pub(crate) fn compact(&mut self, moved: &[Option<usize>]) {
+        for values in self.postings.values_mut() {
+            values.retain(|_, rows| {
+                *rows = rows
+                    .iter()
+                    .filter_map(|&row| moved[row as usize])
+                    .map(|row| u32::try_from(row).expect("more than u32::MAX vectors"))
+                    .collect();
+                !rows.is_empty()
+            });
+        }
+        self.postings.retain(|_, values| !values.is_empty());
+
+        let mut by_row = Vec::with_capacity(self.by_row.len());
+        for (held, new_row) in std::mem::take(&mut self.by_row).into_iter().zip(moved) {
+            if let Some(new_row) = *new_row {
+                // Kept rows keep their order, so `new_row` is the next index
+                by_row.resize_with(new_row, Vec::new);
+                by_row.push(held);
+            }
+        }
+        self.by_row = by_row;
+    }
+
+    /// Every value `row` holds, ordered by key
+    pub(crate) fn get(&self, row: usize) -> Vec<(String, AttributeValue)> {
+        let mut attributes = self.by_row.get(row).cloned().unwrap_or_default();
+        attributes.sort();
+        attributes
+    }
+
+    /// Rows among the first `len` that `filter` matches
+    pub(crate) fn evaluate(&self, filter: &Filter, len: usize) -> Bitmap {
+        match filter {
+            Filter::Eq(key, value) => self.matching(key, len, |values| {
+                values.get_key_value(value).into_iter().collect()
+            }),
+            Filter::AnyOf(key, wanted) => self.matching(key, len, |values| {
+                wanted
+                    .iter()
+                    .filter_map(|value| values.get_key_value(value))
+                    .collect()
+            }),
+            Filter::Range { key, min, max } => self.matching(key, len, |values| {
+                let lo = AttributeValue::Int(min.unwrap_or(i64::MIN));
+                let hi = AttributeValue::Int(max.unwrap_or(i64::MAX));
+                if lo > hi {
+                    return Vec::new();
+                }
+                values.range(lo..=hi).collect()
+            }),
+            Filter::And(filters) => {
+                let mut bitmap = Bitmap::full(len);
+                for filter in filters {
+                    bitmap.intersect(&self.evaluate(filter, len));
+                }
+                bitmap
+            }
+            Filter::Or(filters) => {
+                let mut bitmap = Bitmap::new(len);
+                for filter in filters {
+                    bitmap.union(&self.evaluate(filter, len));
+                }
+                bitmap
+            }
+            Filter::Not(filter) => {
+                let mut bitmap = self.evaluate(filter, len);
+                bitmap.invert();
+                bitmap
+            }
+        }
+    }
+
+    /// Union of the posting lists that `select` picks from `key`'s values
+    fn matching<'a, F>(&'a self, key: &str, len: usize, select: F) -> Bitmap
+    where
+        F: Fn(&'a BTreeMap<AttributeValue, Vec<u32>>) -> Vec<(&'a AttributeValue, &'a Vec<u32>)>,
+    {
+        let mut bitmap = Bitmap::new(len);
+        if let Some(values) = self.postings.get(key) {
+            for (_, rows) in select(values) {
+                for &row in rows {
+                    bitmap.insert(row as usize);
+                }
+            }
+        }
+        bitmap
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn attrs(pairs: &[(&str, AttributeValue)]) -> Vec<(String, AttributeValue)> {
+        pairs
+            .iter()
+            .map(|(key, value)| ((*key).to_owned(), value.clone()))
+            .collect()
+    }
+
+    fn sample() -> AttributeIndex {
+        let mut index = AttributeIndex::default();
+        for row in 0..6i64 {
+            let folder = if row < 3 { "week-14" } else { "week-15" };
+            let mut pairs = attrs(&[("folder", folder.into()), ("modified", (100 + row).into())]);
+            if row % 2 == 0 {
+                pairs.extend(attrs(&[("tags", "rust".into()), ("tags", "async".into())]));
+            }
+            index.set(usize::try_from(row).unwrap(), &pairs);
+        }
+        index
+    }
+
+    fn rows(bitmap: &Bitmap) -> Vec<usize> {
+        bitmap.iter_ones().collect()
+    }
+
+    #[test]
+    fn test_bitmap_tail_stays_clear() {
+        let mut bitmap = Bitmap::full(70);
+        assert_eq!(bitmap.count_ones(), 70);
+        bitmap.invert();
+        assert_eq!(bitmap.count_ones(), 0);
+        bitmap.insert(69);
+        bitmap.insert(70);
+        assert_eq!(rows(&bitmap), vec![69]);
+        bitmap.remove(69);
+        assert!(!bitmap.contains(69));
+    }
+
+    #[test]
+    fn test_predicates() {
+        let index = sample();
+        let eq = Filter::Eq("folder".into(), "week-15".into());
+        assert_eq!(rows(&index.evaluate(&eq, 6)), vec![3, 4, 5]);
+
+        let any = Filter::AnyOf("tags".into(), vec!["rust".into(), "tokio".into()]);
+        assert_eq!(rows(&index.evaluate(&any, 6)), vec![0, 2, 4]);
+
+        let range = Filter::Range {
+            key: "modified".into(),
+            min: Some(101),
+            max: Some(103),
+        };
+        assert_eq!(rows(&index.evaluate(&range, 6)), vec![1, 2, 3]);
+
+        let both = Filter::And(vec![eq.clone(), any.clone()]);
+        assert_eq!(rows(&index.evaluate(&both, 6)), vec![4]);
+        let either = Filter::Or(vec![eq.clone(), any]);
+        assert_eq!(rows(&index.evaluate(&either, 6)), vec![0, 2, 3, 4, 5]);
+        let not = Filter::Not(Box::new(eq));
+        assert_eq!(rows(&index.evaluate(&not, 6)), vec![0, 1, 2]);
+    }
+
+    #[test]
+    fn test_unknown_key_and_type_match_nothing() {
+        let index = sample();
+        let missing = Filter::Eq("author".into(), "me".into());
+        assert_eq!(index.evaluate(&missing, 6).count_ones(), 0);
+        // Text values never fall inside an integer range
+        let range = Filter::Range {
+            key: "folder".into(),
+            min: None,
+            max: None,
+        };
+        assert_eq!(index.evaluate(&range, 6).count_ones(), 0);
+    }
+
+    #[test]
+    fn test_set_replaces_only_given_keys() {
+        let mut index = sample();
+        index.set(0, &attrs(&[("folder", "archive".into())]));
+        assert_eq!(
+            index.get(0),
+            attrs(&[
+                ("folder", "archive".into()),
+                ("modified", 100.into()),
+                ("tags", "async".into()),
+                ("tags", "rust".into()),
+            ])
+        );
+        let old = Filter::Eq("folder".into(), "week-14".into());
+        assert_eq!(rows(&index.evaluate(&old, 6)), vec![1, 2]);
+    }
+
+    #[test]
+    fn test_set_replaces_values_of_many_rows() {
+        // Every note has its own source and date, as ingestion gives them
+        let n: i64 = 1_000;
+        let mut index = AttributeIndex::default();
+        for row in 0..n {
+            let source = AttributeValue::Text(format!("note-{row}.md"));
+            index.set(
+                usize::try_from(row).unwrap(),
+                &attrs(&[("source", source), ("modified", row.into())]),
+            );
+        }
+        for row in 0..n {
+            index.set(
+                usize::try_from(row).unwrap(),
+                &attrs(&[("modified", (-row).into())]),
+            );
+        }
+
+        let rows_held = usize::try_from(n).unwrap();
+        let old = Filter::Range {
+            key: "modified".into(),
+            min: Some(1),
+            max: None,
+        };
+        assert_eq!(rows(&index.evaluate(&old, rows_held)), Vec::<usize>::new());
+        let new = Filter::Range {
+            key: "modified".into(),
+            min: Some(-2),
+            max: None,
+        };
+        assert_eq!(rows(&index.evaluate(&new, rows_held)), vec![0, 1, 2]);
+        let source = Filter::Eq("source".into(), "note-7.md".into());
+        assert_eq!(rows(&index.evaluate(&source, rows_held)), vec![7]);
+        assert_eq!(
+            index.get(7),
+            attrs(&[("modified", (-7).into()), ("source", "note-7.md".into())])
+        );
+    }
+
+    #[test]
+    fn test_compact_moves_row_values() {
+        let mut index = sample();
+        index.compact(&[None, Some(0), None, Some(1), Some(2), Some(3)]);
+        assert_eq!(
+            index.get(0),
+            attrs(&[("folder", "week-14".into()), ("modified", 101.into())])
+        );
+        index.set(2, &attrs(&[("tags", "tokio".into())]));
+        assert_eq!(
+            index.get(2),
+            attrs(&[
+                ("folder", "week-15".into()),
+                ("modified", 104.into()),
+                ("tags", "tokio".into()),
+            ])
+        );
+        let rust = Filter::Eq("tags".into(), "rust".into());
+        assert_eq!(rows(&index.evaluate(&rust, 4)), Vec::<usize>::new());
+    }
+}
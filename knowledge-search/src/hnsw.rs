@@ -0,0 +1,607 @@
+//! Hierarchical Navigable Small World graph (Malkov & Yashunin, 2016) for
+//! approximate top-k search over the same cosine similarity as `VectorStore`.
+//!
+//! `ef_search` is the recall/latency knob: the search keeps that many
+//! candidates while walking layer 0, so raising it visits more of the graph
+//! and misses fewer true neighbours.
+
+use crate::{SearchResult, VectorStoreError, compute_norm, cosine_similarity};
+use std::cmp::{Ordering, Reverse};
+use std::collections::BinaryHeap;
+use std::num::NonZeroUsize;
+use std::ops::Range;
+use std::thread;
+
+/// Hard cap on graph height; with M >= 2 reaching it takes ~2^16 draws.
+const MAX_LAYER: usize = 16;
+
+#[derive(Debug, Clone, Copy)]
+pub struct HnswParams {
+    /// Links kept per node on the upper layers (twice this on layer 0)
+    pub m: usize,
+    /// Candidates kept while inserting; higher builds a better graph, slower
+    pub ef_construction: usize,
+    /// Default candidates kept while searching
+    pub ef_search: usize,
+    /// Seed for layer assignment, so builds are reproducible
+    pub seed: u64,
+}
+
+impl Default for HnswParams {
+    fn default() -> Self {
+        Self {
+            m: 16,
+            ef_construction: 200,
+            ef_search: 64,
+            seed: 0x5EED,
+        }
+    }
+}
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+struct Scored {
+    similarity: f32,
+    id: u32,
+}
+
+impl Eq for Scored {}
+
+impl Ord for Scored {
+    fn cmp(&self, other: &Self) -> Ordering {
+        self.similarity
+            .total_cmp(&other.similarity)
+            .then_with(|| other.id.cmp(&self.id))
+    }
+}
+
+impl PartialOrd for Scored {
+    fn partial_cmp(&self, other: &Self) -> Option<Ordering> {
+        Some(self.cmp(other))
+    }
+}
+
+/// One bit per node, reset for every layer search.
+struct Visited(Vec<u64>);
+
+impl Visited {
+    fn new(nodes: usize) -> Self {
+        Self(vec![0; nodes.div_ceil(64)])
+    }
+
+    /// Marks `id` and returns whether it was unvisited.
+    fn insert(&mut self, id: u32) -> bool {
+        let (word, bit) = (id as usize / 64, 1u64 << (id % 64));
+        let fresh = self.0[word] & bit == 0;
+        self.0[word] |= bit;
+        fresh
+    }
+}
+
+pub struct HnswIndex {
+    dimensions: usize,
+    params: HnswParams,
+    data: Vec<f32>,
+    norms: Vec<f32>,
+    /// `links[node][layer]` holds the neighbours of `node` on `layer`
+    links: Vec<Vec<Vec<u32>>>,
+    entry_point: Option<u32>,
+    top_layer: usize,
+    rng: u64,
+}
+
+impl HnswIndex {
+    /// Create an empty index for vectors of given dimensions
+    #[must_use]
+    pub fn new(dimensions: usize, params: HnswParams) -> Self {
+        let params = HnswParams {
+            m: params.m.max(2),
+            ef_construction: params.ef_construction.max(1),
+            ef_search: params.ef_search.max(1),
+            ..params
+        };
+        Self {
+            dimensions,
+            params,
+            data: Vec::new(),
+            norms: Vec::new(),
+            links: Vec::new(),
+            entry_point: None,
+            top_layer: 0,
+            rng: params.seed,
+        }
+    }
+
+    #[must_use]
+    pub fn dimensions(&self) -> usize {
+        self.dimensions
+    }
+
+    #[must_use]
+    pub fn params(&self) -> HnswParams {
+        self.params
+    }
+
+    /// Change the default candidate list size used by [`HnswIndex::search`]
+    pub fn set_ef_search(&mut self, ef_search: usize) {
+        self.params.ef_search = ef_search.max(1);
+    }
+
+    #[must_use]
+    pub fn len(&self) -> usize {
+        self.norms.len()
+    }
+
+    #[must_use]
+    pub fn is_empty(&self) -> bool {
+        self.norms.is_empty()
+    }
+
+    /// Insert a vector into the graph. Returns its index.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    ///
+    /// # Panics
+    ///
+    /// Panics if the index already holds `u32::MAX` vectors
+    pub fn add(&mut self, vector: &[f32]) -> Result<usize, VectorStoreError> {
+        if vector.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: vector.len(),
+            });
+        }
+        let idx = self.len();
+        let node = u32::try_from(idx).expect("HNSW index is limited to u32::MAX vectors");
+        let norm = compute_norm(vector);
+        let layer = self.random_layer();
+
+        self.data.extend_from_slice(vector);
+        self.norms.push(norm);
+        self.links.push(vec![Vec::new(); layer + 1]);
+
+        let Some(entry) = self.entry_point else {
+            self.entry_point = Some(node);
+            self.top_layer = layer;
+            return Ok(idx);
+        };
+
+        let mut nearest = self.score(vector, norm, entry);
+        for l in (layer + 1..=self.top_layer).rev() {
+            nearest = self.greedy_closest(vector, norm, nearest, l);
+        }
+
+        let mut entries = vec![nearest];
+        for l in (0..=layer.min(self.top_layer)).rev() {
+            let candidates =
+                self.search_layer(vector, norm, &entries, self.params.ef_construction, l);
+            let neighbours = self.select_neighbours(&candidates, self.params.m);
+            for &n in &neighbours {
+                self.link(n, node, l);
+            }
+            self.links[idx][l] = neighbours;
+            entries = candidates;
+        }
+
+        if layer > self.top_layer {
+            self.top_layer = layer;
+            self.entry_point = Some(node);
+        }
+        Ok(idx)
+    }
+
+    /// Insert a row-major block of vectors (`n * dimensions` floats).
+    /// Returns the range of indices assigned to them.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// if the block length is not a multiple of the index's dimensions
+    pub fn add_batch(&mut self, vectors: &[f32]) -> Result<Range<usize>, VectorStoreError> {
+        self.check_batch(vectors)?;
+        let start = self.len();
+        for vector in vectors.chunks_exact(self.dimensions) {
+            self.add(vector)?;
+        }
+        Ok(start..self.len())
+    }
+
+    /// Approximate top-k search with the index's default `ef_search`
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    pub fn search(&self, query: &[f32], k: usize) -> Result<Vec<SearchResult>, VectorStoreError> {
+        self.search_with_ef(query, k, self.params.ef_search)
+    }
+
+    /// Approximate top-k search keeping `ef` candidates on the bottom layer
+    /// (raised to `k` if smaller). Returns results sorted by similarity.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    pub fn search_with_ef(
+        &self,
+        query: &[f32],
+        k: usize,
+        ef: usize,
+    ) -> Result<Vec<SearchResult>, VectorStoreError> {
+        if query.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: query.len(),
+            });
+        }
+        let Some(entry) = self.entry_point else {
+            return Ok(Vec::new());
+        };
+        if k == 0 {
+            return Ok(Vec::new());
+        }
+
+        let norm = compute_norm(query);
+        let mut nearest = self.score(query, norm, entry);
+        for l in (1..=self.top_layer).rev() {
+            nearest = self.greedy_closest(query, norm, nearest, l);
+        }
+
+        Ok(self
+            .search_layer(query, norm, &[nearest], ef.max(k), 0)
+            .into_iter()
+            .take(k)
+            .map(|s| SearchResult {
+                index: s.id as usize,
+                similarity: s.similarity,
+            })
+            .collect())
+    }
+
+    /// Search a row-major block of queries, spread across threads.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// if the block length is not a multiple of the index's dimensions
+    ///
+    /// # Panics
+    ///
+    /// Panics if a search thread panics
+    pub fn search_batch(
+        &self,
+        queries: &[f32],
+        k: usize,
+        ef: usize,
+    ) -> Result<Vec<Vec<SearchResult>>, VectorStoreError> {
+        self.check_batch(queries)?;
+        let n_queries = queries.len() / self.dimensions;
+        let workers = thread::available_parallelism()
+            .map_or(1, NonZeroUsize::get)
+            .min(n_queries)
+            .max(1);
+        let per_worker = n_queries.div_ceil(workers).max(1) * self.dimensions;
+
+        thread::scope(|s| {
+            let handles: Vec<_> = queries
+                .chunks(per_worker)
+                .map(|block| {
+                    s.spawn(move || {
+                        block
+                            .chunks_exact(self.dimensions)
+                            .map(|q| self.search_with_ef(q, k, ef))
+                            .collect::<Result<Vec<_>, _>>()
+                    })
+                })
+                .collect();
+
+            let mut results = Vec::with_capacity(n_queries);
+            for handle in handles {
+                results.extend(handle.join().expect("search worker panicked")?);
+            }
+            Ok(results)
+        })
+    }
+
+    fn check_batch(&self, block: &[f32]) -> Result<(), VectorStoreError> {
+        if self.dimensions == 0 || !block.len().is_multiple_of(self.dimensions) {
+            return Err(VectorStoreError::RaggedBatch {
+                expected: self.dimensions,
+                len: block.len(),
+            });
+        }
+        Ok(())
+    }
+
+    fn vector(&self, id: u32) -> &[f32] {
+        let i = id as usize;
+        &self.data[i * self.dimensions..(i + 1) * self.dimensions]
+    }
+
+    fn score(&self, query: &[f32], query_norm: f32, id: u32) -> Scored {
+        Scored {
+            similarity: cosine_similarity(
+                query,
+                query_norm,
+                self.vector(id),
+                self.norms[id as usize],
+            ),
+            id,
+        }
+    }
+
+    fn max_links(&self, layer: usize) -> usize {
+        if layer == 0 {
+            self.params.m * 2
+        } else {
+            self.params.m
+        }
+    }
+
+    /// Draw a layer from the exponential distribution with scale 1/ln(M)
+    #[allow(
+        clippy::cast_possible_truncation,
+        clippy::cast_sign_loss,
+        clippy::cast_precision_loss
+    )]
+    fn random_layer(&mut self) -> usize {
+        // splitmix64
+        self.rng = self.rng.wrapping_add(0x9E37_79B9_7F4A_7C15);
+        let mut z = self.rng;
+        z = (z ^ (z >> 30)).wrapping_mul(0xBF58_476D_1CE4_E5B9);
+        z = (z ^ (z >> 27)).wrapping_mul(0x94D0_49BB_1331_11EB);
+        z ^= z >> 31;
+
+        let uniform = ((z >> 11) as f64 + 1.0) / (1u64 << 53) as f64;
+        let scale = 1.0 / (self.params.m as f64).ln();
+        ((-uniform.ln() * scale) as usize).min(MAX_LAYER)
+    }
+
+    /// Hill-climb on one layer until no neighbour is closer
+    fn greedy_closest(
+        &self,
+        query: &[f32],
+        query_norm: f32,
+        start: Scored,
+        layer: usize,
+    ) -> Scored {
+        let mut best = start;
+        loop {
+            let mut improved = false;
+            for &n in &self.links[best.id as usize][layer] {
+                let candidate = self.score(query, query_norm, n);
+                if candidate.similarity > best.similarity {
+                    best = candidate;
+                    improved = true;
+                }
+            }
+            if !improved {
+                return best;
+            }
+        }
+    }
+
+    /// Best-first search on one layer keeping `ef` results.
+    /// Returns them sorted by similarity (highest first).
+    fn search_layer(
+        &self,
+        query: &[f32],
+        query_norm: f32,
+        entries: &[Scored],
+        ef: usize,
+        layer: usize,
+    ) -> Vec<Scored> {
+        let mut visited = Visited::new(self.len());
+        let mut candidates: BinaryHeap<Scored> = BinaryHeap::new();
+        let mut found: BinaryHeap<Reverse<Scored>> = BinaryHeap::new();
+
+        for &entry in entries {
+            if visited.insert(entry.id) {
+                candidates.push(entry);
+                found.push(Reverse(entry));
+            }
+        }
+        while found.len() > ef {
+            let _ = found.pop();
+        }
+
+        while let Some(current) = candidates.pop() {
+            let worst = found.peek().map_or(f32::NEG_INFINITY, |r| r.0.similarity);
+            if current.similarity < worst && found.len() >= ef {
+                break;
+            }
+
+            for &n in &self.links[current.id as usize][layer] {
+                if !visited.insert(n) {
+                    continue;
+                }
+                let scored = self.score(query, query_norm, n);
+                let worst = found.peek().map_or(f32::NEG_INFINITY, |r| r.0.similarity);
+                if found.len() < ef || scored.similarity > worst {
+                    candidates.push(scored);
+                    found.push(Reverse(scored));
+                    if found.len() > ef {
+                        let _ = found.pop();
+                    }
+                }
+            }
+        }
+
+        let mut res: Vec<Scored> = found.into_iter().map(|r| r.0).collect();
+        res.sort_by(|first, second| second.cmp(first));
+        res
+    }
+
+    /// Neighbour selection heuristic: keep a candidate only if it is closer to
+    /// the base node than to anything already kept, which spreads links across
+    /// clusters. Rejected candidates top the list back up to `m`.
+    fn select_neighbours(&self, candidates: &[Scored], m: usize) -> Vec<u32> {
+        let mut kept: Vec<u32> = Vec::with_capacity(m);
+        let mut rejected = Vec::new();
+
+        for candidate in candidates {
+            if kept.len() >= m {
+                break;
+            }
+            let vector = self.vector(candidate.id);
+            let norm = self.norms[candidate.id as usize];
+            let diverse = kept
+                .iter()
+                .all(|&k| self.score(vector, norm, k).similarity < candidate.similarity);
+            if diverse {
+                kept.push(candidate.id);
+            } else {
+                rejected.push(candidate.id);
+            }
+        }
+
+        let room = m.saturating_sub(kept.len());
+        kept.extend(rejected.into_iter().take(room));
+        kept
+    }
+
+    /// Add `to` to the neighbours of `from`, re-pruning if over capacity
+    fn link(&mut self, from: u32, to: u32, layer: usize) {
+        let max = self.max_links(layer);
+        let node = from as usize;
+        self.links[node][layer].push(to);
+        if self.links[node][layer].len() <= max {
+            return;
+        }
+
+        let vector = self.vector(from);
+        let norm = self.norms[node];
+        let mut candidates: Vec<Scored> = self.links[node][layer]
+            .iter()
+            .map(|&n| self.score(vector, norm, n))
+            .collect();
+        candidates.sort_by(|first, second| second.cmp(first));
+        self.links[node][layer] = self.select_neighbours(&candidates, max);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::VectorStore;
+    use approx::assert_relative_eq;
+
+    #[allow(clippy::cast_precision_loss)]
+    fn random_vectors(n: usize, dims: usize, seed: u64) -> Vec<f32> {
+        let mut state = seed;
+        (0..n * dims)
+            .map(|_| {
+                state = state
+                    .wrapping_mul(6_364_136_223_846_793_005)
+                    .wrapping_add(1_442_695_040_888_963_407);
+                ((state >> 40) as f32 / (1u64 << 24) as f32) - 0.5
+            })
+            .collect()
+    }
+
+    fn small_params() -> HnswParams {
+        HnswParams {
+            m: 12,
+            ef_construction: 100,
+            ef_search: 64,
+            ..HnswParams::default()
+        }
+    }
+
+    #[test]
+    fn test_search_empty_index() {
+        let index = HnswIndex::new(3, HnswParams::default());
+        assert!(index.search(&[1.0, 0.0, 0.0], 5).unwrap().is_empty());
+    }
+
+    #[test]
+    fn test_search_single_vector() {
+        let mut index = HnswIndex::new(3, HnswParams::default());
+        assert_eq!(index.add(&[3.5, 4.7, 6.8]).unwrap(), 0);
+
+        let res = index.search(&[3.5, 4.7, 6.8], 1).unwrap();
+        assert_eq!(res[0].index, 0);
+        assert_relative_eq!(res[0].similarity, 1.0);
+    }
+
+    #[test]
+    fn test_add_wrong_dimensions() {
+        let mut index = HnswIndex::new(4, HnswParams::default());
+        assert!(matches!(
+            index.add(&[1.0, 2.0, 3.0]),
+            Err(VectorStoreError::DimensionMismatch {
+                expected: 4,
+                actual: 3
+            })
+        ));
+    }
+
+    #[test]
+    fn test_recall_against_brute_force() {
+        let dims = 16;
+        let data = random_vectors(1000, dims, 7);
+        let queries = random_vectors(20, dims, 11);
+
+        let mut index = HnswIndex::new(dims, small_params());
+        let mut exact = VectorStore::new(dims);
+        let _ = index.add_batch(&data).unwrap();
+        let _ = exact.add_batch(&data).unwrap();
+
+        let k = 10;
+        let approx = index.search_batch(&queries, k, 100).unwrap();
+        let truth = exact.search_batch(&queries, k).unwrap();
+
+        let hits: usize = approx
+            .iter()
+            .zip(&truth)
+            .map(|(a, t)| {
+                a.iter()
+                    .filter(|r| t.iter().any(|x| x.index == r.index))
+                    .count()
+            })
+            .sum();
+        #[allow(clippy::cast_precision_loss)]
+        let recall = hits as f32 / (k * truth.len()) as f32;
+        assert!(recall >= 0.9, "recall@{k} was {recall}");
+
+        for results in &approx {
+            assert_eq!(results.len(), k);
+            assert!(
+                results
+                    .windows(2)
+                    .all(|w| w[0].similarity >= w[1].similarity)
+            );
+        }
+    }
+
+    #[test]
+    fn test_incremental_insert_is_searchable() {
+        let dims = 8;
+        let mut index = HnswIndex::new(dims, small_params());
+        let _ = index.add_batch(&random_vectors(300, dims, 3)).unwrap();
+        let _ = index.search(&random_vectors(1, dims, 5), 5).unwrap();
+
+        let late = random_vectors(1, dims, 99);
+        let idx = index.add(&late).unwrap();
+
+        assert_eq!(idx, 300);
+        assert_eq!(index.search(&late, 1).unwrap()[0].index, 300);
+    }
+
+    #[test]
+    fn test_links_respect_capacity() {
+        let dims = 8;
+        let params = small_params();
+        let mut index = HnswIndex::new(dims, params);
+        let _ = index.add_batch(&random_vectors(500, dims, 21)).unwrap();
+
+        for node in &index.links {
+            for (layer, neighbours) in node.iter().enumerate() {
+                assert!(neighbours.len() <= index.max_links(layer));
+            }
+        }
+    }
+}
@@ -1,21 +1,91 @@
+mod bm25;
+mod filter;
+mod hnsw;
 #[cfg(feature = "python")]
 pub mod python;
+mod quantized;
+mod storage;
 
+pub use bm25::{Bm25Index, Bm25Params, DEFAULT_RRF_K, Fusion, hybrid_search};
+pub use filter::{AttributeValue, Bitmap, Filter};
+pub use hnsw::{HnswIndex, HnswParams};
+pub use quantized::{Quantization, QuantizedStore};
+
+use filter::AttributeIndex;
 use std::cmp::Reverse;
-use std::collections::BinaryHeap;
+use std::collections::{BinaryHeap, HashMap};
+use std::num::NonZeroUsize;
+use std::ops::Range;
+use std::thread;
+use storage::F32Buf;
 use thiserror::Error;
 
+/// Below this many rows per worker, spawning threads costs more than the scan.
+const MIN_ROWS_PER_THREAD: usize = 2048;
+
+/// Queries scored together against each row, so a row is pulled into cache
+/// once per block instead of once per query.
+const QUERY_BLOCK: usize = 16;
+
+/// A filter matching at most 1/`SELECTIVE_FRACTION` of the rows is scored by
+/// visiting just those rows; broader ones scan every row and skip the rest.
+const SELECTIVE_FRACTION: usize = 16;
+
 #[derive(Error, Debug)]
 pub enum VectorStoreError {
     #[error("dimension mismatch: expected {expected}, got {actual}")]
     DimensionMismatch { expected: usize, actual: usize },
+    #[error("dimension mismatch: batch of {len} values is not a multiple of {expected}")]
+    RaggedBatch { expected: usize, len: usize },
+    #[error("io error: {0}")]
+    Io(#[from] std::io::Error),
+    #[error("corrupt store file: {0}")]
+    Corrupt(String),
+    #[error("unsupported store format version {0}")]
+    UnsupportedVersion(u32),
+    #[error("length mismatch: expected {expected} vectors, got {actual}")]
+    LengthMismatch { expected: usize, actual: usize },
+    #[error("index {index} out of range for store of {len} vectors")]
+    OutOfRange { index: usize, len: usize },
+    #[error("vector {index} was removed")]
+    Removed { index: usize },
 }
 
+type TopK = BinaryHeap<Reverse<SearchResult>>;
+
+/// Vectors are addressed by the id `add` returned, which never changes.
+/// Internally each lives in a slot (its row in `data`); ids and slots agree
+/// until [`VectorStore::compact`] closes the holes left by removed vectors.
 pub struct VectorStore {
     dimensions: usize,
-    data: Vec<f32>,
-    norms: Vec<f32>,
+    data: F32Buf,
+    norms: F32Buf,
+    /// Slots in use, removed ones included
     count: usize,
+    /// Tombstones by slot; empty until the first `remove`, and shorter than
+    /// `count` when rows were added since
+    removed: Vec<bool>,
+    removed_count: usize,
+    /// Metadata for filtered search, by slot; kept in memory only, not in
+    /// saved files
+    attributes: AttributeIndex,
+    /// Id of each slot; empty while every slot holds the id equal to it
+    slot_ids: Vec<usize>,
+    /// Inverse of `slot_ids`
+    id_slots: HashMap<usize, usize>,
+    /// Id the next `add` assigns
+    next_id: usize,
+}
+
+/// How much of a store removed vectors take up, to decide when to call
+/// [`VectorStore::compact`].
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub struct Fragmentation {
+    /// Slots in use, removed ones included
+    pub slots: usize,
+    pub removed: usize,
+    /// Bytes of vectors and norms that compaction would free
+    pub reclaimable_bytes: usize,
 }
 
 impl Eq for SearchResult {}
@@ -26,7 +96,15 @@ impl Ord for SearchResult {
     }
 }
 
-#[derive(Debug, Clone, PartialEq, PartialOrd)]
+// BinaryHeap sifts with `<=`, so this must agree with `Ord` (a derived
+// impl would compare `index` first and the heap would keep the newest rows).
+impl PartialOrd for SearchResult {
+    fn partial_cmp(&self, other: &Self) -> Option<std::cmp::Ordering> {
+        Some(self.cmp(other))
+    }
+}
+
+#[derive(Debug, Clone, PartialEq)]
 pub struct SearchResult {
     pub index: usize,
     pub similarity: f32,
@@ -39,13 +117,266 @@ impl VectorStore {
     pub fn new(dimensions: usize) -> Self {
         Self {
             dimensions,
-            data: Vec::new(),
-            norms: Vec::new(),
+            data: F32Buf::default(),
+            norms: F32Buf::default(),
             count: 0,
+            removed: Vec::new(),
+            removed_count: 0,
+            attributes: AttributeIndex::default(),
+            slot_ids: Vec::new(),
+            id_slots: HashMap::new(),
+            next_id: 0,
+        }
+    }
+
+    /// Dimensions of the vectors held by this store
+    #[must_use]
+    pub fn dimensions(&self) -> usize {
+        self.dimensions
+    }
+
+    /// Number of slots in the store. Removed vectors keep theirs until
+    /// [`VectorStore::compact`].
+    #[must_use]
+    pub fn len(&self) -> usize {
+        self.count
+    }
+
+    /// Id the next `add` will assign; every id below it was handed out once
+    #[must_use]
+    pub fn next_id(&self) -> usize {
+        self.next_id
+    }
+
+    #[must_use]
+    pub fn is_empty(&self) -> bool {
+        self.count == 0
+    }
+
+    /// Number of removed vectors still holding a slot. They never appear in
+    /// results, and [`VectorStore::compact`] frees their slots.
+    #[must_use]
+    pub fn removed_count(&self) -> usize {
+        self.removed_count
+    }
+
+    /// Whether `id` was handed out and has since been removed
+    #[must_use]
+    pub fn is_removed(&self, id: usize) -> bool {
+        id < self.next_id && self.slot(id).is_none_or(|slot| self.slot_removed(slot))
+    }
+
+    #[must_use]
+    pub fn fragmentation(&self) -> Fragmentation {
+        Fragmentation {
+            slots: self.count,
+            removed: self.removed_count,
+            reclaimable_bytes: self.removed_count * (self.dimensions + 1) * size_of::<f32>(),
+        }
+    }
+
+    /// Exclude a vector from future searches. Ids are not reused, so the
+    /// other vectors keep theirs. Returns false if it was already removed.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if `id` was never handed out
+    pub fn remove(&mut self, id: usize) -> Result<bool, VectorStoreError> {
+        if id >= self.next_id {
+            return Err(VectorStoreError::OutOfRange {
+                index: id,
+                len: self.next_id,
+            });
+        }
+        let Some(slot) = self.slot(id) else {
+            // Removed, and compacted away since
+            return Ok(false);
+        };
+        if self.removed.len() < self.count {
+            self.removed.resize(self.count, false);
+        }
+        if self.removed[slot] {
+            return Ok(false);
+        }
+        self.removed[slot] = true;
+        self.removed_count += 1;
+        Ok(true)
+    }
+
+    /// Replace the vector stored under `id` in place. Its id, attributes
+    /// and position in the store stay the same.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if the dimensions are wrong, or `id` was never
+    /// handed out or was removed
+    pub fn update(&mut self, id: usize, vector: &[f32]) -> Result<(), VectorStoreError> {
+        if vector.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: vector.len(),
+            });
+        }
+        let slot = self.live_slot(id)?;
+        let dims = self.dimensions;
+        self.data.to_mut()[slot * dims..(slot + 1) * dims].copy_from_slice(vector);
+        self.norms.to_mut()[slot] = compute_norm(vector);
+        Ok(())
+    }
+
+    /// Rewrite `data` and `norms` without the slots of removed vectors.
+    /// Ids are unchanged; only the slots behind them move. Returns the
+    /// number of slots freed.
+    ///
+    /// A mapped store is copied into memory first, as for any write.
+    pub fn compact(&mut self) -> usize {
+        if self.removed_count == 0 {
+            return 0;
+        }
+        let dims = self.dimensions;
+        let live = self.count - self.removed_count;
+        let mut data = Vec::with_capacity(live * dims);
+        let mut norms = Vec::with_capacity(live);
+        let mut slot_ids = Vec::with_capacity(live);
+        // Old slot -> new slot, None for removed vectors
+        let mut moved = Vec::with_capacity(self.count);
+
+        for slot in 0..self.count {
+            if self.slot_removed(slot) {
+                moved.push(None);
+                continue;
+            }
+            moved.push(Some(norms.len()));
+            data.extend_from_slice(&self.data[slot * dims..(slot + 1) * dims]);
+            norms.push(self.norms[slot]);
+            slot_ids.push(self.id(slot));
         }
+
+        self.attributes.compact(&moved);
+        self.data = F32Buf::Owned(data);
+        self.norms = F32Buf::Owned(norms);
+        self.count = live;
+        self.removed = Vec::new();
+        self.removed_count = 0;
+        self.set_slot_ids(slot_ids);
+
+        moved.len() - live
     }
 
-    /// Add a vector to the store. Returns its index.
+    /// Set attributes of the vector `id`, replacing its values for the keys
+    /// given. Repeat a key to give it several values (a note's tags).
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if `id` was never handed out or was removed
+    pub fn set_attributes(
+        &mut self,
+        id: usize,
+        attributes: &[(String, AttributeValue)],
+    ) -> Result<(), VectorStoreError> {
+        let slot = self.live_slot(id)?;
+        self.attributes.set(slot, attributes);
+        Ok(())
+    }
+
+    /// Attributes of the vector `id`, ordered by key
+    #[must_use]
+    pub fn attributes(&self, id: usize) -> Vec<(String, AttributeValue)> {
+        self.slot(id)
+            .map(|slot| self.attributes.get(slot))
+            .unwrap_or_default()
+    }
+
+    /// Number of live vectors that `filter` matches
+    #[must_use]
+    pub fn count_matching(&self, filter: &Filter) -> usize {
+        self.matching(filter).count_ones()
+    }
+
+    /// Slot holding `id`, if it has one
+    fn slot(&self, id: usize) -> Option<usize> {
+        if self.slot_ids.is_empty() {
+            (id < self.count).then_some(id)
+        } else {
+            self.id_slots.get(&id).copied()
+        }
+    }
+
+    fn id(&self, slot: usize) -> usize {
+        self.slot_ids.get(slot).copied().unwrap_or(slot)
+    }
+
+    fn slot_removed(&self, slot: usize) -> bool {
+        self.removed.get(slot).copied().unwrap_or(false)
+    }
+
+    /// Slot of a vector that can still be read or changed
+    fn live_slot(&self, id: usize) -> Result<usize, VectorStoreError> {
+        if id >= self.next_id {
+            return Err(VectorStoreError::OutOfRange {
+                index: id,
+                len: self.next_id,
+            });
+        }
+        match self.slot(id) {
+            Some(slot) if !self.slot_removed(slot) => Ok(slot),
+            _ => Err(VectorStoreError::Removed { index: id }),
+        }
+    }
+
+    /// Install a slot -> id table, dropping it when it is the identity
+    fn set_slot_ids(&mut self, slot_ids: Vec<usize>) {
+        if slot_ids.iter().enumerate().all(|(slot, &id)| slot == id) {
+            self.slot_ids = Vec::new();
+            self.id_slots = HashMap::new();
+        } else {
+            self.id_slots = slot_ids
+                .iter()
+                .enumerate()
+                .map(|(slot, &id)| (id, slot))
+                .collect();
+            self.slot_ids = slot_ids;
+        }
+    }
+
+    /// Give `n` new slots at the end ids from `next_id` on
+    fn assign_ids(&mut self, n: usize) -> Range<usize> {
+        let ids = self.next_id..self.next_id + n;
+        if !self.slot_ids.is_empty() {
+            for id in ids.clone() {
+                self.id_slots.insert(id, self.slot_ids.len());
+                self.slot_ids.push(id);
+            }
+        }
+        self.next_id = ids.end;
+        ids
+    }
+
+    /// Report slots as ids
+    fn with_ids(&self, mut results: Vec<SearchResult>) -> Vec<SearchResult> {
+        if !self.slot_ids.is_empty() {
+            for result in &mut results {
+                result.index = self.slot_ids[result.index];
+            }
+        }
+        results
+    }
+
+    /// Live slots that `filter` matches
+    fn matching(&self, filter: &Filter) -> Bitmap {
+        let mut allowed = self.attributes.evaluate(filter, self.count);
+        for (i, _) in self
+            .removed
+            .iter()
+            .enumerate()
+            .filter(|(_, removed)| **removed)
+        {
+            allowed.remove(i);
+        }
+        allowed
+    }
+
+    /// Add a vector to the store. Returns its id.
     ///
     /// # Errors
     ///
@@ -58,15 +389,32 @@ impl VectorStore {
                 actual: vector.len(),
             });
         }
-        let idx = self.count;
 
-        for &x in vector {
-            self.data.push(x);
-        }
-        self.norms.push(compute_norm(vector));
+        self.data.to_mut().extend_from_slice(vector);
+        self.norms.to_mut().push(compute_norm(vector));
         self.count += 1;
 
-        Ok(idx)
+        Ok(self.assign_ids(1).start)
+    }
+
+    /// Add a row-major block of vectors (`n * dimensions` floats).
+    /// Returns the range of ids assigned to them.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// if the block length is not a multiple of the store's dimensions
+    pub fn add_batch(&mut self, vectors: &[f32]) -> Result<Range<usize>, VectorStoreError> {
+        self.check_batch(vectors)?;
+        let start = self.count;
+
+        self.data.to_mut().extend_from_slice(vectors);
+        self.norms
+            .to_mut()
+            .extend(vectors.chunks_exact(self.dimensions).map(compute_norm));
+        self.count = self.norms.len();
+
+        Ok(self.assign_ids(self.count - start))
     }
 
     /// Search for top-k most similar vectors to query
@@ -76,7 +424,6 @@ impl VectorStore {
     ///
     /// Returns an Error at runtime (PyO3-friendly)
     /// that signifies mismatch of the vector's dimensions
-    #[allow(clippy::missing_panics_doc)]
     pub fn search(&self, query: &[f32], k: usize) -> Result<Vec<SearchResult>, VectorStoreError> {
         if query.len() != self.dimensions {
             return Err(VectorStoreError::DimensionMismatch {
@@ -85,41 +432,221 @@ impl VectorStore {
             });
         }
 
+        Ok(self.search_batch(query, k)?.pop().unwrap_or_default())
+    }
+
+    /// Search a row-major block of queries in one pass over the data.
+    /// Returns one top-k list per query, each sorted by similarity (highest first).
+    ///
+    /// The rows are split into shards scored on separate threads; each shard
+    /// keeps its own heaps and they are merged at the end.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// if the block length is not a multiple of the store's dimensions
+    ///
+    /// # Panics
+    ///
+    /// Panics if a scoring thread panics
+    pub fn search_batch(
+        &self,
+        queries: &[f32],
+        k: usize,
+    ) -> Result<Vec<Vec<SearchResult>>, VectorStoreError> {
+        self.check_batch(queries)?;
+        let query_norms: Vec<f32> = queries
+            .chunks_exact(self.dimensions)
+            .map(compute_norm)
+            .collect();
+
+        Ok(sharded_top_k(self.count, query_norms.len(), k, |rows| {
+            self.scan_rows(queries, &query_norms, rows, k, None)
+        })
+        .into_iter()
+        .map(|results| self.with_ids(results))
+        .collect())
+    }
+
+    /// Top-k search over the vectors whose attributes match `filter`.
+    ///
+    /// The filter becomes a bitmap before anything is scored, so a result
+    /// list is only short when fewer than k vectors match. A selective
+    /// filter gathers the matching rows and scores just those; a broad one
+    /// runs the usual sharded scan and skips rows outside the bitmap.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    pub fn search_filtered(
+        &self,
+        query: &[f32],
+        k: usize,
+        filter: &Filter,
+    ) -> Result<Vec<SearchResult>, VectorStoreError> {
+        if query.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: query.len(),
+            });
+        }
+        let allowed = self.matching(filter);
         let query_norm = compute_norm(query);
-        let mut min_heap = BinaryHeap::new();
-
-        for i in 0..self.count {
-            let cos_sim = cosine_similarity(
-                query,
-                query_norm,
-                &self.data[i * self.dimensions..(i + 1) * self.dimensions],
-                self.norms[i],
-            );
-
-            min_heap.push(Reverse(SearchResult {
-                index: i,
-                similarity: cos_sim,
-            }));
-            if min_heap.len() > k {
-                let _ = min_heap.pop();
+
+        let mut results = if allowed.count_ones() * SELECTIVE_FRACTION <= self.count {
+            let rows: Vec<usize> = allowed.iter_ones().collect();
+            sharded_top_k(rows.len(), 1, k, |shard| {
+                let mut heap = BinaryHeap::new();
+                for &i in &rows[shard] {
+                    let row = &self.data[i * self.dimensions..(i + 1) * self.dimensions];
+                    let similarity = cosine_similarity(query, query_norm, row, self.norms[i]);
+                    push_top_k(
+                        &mut heap,
+                        SearchResult {
+                            index: i,
+                            similarity,
+                        },
+                        k,
+                    );
+                }
+                vec![heap]
+            })
+        } else {
+            sharded_top_k(self.count, 1, k, |rows| {
+                self.scan_rows(query, &[query_norm], rows, k, Some(&allowed))
+            })
+        };
+        Ok(self.with_ids(results.pop().unwrap_or_default()))
+    }
+
+    /// Score `rows` against every query, one top-k heap per query. With
+    /// `allowed`, rows outside it are skipped.
+    fn scan_rows(
+        &self,
+        queries: &[f32],
+        query_norms: &[f32],
+        rows: Range<usize>,
+        k: usize,
+        allowed: Option<&Bitmap>,
+    ) -> Vec<TopK> {
+        let dims = self.dimensions;
+        let mut heaps: Vec<TopK> = (0..query_norms.len()).map(|_| BinaryHeap::new()).collect();
+
+        for (block, block_queries) in queries.chunks(QUERY_BLOCK * dims).enumerate() {
+            let first = block * QUERY_BLOCK;
+            for i in rows.clone() {
+                if self.slot_removed(i) || allowed.is_some_and(|a| !a.contains(i)) {
+                    continue;
+                }
+                let row = &self.data[i * dims..(i + 1) * dims];
+                for (j, query) in block_queries.chunks_exact(dims).enumerate() {
+                    let q = first + j;
+                    let cos_sim = cosine_similarity(query, query_norms[q], row, self.norms[i]);
+                    push_top_k(
+                        &mut heaps[q],
+                        SearchResult {
+                            index: i,
+                            similarity: cos_sim,
+                        },
+                        k,
+                    );
+                }
             }
         }
 
-        let mut res: Vec<SearchResult> = min_heap.into_vec().into_iter().map(|r| r.0).collect();
-        res.sort_by(|first, second| second.cmp(first));
+        heaps
+    }
 
-        Ok(res)
+    fn check_batch(&self, block: &[f32]) -> Result<(), VectorStoreError> {
+        if self.dimensions == 0 || !block.len().is_multiple_of(self.dimensions) {
+            return Err(VectorStoreError::RaggedBatch {
+                expected: self.dimensions,
+                len: block.len(),
+            });
+        }
+        Ok(())
+    }
+}
+
+fn worker_count(rows: usize) -> usize {
+    let cores = thread::available_parallelism().map_or(1, NonZeroUsize::get);
+    cores.min(rows / MIN_ROWS_PER_THREAD).max(1)
+}
+
+/// Split `0..rows` into shards, score each on its own thread with
+/// `scan(shard)` (one heap per query) and merge the shards' heaps.
+fn sharded_top_k<F>(rows: usize, n_queries: usize, k: usize, scan: F) -> Vec<Vec<SearchResult>>
+where
+    F: Fn(Range<usize>) -> Vec<TopK> + Sync,
+{
+    let shards = worker_count(rows);
+    let shard_rows = rows.div_ceil(shards).max(1);
+
+    let partials: Vec<Vec<TopK>> = if shards == 1 {
+        vec![scan(0..rows)]
+    } else {
+        thread::scope(|s| {
+            let handles: Vec<_> = (0..rows)
+                .step_by(shard_rows)
+                .map(|start| {
+                    let scan = &scan;
+                    s.spawn(move || scan(start..(start + shard_rows).min(rows)))
+                })
+                .collect();
+            handles
+                .into_iter()
+                .map(|h| h.join().expect("search worker panicked"))
+                .collect()
+        })
+    };
+
+    let mut merged: Vec<TopK> = (0..n_queries).map(|_| BinaryHeap::new()).collect();
+    for shard in partials {
+        for (heap, partial) in merged.iter_mut().zip(shard) {
+            for Reverse(result) in partial {
+                push_top_k(heap, result, k);
+            }
+        }
+    }
+
+    merged.into_iter().map(into_sorted).collect()
+}
+
+fn push_top_k(heap: &mut TopK, result: SearchResult, k: usize) {
+    heap.push(Reverse(result));
+    if heap.len() > k {
+        let _ = heap.pop();
     }
 }
 
-// Helper functions you'll need (private):
+fn into_sorted(heap: TopK) -> Vec<SearchResult> {
+    let mut res: Vec<SearchResult> = heap.into_vec().into_iter().map(|r| r.0).collect();
+    res.sort_by(|first, second| second.cmp(first));
+    res
+}
+
+/// Independent accumulators per lane: without them the sum is one serial
+/// dependency chain that LLVM may not reorder, so it cannot vectorize.
+const LANES: usize = 8;
+
 fn compute_dot(a: &[f32], b: &[f32]) -> f32 {
-    a.iter().zip(b.iter()).map(|(x, y)| x * y).sum()
+    let mut acc = [0.0f32; LANES];
+    let (a_rest, b_rest) = (
+        a.chunks_exact(LANES).remainder(),
+        b.chunks_exact(LANES).remainder(),
+    );
+    for (x, y) in a.chunks_exact(LANES).zip(b.chunks_exact(LANES)) {
+        for lane in 0..LANES {
+            acc[lane] += x[lane] * y[lane];
+        }
+    }
+    let tail: f32 = a_rest.iter().zip(b_rest).map(|(x, y)| x * y).sum();
+    acc.iter().sum::<f32>() + tail
 }
 
 fn compute_norm(v: &[f32]) -> f32 {
-    let res: f32 = v.iter().fold(0.0, |acc, &x| acc + x.powi(2));
-    res.sqrt()
+    compute_dot(v, v).sqrt()
 }
 
 fn cosine_similarity(a: &[f32], a_norm: f32, b: &[f32], b_norm: f32) -> f32 {
@@ -223,6 +750,254 @@ mod tests {
         assert_eq!(res.len(), 2);
     }
 
+    #[test]
+    fn test_search_top_k_keeps_best_not_newest() {
+        let mut store = VectorStore::new(2);
+
+        let _ = store.add(&[1.0, 0.0]);
+        let _ = store.add(&[0.0, 1.0]);
+        let _ = store.add(&[-1.0, 0.0]);
+        let res = store.search(&[1.0, 0.1], 1).unwrap();
+
+        assert_eq!(res[0].index, 0);
+    }
+
+    #[test]
+    fn test_add_batch_assigns_sequential_indices() {
+        let mut store = VectorStore::new(2);
+        let _ = store.add(&[1.0, 0.0]).unwrap();
+
+        let range = store.add_batch(&[0.0, 1.0, 0.5, 0.5, 1.0, 1.0]).unwrap();
+
+        assert_eq!(range, 1..4);
+        assert_eq!(store.add(&[2.0, 1.0]).unwrap(), 4);
+    }
+
+    #[test]
+    fn test_add_batch_ragged() {
+        let mut store = VectorStore::new(3);
+        let err = store.add_batch(&[1.0, 2.0, 3.0, 4.0]).unwrap_err();
+
+        assert!(matches!(
+            err,
+            VectorStoreError::RaggedBatch {
+                expected: 3,
+                len: 4
+            }
+        ));
+        assert_eq!(store.count, 0);
+    }
+
+    #[test]
+    fn test_removed_vectors_are_skipped() {
+        let mut store = VectorStore::new(2);
+        let _ = store.add_batch(&[1.0, 0.0, 0.9, 0.1, 0.0, 1.0]).unwrap();
+
+        assert!(store.remove(0).unwrap());
+        assert!(!store.remove(0).unwrap());
+        let res = store.search(&[1.0, 0.0], 3).unwrap();
+
+        assert_eq!(res.len(), 2);
+        assert_eq!(res[0].index, 1);
+        assert_eq!(store.len(), 3);
+        assert_eq!(store.removed_count(), 1);
+
+        // Rows added after a removal are searchable and keep fresh indices
+        assert_eq!(store.add(&[1.0, 0.0]).unwrap(), 3);
+        assert_eq!(store.search(&[1.0, 0.0], 1).unwrap()[0].index, 3);
+        assert!(matches!(
+            store.remove(4),
+            Err(VectorStoreError::OutOfRange { index: 4, len: 4 })
+        ));
+    }
+
+    /// 4096 vectors in 64 folders, so one folder is selective and the
+    /// complement is broad; both must agree with filtering an exhaustive search
+    #[test]
+    fn test_filtered_search_matches_post_filtering() {
+        let dims = 8;
+        let mut state = 7u64;
+        let mut next = || {
+            state = state
+                .wrapping_mul(6_364_136_223_846_793_005)
+                .wrapping_add(1_442_695_040_888_963_407);
+            f32::from(u16::try_from(state >> 48).unwrap()) / 65535.0 - 0.5
+        };
+        let data: Vec<f32> = (0..4096 * dims).map(|_| next()).collect();
+        let query: Vec<f32> = (0..dims).map(|_| next()).collect();
+        let mut store = VectorStore::new(dims);
+        let _ = store.add_batch(&data).unwrap();
+        for i in 0..4096 {
+            let folder = format!("week-{}", i % 64);
+            store
+                .set_attributes(i, &[("folder".to_owned(), folder.into())])
+                .unwrap();
+        }
+        for i in (0..4096).step_by(5) {
+            let _ = store.remove(i).unwrap();
+        }
+
+        let selective = Filter::Eq("folder".into(), "week-3".into());
+        let broad = Filter::Not(Box::new(selective.clone()));
+        let everything = store.search(&query, 4096).unwrap();
+        for filter in [selective, broad] {
+            let allowed = store.matching(&filter);
+            assert_eq!(store.count_matching(&filter), allowed.count_ones());
+            let expected: Vec<usize> = everything
+                .iter()
+                .map(|r| r.index)
+                .filter(|&i| allowed.contains(i))
+                .take(10)
+                .collect();
+            let got: Vec<usize> = store
+                .search_filtered(&query, 10, &filter)
+                .unwrap()
+                .iter()
+                .map(|r| r.index)
+                .collect();
+            assert_eq!(got, expected);
+            assert!(got.iter().all(|&i| i % 64 == 3) || got.iter().all(|&i| i % 64 != 3));
+            assert!(got.iter().all(|&i| !store.is_removed(i)));
+        }
+    }
+
+    #[test]
+    fn test_update_replaces_vector_in_place() {
+        let mut store = VectorStore::new(2);
+        let _ = store.add_batch(&[1.0, 0.0, 0.0, 1.0]).unwrap();
+        store.update(0, &[0.0, 2.0]).unwrap();
+
+        let res = store.search(&[0.0, 1.0], 2).unwrap();
+        assert_relative_eq!(res[0].similarity, 1.0);
+        assert_relative_eq!(res[1].similarity, 1.0);
+        assert_eq!(store.len(), 2);
+
+        let _ = store.remove(1).unwrap();
+        assert!(matches!(
+            store.update(1, &[1.0, 0.0]),
+            Err(VectorStoreError::Removed { index: 1 })
+        ));
+        assert!(matches!(
+            store.update(2, &[1.0, 0.0]),
+            Err(VectorStoreError::OutOfRange { index: 2, len: 2 })
+        ));
+    }
+
+    #[test]
+    fn test_compact_keeps_ids_and_attributes() {
+        let mut store = VectorStore::new(2);
+        let _ = store
+            .add_batch(&[1.0, 0.0, 0.9, 0.1, 0.8, 0.2, 0.0, 1.0])
+            .unwrap();
+        for id in 0..4 {
+            let parity = if id % 2 == 0 { "even" } else { "odd" };
+            store
+                .set_attributes(id, &[("parity".into(), parity.into())])
+                .unwrap();
+        }
+        let _ = store.remove(0).unwrap();
+        let _ = store.remove(2).unwrap();
+        assert_eq!(
+            store.fragmentation(),
+            Fragmentation {
+                slots: 4,
+                removed: 2,
+                reclaimable_bytes: 2 * 3 * 4,
+            }
+        );
+
+        assert_eq!(store.compact(), 2);
+        assert_eq!(store.compact(), 0);
+        assert_eq!(store.len(), 2);
+        assert_eq!(store.removed_count(), 0);
+        assert!(store.is_removed(0));
+        assert!(!store.is_removed(1));
+        assert!(!store.remove(2).unwrap());
+
+        let res = store.search(&[1.0, 0.0], 4).unwrap();
+        assert_eq!(res.iter().map(|r| r.index).collect::<Vec<_>>(), vec![1, 3]);
+        let odd = Filter::Eq("parity".into(), "odd".into());
+        assert_eq!(store.count_matching(&odd), 2);
+        assert_eq!(
+            store.attributes(3),
+            vec![("parity".to_owned(), AttributeValue::from("odd"))]
+        );
+
+        // New vectors continue the id sequence, and every id still resolves
+        assert_eq!(store.add(&[0.5, 0.5]).unwrap(), 4);
+        store.update(3, &[1.0, 0.0]).unwrap();
+        assert_eq!(store.search(&[1.0, 0.0], 1).unwrap()[0].index, 3);
+        assert!(store.remove(4).unwrap());
+        assert_eq!(store.search(&[1.0, 1.0], 3).unwrap().len(), 2);
+    }
+
+    #[test]
+    fn test_set_attributes_out_of_range() {
+        let mut store = VectorStore::new(2);
+        let _ = store.add(&[1.0, 0.0]).unwrap();
+        store
+            .set_attributes(0, &[("tags".into(), "rust".into())])
+            .unwrap();
+        assert_eq!(
+            store.attributes(0),
+            vec![("tags".to_owned(), AttributeValue::from("rust"))]
+        );
+        assert!(matches!(
+            store.set_attributes(1, &[]),
+            Err(VectorStoreError::OutOfRange { index: 1, len: 1 })
+        ));
+        let none = Filter::Eq("tags".into(), "python".into());
+        assert!(
+            store
+                .search_filtered(&[1.0, 0.0], 3, &none)
+                .unwrap()
+                .is_empty()
+        );
+    }
+
+    #[test]
+    fn test_search_batch_matches_single_search() {
+        // Enough rows to take the multi-threaded path
+        #![allow(clippy::cast_precision_loss)]
+        let dims = 8;
+        let mut store = VectorStore::new(dims);
+        let rows: Vec<f32> = (0..MIN_ROWS_PER_THREAD * 4 * dims)
+            .map(|i| ((i * 7919) % 101) as f32 - 50.0)
+            .collect();
+        let _ = store.add_batch(&rows).unwrap();
+
+        let queries: Vec<f32> = (0..(QUERY_BLOCK + 3) * dims)
+            .map(|i| ((i * 31) % 17) as f32 - 8.0)
+            .collect();
+        let batched = store.search_batch(&queries, 5).unwrap();
+
+        assert_eq!(batched.len(), QUERY_BLOCK + 3);
+        for (query, results) in queries.chunks_exact(dims).zip(&batched) {
+            assert_eq!(results, &store.search(query, 5).unwrap());
+            let single: Vec<SearchResult> = (0..store.count)
+                .map(|i| SearchResult {
+                    index: i,
+                    similarity: cosine_similarity(
+                        query,
+                        compute_norm(query),
+                        &rows[i * dims..(i + 1) * dims],
+                        store.norms[i],
+                    ),
+                })
+                .collect();
+            let best = single.iter().max_by(Ord::cmp).unwrap();
+            assert_relative_eq!(results[0].similarity, best.similarity);
+        }
+    }
+
+    #[test]
+    fn test_search_batch_empty_store() {
+        let store = VectorStore::new(2);
+        let res = store.search_batch(&[1.0, 0.0, 0.0, 1.0], 3).unwrap();
+
+        assert_eq!(res, vec![Vec::new(), Vec::new()]);
+    }
+
     #[test]
     fn test_cosine_similarity_parallel_vectors() {
         // Test [1,0] and [2,0] → should be 1.0
@@ -1,5 +1,11 @@
-use super::VectorStore;
-use pyo3::{exceptions, prelude::*};
+use super::{
+    AttributeValue, Bm25Index, Bm25Params, Filter, Fusion, HnswIndex, HnswParams, Quantization,
+    QuantizedStore, SearchResult, VectorStore, VectorStoreError, hybrid_search as fuse_rankings,
+};
+use numpy::{IntoPyArray, PyArrayMethods};
+use pyo3::{buffer::PyBuffer, exceptions, prelude::*, types::PyDict};
+use std::collections::HashMap;
+use std::path::PathBuf;
 
 #[pyclass(name = "VectorStore")]
 struct PyVectorStore {
@@ -15,26 +21,568 @@ impl PyVectorStore {
         }
     }
 
+    /// Open a store written by `save`. With `mmap=True` (the default) the
+    /// vectors are paged in from disk on demand; `verify=True` also checks
+    /// the payload checksum, which reads the whole file.
+    #[staticmethod]
+    #[pyo3(signature = (path, mmap = true, verify = false))]
     #[allow(clippy::needless_pass_by_value)]
-    fn add(&mut self, vector: Vec<f32>) -> PyResult<usize> {
+    fn open(py: Python<'_>, path: PathBuf, mmap: bool, verify: bool) -> PyResult<Self> {
+        let inner = py
+            .detach(|| VectorStore::open(&path, mmap, verify))
+            .map_err(to_py_err)?;
+        Ok(Self { inner })
+    }
+
+    #[allow(clippy::needless_pass_by_value)]
+    fn save(&self, py: Python<'_>, path: PathBuf) -> PyResult<()> {
+        let inner = &self.inner;
+        py.detach(|| inner.save(&path)).map_err(to_py_err)
+    }
+
+    fn verify(&self, py: Python<'_>) -> PyResult<()> {
+        let inner = &self.inner;
+        py.detach(|| inner.verify()).map_err(to_py_err)
+    }
+
+    #[getter]
+    fn dimensions(&self) -> usize {
+        self.inner.dimensions()
+    }
+
+    #[getter]
+    fn is_mapped(&self) -> bool {
+        self.inner.is_mapped()
+    }
+
+    #[getter]
+    fn removed_count(&self) -> usize {
+        self.inner.removed_count()
+    }
+
+    /// Id the next `add` will assign
+    #[getter]
+    fn next_id(&self) -> usize {
+        self.inner.next_id()
+    }
+
+    /// Slots in use, removed vectors included until `compact`
+    fn __len__(&self) -> usize {
+        self.inner.len()
+    }
+
+    /// Drop a vector from search results; the other ids are unchanged.
+    /// Returns False if it was already removed.
+    fn remove(&mut self, index: usize) -> PyResult<bool> {
+        self.inner.remove(index).map_err(to_py_err)
+    }
+
+    /// Replace a vector in place, keeping its id and attributes
+    fn update(&mut self, py: Python<'_>, index: usize, vector: &Bound<'_, PyAny>) -> PyResult<()> {
+        let vector = extract_vector(py, vector)?;
+        self.inner.update(index, &vector).map_err(to_py_err)
+    }
+
+    /// Rewrite the vectors without the slots of removed ones, with the GIL
+    /// released. Ids do not change. Returns the number of slots freed.
+    fn compact(&mut self, py: Python<'_>) -> usize {
+        let inner = &mut self.inner;
+        py.detach(|| inner.compact())
+    }
+
+    /// `slots`, `live`, `removed`, `removed_fraction` and
+    /// `reclaimable_bytes`, to decide when to `compact`
+    #[allow(clippy::cast_precision_loss)]
+    fn fragmentation<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyDict>> {
+        let stats = self.inner.fragmentation();
+        let dict = PyDict::new(py);
+        dict.set_item("slots", stats.slots)?;
+        dict.set_item("live", stats.slots - stats.removed)?;
+        dict.set_item("removed", stats.removed)?;
+        dict.set_item(
+            "removed_fraction",
+            stats.removed as f64 / stats.slots.max(1) as f64,
+        )?;
+        dict.set_item("reclaimable_bytes", stats.reclaimable_bytes)?;
+        Ok(dict)
+    }
+
+    fn is_removed(&self, index: usize) -> bool {
+        self.inner.is_removed(index)
+    }
+
+    /// Add a vector, optionally with a dict of attributes to filter on:
+    /// str or int values, or lists of them (`{"folder": "week-15",
+    /// "tags": ["rust", "async"], "modified": 1718000000}`).
+    #[pyo3(signature = (vector, attributes = None))]
+    fn add(
+        &mut self,
+        py: Python<'_>,
+        vector: &Bound<'_, PyAny>,
+        attributes: Option<&Bound<'_, PyAny>>,
+    ) -> PyResult<usize> {
+        let vector = extract_vector(py, vector)?;
+        let attributes = attributes.map(extract_attributes).transpose()?;
+        let index = self.inner.add(&vector).map_err(to_py_err)?;
+        if let Some(attributes) = attributes {
+            self.inner
+                .set_attributes(index, &attributes)
+                .map_err(to_py_err)?;
+        }
+        Ok(index)
+    }
+
+    /// Add an N x D block of vectors (2-D float32 array or list of lists)
+    /// in one call, with an optional list of N attribute dicts. Returns the
+    /// indices assigned to them.
+    #[pyo3(signature = (vectors, attributes = None))]
+    fn add_many(
+        &mut self,
+        py: Python<'_>,
+        vectors: &Bound<'_, PyAny>,
+        attributes: Option<Vec<Option<Bound<'_, PyAny>>>>,
+    ) -> PyResult<Vec<usize>> {
+        let vectors = extract_matrix(py, vectors, self.inner.dimensions())?;
+        let attributes = attributes
+            .map(|rows| {
+                rows.iter()
+                    .map(|row| row.as_ref().map(extract_attributes).transpose())
+                    .collect::<PyResult<Vec<_>>>()
+            })
+            .transpose()?;
+        if let Some(rows) = &attributes {
+            let expected = vectors.len() / self.inner.dimensions().max(1);
+            if rows.len() != expected {
+                return Err(to_py_err(VectorStoreError::LengthMismatch {
+                    expected,
+                    actual: rows.len(),
+                }));
+            }
+        }
+        let inner = &mut self.inner;
+        let indices = py.detach(|| inner.add_batch(&vectors)).map_err(to_py_err)?;
+
+        for (index, row) in indices.clone().zip(attributes.into_iter().flatten()) {
+            if let Some(row) = row {
+                self.inner.set_attributes(index, &row).map_err(to_py_err)?;
+            }
+        }
+        Ok(indices.collect())
+    }
+
+    /// Replace the vector's values for the attribute keys given; other keys
+    /// keep theirs.
+    fn set_attributes(&mut self, index: usize, attributes: &Bound<'_, PyAny>) -> PyResult<()> {
+        let attributes = extract_attributes(attributes)?;
         self.inner
-            .add(&vector)
-            .map_err(|e| PyErr::new::<exceptions::PyValueError, _>(e.to_string()))
+            .set_attributes(index, &attributes)
+            .map_err(to_py_err)
+    }
+
+    /// The vector's attributes. Keys with several values map to a list.
+    fn get_attributes<'py>(&self, py: Python<'py>, index: usize) -> PyResult<Bound<'py, PyDict>> {
+        let mut grouped: Vec<(String, Vec<AttributeValue>)> = Vec::new();
+        for (key, value) in self.inner.attributes(index) {
+            match grouped.last_mut() {
+                Some((last, values)) if *last == key => values.push(value),
+                _ => grouped.push((key, vec![value])),
+            }
+        }
+        let dict = PyDict::new(py);
+        for (key, mut values) in grouped {
+            if values.len() == 1 {
+                dict.set_item(key, attribute_to_py(py, values.pop().unwrap())?)?;
+            } else {
+                let values = values
+                    .into_iter()
+                    .map(|value| attribute_to_py(py, value))
+                    .collect::<PyResult<Vec<_>>>()?;
+                dict.set_item(key, values)?;
+            }
+        }
+        Ok(dict)
+    }
+
+    /// Number of live vectors matching `filter` (see `search`)
+    fn count(&self, filter: &Bound<'_, PyAny>) -> PyResult<usize> {
+        let filter = extract_filter(filter)?;
+        Ok(self.inner.count_matching(&filter))
+    }
+
+    /// Top-k search. With `as_numpy=True` the results come back as an
+    /// `(indices, similarities)` pair of NumPy arrays instead of a list of
+    /// `PySearchResult` objects.
+    ///
+    /// `filter` restricts the search to vectors whose attributes match, so
+    /// k results come back whenever k vectors match. Each key is a
+    /// condition and all must hold: a value (`{"folder": "week-15"}`), a
+    /// list meaning any of them (`{"tags": ["rust", "async"]}`), or integer
+    /// bounds (`{"modified": {"gte": start, "lt": end}}`). `"$or"` takes a
+    /// list of filters and `"$not"` a filter.
+    #[pyo3(signature = (query, k, as_numpy = false, filter = None))]
+    fn search(
+        &self,
+        py: Python<'_>,
+        query: &Bound<'_, PyAny>,
+        k: usize,
+        as_numpy: bool,
+        filter: Option<&Bound<'_, PyAny>>,
+    ) -> PyResult<Py<PyAny>> {
+        let query = extract_vector(py, query)?;
+        let filter = filter.map(extract_filter).transpose()?;
+        let inner = &self.inner;
+        let results = py
+            .detach(|| match &filter {
+                Some(filter) => inner.search_filtered(&query, k, filter),
+                None => inner.search(&query, k),
+            })
+            .map_err(to_py_err)?;
+
+        results_to_py(py, results, as_numpy)
     }
 
-    fn search(&self, query: Vec<f32>, k: usize) -> PyResult<Vec<PySearchResult>> {
-        let results = self
-            .inner
-            .search(&query, k)
-            .map_err(|e| PyErr::new::<exceptions::PyValueError, _>(e.to_string()))?;
+    /// Score a Q x D block of queries in one pass, with the GIL released.
+    /// Returns one result list per query, or with `as_numpy=True` a pair of
+    /// Q x k `(indices, similarities)` arrays.
+    #[pyo3(signature = (queries, k, as_numpy = false))]
+    fn search_many(
+        &self,
+        py: Python<'_>,
+        queries: &Bound<'_, PyAny>,
+        k: usize,
+        as_numpy: bool,
+    ) -> PyResult<Py<PyAny>> {
+        let queries = extract_matrix(py, queries, self.inner.dimensions())?;
+        let inner = &self.inner;
+        let batches = py
+            .detach(|| inner.search_batch(&queries, k))
+            .map_err(to_py_err)?;
 
-        Ok(results
+        if as_numpy {
+            // Every query sees the same rows, so every list has the same length
+            let rows = batches.len();
+            let width = batches.first().map_or(0, Vec::len);
+            let (indices, similarities): (Vec<usize>, Vec<f32>) = batches
+                .into_iter()
+                .flatten()
+                .map(|r| (r.index, r.similarity))
+                .unzip();
+            let pair = (
+                indices.into_pyarray(py).reshape([rows, width])?,
+                similarities.into_pyarray(py).reshape([rows, width])?,
+            );
+            return Ok(pair.into_pyobject(py)?.into_any().unbind());
+        }
+
+        let lists = batches
+            .into_iter()
+            .map(|results| results_to_py(py, results, false))
+            .collect::<PyResult<Vec<_>>>()?;
+        Ok(lists.into_pyobject(py)?.unbind())
+    }
+}
+
+/// Approximate nearest-neighbour index with the same add/search API as
+/// `VectorStore`. `ef_search` trades recall for latency per query.
+#[pyclass(name = "HnswIndex")]
+struct PyHnswIndex {
+    inner: HnswIndex,
+}
+
+#[pymethods]
+impl PyHnswIndex {
+    #[new]
+    #[pyo3(signature = (dimensions, m = 16, ef_construction = 200, ef_search = 64, seed = 0x5EED))]
+    fn new(
+        dimensions: usize,
+        m: usize,
+        ef_construction: usize,
+        ef_search: usize,
+        seed: u64,
+    ) -> Self {
+        Self {
+            inner: HnswIndex::new(
+                dimensions,
+                HnswParams {
+                    m,
+                    ef_construction,
+                    ef_search,
+                    seed,
+                },
+            ),
+        }
+    }
+
+    #[getter]
+    fn dimensions(&self) -> usize {
+        self.inner.dimensions()
+    }
+
+    #[getter]
+    fn ef_search(&self) -> usize {
+        self.inner.params().ef_search
+    }
+
+    #[setter]
+    fn set_ef_search(&mut self, ef_search: usize) {
+        self.inner.set_ef_search(ef_search);
+    }
+
+    fn __len__(&self) -> usize {
+        self.inner.len()
+    }
+
+    fn add(&mut self, py: Python<'_>, vector: &Bound<'_, PyAny>) -> PyResult<usize> {
+        let vector = extract_vector(py, vector)?;
+        let inner = &mut self.inner;
+        py.detach(|| inner.add(&vector)).map_err(to_py_err)
+    }
+
+    fn add_many(&mut self, py: Python<'_>, vectors: &Bound<'_, PyAny>) -> PyResult<Vec<usize>> {
+        let vectors = extract_matrix(py, vectors, self.inner.dimensions())?;
+        let inner = &mut self.inner;
+        let indices = py.detach(|| inner.add_batch(&vectors)).map_err(to_py_err)?;
+
+        Ok(indices.collect())
+    }
+
+    /// Approximate top-k search. `ef_search` overrides the index default
+    /// for this call only.
+    #[pyo3(signature = (query, k, ef_search = None, as_numpy = false))]
+    fn search(
+        &self,
+        py: Python<'_>,
+        query: &Bound<'_, PyAny>,
+        k: usize,
+        ef_search: Option<usize>,
+        as_numpy: bool,
+    ) -> PyResult<Py<PyAny>> {
+        let query = extract_vector(py, query)?;
+        let inner = &self.inner;
+        let ef = ef_search.unwrap_or(inner.params().ef_search);
+        let results = py
+            .detach(|| inner.search_with_ef(&query, k, ef))
+            .map_err(to_py_err)?;
+
+        results_to_py(py, results, as_numpy)
+    }
+
+    #[pyo3(signature = (queries, k, ef_search = None))]
+    fn search_many(
+        &self,
+        py: Python<'_>,
+        queries: &Bound<'_, PyAny>,
+        k: usize,
+        ef_search: Option<usize>,
+    ) -> PyResult<Py<PyAny>> {
+        let queries = extract_matrix(py, queries, self.inner.dimensions())?;
+        let inner = &self.inner;
+        let ef = ef_search.unwrap_or(inner.params().ef_search);
+        let batches = py
+            .detach(|| inner.search_batch(&queries, k, ef))
+            .map_err(to_py_err)?;
+
+        let lists = batches
             .into_iter()
-            .map(|r| PySearchResult {
-                index: r.index,
-                similarity: r.similarity,
+            .map(|results| results_to_py(py, results, false))
+            .collect::<PyResult<Vec<_>>>()?;
+        Ok(lists.into_pyobject(py)?.unbind())
+    }
+}
+
+/// Vector store holding f16 or int8 codes instead of f32. Attach the
+/// full-precision store saved on disk to rescore the top candidates exactly.
+#[pyclass(name = "QuantizedVectorStore")]
+struct PyQuantizedVectorStore {
+    inner: QuantizedStore,
+}
+
+#[pymethods]
+impl PyQuantizedVectorStore {
+    #[new]
+    #[pyo3(signature = (dimensions, mode = "int8", rescore_factor = 4))]
+    fn new(dimensions: usize, mode: &str, rescore_factor: usize) -> PyResult<Self> {
+        let mut inner = QuantizedStore::new(dimensions, parse_quantization(mode)?);
+        inner.set_rescore_factor(rescore_factor);
+        Ok(Self { inner })
+    }
+
+    /// Quantize every live vector of an existing `VectorStore`; results
+    /// keep its ids
+    #[staticmethod]
+    #[pyo3(signature = (store, mode = "int8", rescore_factor = 4))]
+    #[allow(clippy::needless_pass_by_value)]
+    fn from_store(
+        py: Python<'_>,
+        store: PyRef<'_, PyVectorStore>,
+        mode: &str,
+        rescore_factor: usize,
+    ) -> PyResult<Self> {
+        let quantization = parse_quantization(mode)?;
+        let source = &store.inner;
+        let mut inner = py.detach(|| QuantizedStore::from_store(source, quantization));
+        inner.set_rescore_factor(rescore_factor);
+        Ok(Self { inner })
+    }
+
+    /// Memory-map a store written by `VectorStore.save` and use it to
+    /// rescore candidates. It must hold the same vectors as this store.
+    #[allow(clippy::needless_pass_by_value)]
+    fn attach_full_precision(&mut self, py: Python<'_>, path: PathBuf) -> PyResult<()> {
+        let full = py
+            .detach(|| VectorStore::open(&path, true, false))
+            .map_err(to_py_err)?;
+        self.inner.attach_full_precision(full).map_err(to_py_err)
+    }
+
+    #[getter]
+    fn dimensions(&self) -> usize {
+        self.inner.dimensions()
+    }
+
+    #[getter]
+    fn mode(&self) -> &'static str {
+        match self.inner.quantization() {
+            Quantization::F16 => "f16",
+            Quantization::Int8 => "int8",
+        }
+    }
+
+    #[getter]
+    fn has_full_precision(&self) -> bool {
+        self.inner.has_full_precision()
+    }
+
+    /// Bytes held in memory by the codes, scales, norms and ids
+    fn memory_bytes(&self) -> usize {
+        self.inner.memory_bytes()
+    }
+
+    fn __len__(&self) -> usize {
+        self.inner.len()
+    }
+
+    fn add(&mut self, py: Python<'_>, vector: &Bound<'_, PyAny>) -> PyResult<usize> {
+        let vector = extract_vector(py, vector)?;
+        self.inner.add(&vector).map_err(to_py_err)
+    }
+
+    fn add_many(&mut self, py: Python<'_>, vectors: &Bound<'_, PyAny>) -> PyResult<Vec<usize>> {
+        let vectors = extract_matrix(py, vectors, self.inner.dimensions())?;
+        let inner = &mut self.inner;
+        let indices = py.detach(|| inner.add_batch(&vectors)).map_err(to_py_err)?;
+
+        Ok(indices.collect())
+    }
+
+    /// Top-k search over the codes. With `rescore=False` the approximate
+    /// scores are returned even when a full-precision store is attached.
+    #[pyo3(signature = (query, k, rescore = true, as_numpy = false))]
+    fn search(
+        &self,
+        py: Python<'_>,
+        query: &Bound<'_, PyAny>,
+        k: usize,
+        rescore: bool,
+        as_numpy: bool,
+    ) -> PyResult<Py<PyAny>> {
+        let query = extract_vector(py, query)?;
+        let inner = &self.inner;
+        let results = py
+            .detach(|| {
+                if rescore {
+                    inner.search(&query, k)
+                } else {
+                    inner.search_approximate(&query, k)
+                }
             })
-            .collect())
+            .map_err(to_py_err)?;
+
+        results_to_py(py, results, as_numpy)
+    }
+
+    fn search_many(
+        &self,
+        py: Python<'_>,
+        queries: &Bound<'_, PyAny>,
+        k: usize,
+    ) -> PyResult<Py<PyAny>> {
+        let queries = extract_matrix(py, queries, self.inner.dimensions())?;
+        let inner = &self.inner;
+        let batches = py
+            .detach(|| inner.search_batch(&queries, k))
+            .map_err(to_py_err)?;
+
+        let lists = batches
+            .into_iter()
+            .map(|results| results_to_py(py, results, false))
+            .collect::<PyResult<Vec<_>>>()?;
+        Ok(lists.into_pyobject(py)?.unbind())
+    }
+}
+
+/// BM25 keyword index over chunk texts. Documents are numbered in the order
+/// they are added, so adding every chunk here and to a `VectorStore` keeps
+/// the two indexes aligned for `hybrid_search`.
+#[pyclass(name = "Bm25Index")]
+struct PyBm25Index {
+    inner: Bm25Index,
+}
+
+#[pymethods]
+impl PyBm25Index {
+    #[new]
+    #[pyo3(signature = (k1 = 1.2, b = 0.75))]
+    fn new(k1: f32, b: f32) -> Self {
+        Self {
+            inner: Bm25Index::new(Bm25Params { k1, b }),
+        }
+    }
+
+    #[getter]
+    fn vocabulary_size(&self) -> usize {
+        self.inner.vocabulary_size()
+    }
+
+    #[getter]
+    fn removed_count(&self) -> usize {
+        self.inner.removed_count()
+    }
+
+    fn __len__(&self) -> usize {
+        self.inner.len()
+    }
+
+    fn add(&mut self, text: &str) -> usize {
+        self.inner.add(text)
+    }
+
+    /// Tokenize and index a list of texts with the GIL released. Returns
+    /// the indices assigned to them.
+    #[allow(clippy::needless_pass_by_value)]
+    fn add_many(&mut self, py: Python<'_>, texts: Vec<String>) -> Vec<usize> {
+        let inner = &mut self.inner;
+        py.detach(|| inner.add_batch(&texts)).collect()
+    }
+
+    /// Drop a document from search results; the other indices are
+    /// unchanged. Returns False if it was already removed.
+    fn remove(&mut self, index: usize) -> PyResult<bool> {
+        self.inner.remove(index).map_err(to_py_err)
+    }
+
+    fn is_removed(&self, index: usize) -> bool {
+        self.inner.is_removed(index)
+    }
+
+    /// Top-k documents by BM25 score, best first. The score is returned in
+    /// the `similarity` field.
+    #[pyo3(signature = (query, k, as_numpy = false))]
+    fn search(&self, py: Python<'_>, query: &str, k: usize, as_numpy: bool) -> PyResult<Py<PyAny>> {
+        let inner = &self.inner;
+        let results = py.detach(|| inner.search(query, k));
+
+        results_to_py(py, results, as_numpy)
     }
 }
 
@@ -47,8 +595,258 @@ struct PySearchResult {
     similarity: f32,
 }
 
+fn to_py_err(err: VectorStoreError) -> PyErr {
+    match err {
+        VectorStoreError::Io(e) => e.into(),
+        other @ (VectorStoreError::OutOfRange { .. } | VectorStoreError::Removed { .. }) => {
+            PyErr::new::<exceptions::PyIndexError, _>(other.to_string())
+        }
+        other => PyErr::new::<exceptions::PyValueError, _>(other.to_string()),
+    }
+}
+
+fn parse_quantization(mode: &str) -> PyResult<Quantization> {
+    match mode {
+        "f16" => Ok(Quantization::F16),
+        "int8" => Ok(Quantization::Int8),
+        other => Err(PyErr::new::<exceptions::PyValueError, _>(format!(
+            "unknown quantization mode {other:?}, expected 'f16' or 'int8'"
+        ))),
+    }
+}
+
+/// Pull a vector across the FFI boundary.
+///
+/// Anything exporting a float32 buffer (NumPy arrays, `array.array('f')`,
+/// memoryviews) is copied in one go; everything else (plain lists, float64
+/// arrays) falls back to per-element extraction.
+fn extract_vector(py: Python<'_>, obj: &Bound<'_, PyAny>) -> PyResult<Vec<f32>> {
+    match PyBuffer::<f32>::get(obj) {
+        Ok(buffer) => buffer.to_vec(py),
+        Err(_) => obj.extract::<Vec<f32>>(),
+    }
+}
+
+/// Flatten an N x `dimensions` block of vectors into row-major order.
+///
+/// A float32 buffer must be a C-contiguous 2-D array `dimensions` wide;
+/// reading any other shape as a flat block would split it into the wrong
+/// rows. Lists of lists must hold rows of exactly `dimensions` floats.
+fn extract_matrix(py: Python<'_>, obj: &Bound<'_, PyAny>, dimensions: usize) -> PyResult<Vec<f32>> {
+    let mismatch = |actual| {
+        to_py_err(VectorStoreError::DimensionMismatch {
+            expected: dimensions,
+            actual,
+        })
+    };
+    match PyBuffer::<f32>::get(obj) {
+        Ok(buffer) => {
+            if buffer.dimensions() != 2 {
+                return Err(PyErr::new::<exceptions::PyValueError, _>(format!(
+                    "expected a 2-D array of vectors, got {} dimensions",
+                    buffer.dimensions()
+                )));
+            }
+            if buffer.shape()[1] != dimensions {
+                return Err(mismatch(buffer.shape()[1]));
+            }
+            if !buffer.is_c_contiguous() {
+                return Err(PyErr::new::<exceptions::PyValueError, _>(
+                    "array of vectors must be C-contiguous (use numpy.ascontiguousarray)",
+                ));
+            }
+            buffer.to_vec(py)
+        }
+        Err(_) => {
+            let rows = obj.extract::<Vec<Vec<f32>>>()?;
+            if let Some(row) = rows.iter().find(|r| r.len() != dimensions) {
+                return Err(mismatch(row.len()));
+            }
+            Ok(rows.concat())
+        }
+    }
+}
+
+/// Attributes dict -> `(key, value)` pairs, one per value of list values
+fn extract_attributes(obj: &Bound<'_, PyAny>) -> PyResult<Vec<(String, AttributeValue)>> {
+    let mut attributes = Vec::new();
+    for (key, values) in obj.extract::<HashMap<String, Bound<'_, PyAny>>>()? {
+        for value in extract_values(&values)? {
+            attributes.push((key.clone(), value));
+        }
+    }
+    Ok(attributes)
+}
+
+/// A str or int, or a list of them
+fn extract_values(obj: &Bound<'_, PyAny>) -> PyResult<Vec<AttributeValue>> {
+    if let Ok(value) = extract_value(obj) {
+        return Ok(vec![value]);
+    }
+    obj.extract::<Vec<Bound<'_, PyAny>>>()
+        .map_err(|_| bad_value())?
+        .iter()
+        .map(extract_value)
+        .collect()
+}
+
+fn extract_value(obj: &Bound<'_, PyAny>) -> PyResult<AttributeValue> {
+    if let Ok(text) = obj.extract::<String>() {
+        return Ok(AttributeValue::Text(text));
+    }
+    obj.extract::<i64>()
+        .map(AttributeValue::Int)
+        .map_err(|_| bad_value())
+}
+
+fn bad_value() -> PyErr {
+    PyErr::new::<exceptions::PyValueError, _>(
+        "attribute values must be str or int, or a list of them",
+    )
+}
+
+fn attribute_to_py(py: Python<'_>, value: AttributeValue) -> PyResult<Py<PyAny>> {
+    Ok(match value {
+        AttributeValue::Text(text) => text.into_pyobject(py)?.into_any().unbind(),
+        AttributeValue::Int(number) => number.into_pyobject(py)?.into_any().unbind(),
+    })
+}
+
+/// Filter dict -> `Filter`; the keys' conditions are ANDed together
+fn extract_filter(obj: &Bound<'_, PyAny>) -> PyResult<Filter> {
+    let mut clauses = Vec::new();
+    for (key, condition) in obj.extract::<HashMap<String, Bound<'_, PyAny>>>()? {
+        clauses.push(match key.as_str() {
+            "$or" => Filter::Or(
+                condition
+                    .extract::<Vec<Bound<'_, PyAny>>>()?
+                    .iter()
+                    .map(extract_filter)
+                    .collect::<PyResult<_>>()?,
+            ),
+            "$not" => Filter::Not(Box::new(extract_filter(&condition)?)),
+            _ => extract_condition(key, &condition)?,
+        });
+    }
+    Ok(if clauses.len() == 1 {
+        clauses.pop().unwrap()
+    } else {
+        Filter::And(clauses)
+    })
+}
+
+fn extract_condition(key: String, condition: &Bound<'_, PyAny>) -> PyResult<Filter> {
+    if let Ok(bounds) = condition.extract::<HashMap<String, i64>>() {
+        // Integer bounds are inclusive, so `gt`/`lt` shift by one
+        let (mut min, mut max) = (i64::MIN, i64::MAX);
+        for (op, bound) in bounds {
+            match op.as_str() {
+                "gte" => min = min.max(bound),
+                "gt" => min = min.max(bound.saturating_add(1)),
+                "lte" => max = max.min(bound),
+                "lt" => max = max.min(bound.saturating_sub(1)),
+                other => {
+                    return Err(PyErr::new::<exceptions::PyValueError, _>(format!(
+                        "unknown comparison {other:?}, expected 'gt', 'gte', 'lt' or 'lte'"
+                    )));
+                }
+            }
+        }
+        return Ok(Filter::Range {
+            key,
+            min: Some(min),
+            max: Some(max),
+        });
+    }
+    let mut values = extract_values(condition)?;
+    Ok(if values.len() == 1 {
+        Filter::Eq(key, values.pop().unwrap())
+    } else {
+        Filter::AnyOf(key, values)
+    })
+}
+
+fn results_to_py(
+    py: Python<'_>,
+    results: Vec<SearchResult>,
+    as_numpy: bool,
+) -> PyResult<Py<PyAny>> {
+    if as_numpy {
+        let (indices, similarities): (Vec<usize>, Vec<f32>) =
+            results.into_iter().map(|r| (r.index, r.similarity)).unzip();
+        let pair = (indices.into_pyarray(py), similarities.into_pyarray(py));
+        return Ok(pair.into_pyobject(py)?.into_any().unbind());
+    }
+
+    let objects: Vec<PySearchResult> = results
+        .into_iter()
+        .map(|r| PySearchResult {
+            index: r.index,
+            similarity: r.similarity,
+        })
+        .collect();
+    Ok(objects.into_pyobject(py)?.unbind())
+}
+
+/// Fuse a vector search and a keyword search over the same chunks.
+///
+/// `fusion="rrf"` ranks by reciprocal rank fusion with constant `rrf_k`;
+/// `fusion="weighted"` mixes min-max scaled scores, `alpha` on the vector
+/// side. Each retriever contributes its top `candidates` (default `4 * k`).
+#[pyfunction]
+#[pyo3(signature = (
+    store, keywords, query_vector, query_text, k,
+    fusion = "rrf", alpha = 0.5, rrf_k = 60.0, candidates = None, as_numpy = false
+))]
+#[allow(clippy::too_many_arguments, clippy::needless_pass_by_value)]
+fn hybrid_search(
+    py: Python<'_>,
+    store: PyRef<'_, PyVectorStore>,
+    keywords: PyRef<'_, PyBm25Index>,
+    query_vector: &Bound<'_, PyAny>,
+    query_text: &str,
+    k: usize,
+    fusion: &str,
+    alpha: f32,
+    rrf_k: f32,
+    candidates: Option<usize>,
+    as_numpy: bool,
+) -> PyResult<Py<PyAny>> {
+    let fusion = match fusion {
+        "rrf" => Fusion::Rrf { k: rrf_k },
+        "weighted" => Fusion::Weighted { alpha },
+        other => {
+            return Err(PyErr::new::<exceptions::PyValueError, _>(format!(
+                "unknown fusion {other:?}, expected 'rrf' or 'weighted'"
+            )));
+        }
+    };
+    let query_vector = extract_vector(py, query_vector)?;
+    let candidates = candidates.unwrap_or(4 * k);
+    let (vectors, keywords) = (&store.inner, &keywords.inner);
+    let results = py
+        .detach(|| {
+            fuse_rankings(
+                vectors,
+                keywords,
+                &query_vector,
+                query_text,
+                k,
+                candidates,
+                fusion,
+            )
+        })
+        .map_err(to_py_err)?;
+
+    results_to_py(py, results, as_numpy)
+}
+
 #[pymodule]
 fn knowledge_search(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<PyVectorStore>()?;
+    m.add_class::<PyHnswIndex>()?;
+    m.add_class::<PyQuantizedVectorStore>()?;
+    m.add_class::<PyBm25Index>()?;
+    m.add_function(wrap_pyfunction!(hybrid_search, m)?)?;
     Ok(())
 }
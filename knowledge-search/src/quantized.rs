@@ -0,0 +1,684 @@
+//! Compressed vector storage.
+//!
+//! `QuantizedStore` keeps each vector as f16 (2 bytes/dim) or as int8 codes
+//! with a per-vector scale (1 byte/dim + 4 bytes), and scans the compressed
+//! codes directly. Scores are approximate, so a store can have the
+//! full-precision `VectorStore` attached (normally memory-mapped from disk):
+//! search then over-fetches `k * rescore_factor` candidates from the codes
+//! and re-ranks only those with exact cosine similarity, paging in just the
+//! rows it needs.
+
+use crate::{
+    LANES, SearchResult, TopK, VectorStore, VectorStoreError, compute_dot, compute_norm,
+    push_top_k, sharded_top_k,
+};
+use std::collections::BinaryHeap;
+use std::ops::Range;
+
+const DEFAULT_RESCORE_FACTOR: usize = 4;
+
+/// Largest finite f16; larger magnitudes saturate instead of becoming inf.
+const F16_MAX: f32 = 65504.0;
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum Quantization {
+    F16,
+    Int8,
+}
+
+enum Codes {
+    F16(Vec<u16>),
+    Int8 { codes: Vec<i8>, scales: Vec<f32> },
+}
+
+/// A query prepared once for a whole scan.
+enum PreparedQuery {
+    F16(Vec<f32>),
+    Int8 { codes: Vec<i8>, scale: f32 },
+}
+
+pub struct QuantizedStore {
+    dimensions: usize,
+    codes: Codes,
+    /// Norms of the original f32 vectors, so cosine stays unbiased by rounding
+    norms: Vec<f32>,
+    count: usize,
+    /// Id of each row; empty while every row holds the id equal to it
+    ids: Vec<usize>,
+    /// Id the next `add` assigns
+    next_id: usize,
+    full_precision: Option<VectorStore>,
+    rescore_factor: usize,
+}
+
+impl QuantizedStore {
+    /// Create an empty store for vectors of given dimensions
+    #[must_use]
+    pub fn new(dimensions: usize, quantization: Quantization) -> Self {
+        let codes = match quantization {
+            Quantization::F16 => Codes::F16(Vec::new()),
+            Quantization::Int8 => Codes::Int8 {
+                codes: Vec::new(),
+                scales: Vec::new(),
+            },
+        };
+        Self {
+            dimensions,
+            codes,
+            norms: Vec::new(),
+            count: 0,
+            ids: Vec::new(),
+            next_id: 0,
+            full_precision: None,
+            rescore_factor: DEFAULT_RESCORE_FACTOR,
+        }
+    }
+
+    /// Quantize every live vector of an existing store. Removed vectors are
+    /// left out, and results carry the store's ids, which after
+    /// [`VectorStore::compact`] no longer match positions.
+    #[must_use]
+    pub fn from_store(store: &VectorStore, quantization: Quantization) -> Self {
+        let mut quantized = Self::new(store.dimensions, quantization);
+        if store.removed_count == 0 && store.slot_ids.is_empty() {
+            quantized.extend(&store.data);
+        } else {
+            let dims = store.dimensions;
+            let mut ids = Vec::with_capacity(store.count - store.removed_count);
+            for slot in (0..store.count).filter(|&slot| !store.slot_removed(slot)) {
+                quantized.extend(&store.data[slot * dims..(slot + 1) * dims]);
+                ids.push(store.id(slot));
+            }
+            quantized.set_ids(ids);
+        }
+        quantized.next_id = store.next_id;
+        quantized
+    }
+
+    #[must_use]
+    pub fn dimensions(&self) -> usize {
+        self.dimensions
+    }
+
+    #[must_use]
+    pub fn quantization(&self) -> Quantization {
+        match self.codes {
+            Codes::F16(_) => Quantization::F16,
+            Codes::Int8 { .. } => Quantization::Int8,
+        }
+    }
+
+    #[must_use]
+    pub fn len(&self) -> usize {
+        self.count
+    }
+
+    #[must_use]
+    pub fn is_empty(&self) -> bool {
+        self.count == 0
+    }
+
+    /// Bytes held in memory for codes, scales, norms and ids (the attached
+    /// full-precision store is not counted; when mapped it lives on disk)
+    #[must_use]
+    pub fn memory_bytes(&self) -> usize {
+        let codes = match &self.codes {
+            Codes::F16(codes) => codes.len() * size_of::<u16>(),
+            Codes::Int8 { codes, scales } => codes.len() + scales.len() * size_of::<f32>(),
+        };
+        codes + self.norms.len() * size_of::<f32>() + self.ids.len() * size_of::<usize>()
+    }
+
+    /// Candidates fetched per result before exact rescoring
+    pub fn set_rescore_factor(&mut self, factor: usize) {
+        self.rescore_factor = factor.max(1);
+    }
+
+    /// Keep full-precision vectors for rescoring, looked up by id. Rows
+    /// added after attaching are missing from `store` and keep their
+    /// approximate scores.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if `store` has different dimensions or a different
+    /// number of live vectors than this store holds
+    pub fn attach_full_precision(&mut self, store: VectorStore) -> Result<(), VectorStoreError> {
+        if store.dimensions != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: store.dimensions,
+            });
+        }
+        let live = store.count - store.removed_count;
+        if live != self.count {
+            return Err(VectorStoreError::LengthMismatch {
+                expected: self.count,
+                actual: live,
+            });
+        }
+        self.full_precision = Some(store);
+        Ok(())
+    }
+
+    #[must_use]
+    pub fn has_full_precision(&self) -> bool {
+        self.full_precision.is_some()
+    }
+
+    /// Quantize and add a vector. Returns its id.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    pub fn add(&mut self, vector: &[f32]) -> Result<usize, VectorStoreError> {
+        if vector.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: vector.len(),
+            });
+        }
+        Ok(self.append(vector).start)
+    }
+
+    /// Quantize and add a row-major block of vectors.
+    /// Returns the range of ids assigned to them.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// if the block length is not a multiple of the store's dimensions
+    pub fn add_batch(&mut self, vectors: &[f32]) -> Result<Range<usize>, VectorStoreError> {
+        self.check_batch(vectors)?;
+        Ok(self.append(vectors))
+    }
+
+    /// Add rows under the next ids
+    fn append(&mut self, vectors: &[f32]) -> Range<usize> {
+        let rows = self.count;
+        self.extend(vectors);
+        let ids = self.next_id..self.next_id + (self.count - rows);
+        if self.ids.is_empty() && ids.start != rows {
+            // Ids ran ahead of rows (removed vectors were left out)
+            self.ids = (0..rows).collect();
+        }
+        if !self.ids.is_empty() {
+            self.ids.extend(ids.clone());
+        }
+        self.next_id = ids.end;
+        ids
+    }
+
+    fn set_ids(&mut self, ids: Vec<usize>) {
+        let identity = ids.iter().enumerate().all(|(row, &id)| row == id);
+        self.ids = if identity { Vec::new() } else { ids };
+    }
+
+    fn id(&self, row: usize) -> usize {
+        self.ids.get(row).copied().unwrap_or(row)
+    }
+
+    /// Top-k search over the compressed codes, rescored with full precision
+    /// when a full-precision store is attached
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    pub fn search(&self, query: &[f32], k: usize) -> Result<Vec<SearchResult>, VectorStoreError> {
+        if query.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: query.len(),
+            });
+        }
+        Ok(self.search_batch(query, k)?.pop().unwrap_or_default())
+    }
+
+    /// Search a row-major block of queries in one pass over the codes
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// if the block length is not a multiple of the store's dimensions
+    pub fn search_batch(
+        &self,
+        queries: &[f32],
+        k: usize,
+    ) -> Result<Vec<Vec<SearchResult>>, VectorStoreError> {
+        self.check_batch(queries)?;
+        let fetch = if self.full_precision.is_some() {
+            k.saturating_mul(self.rescore_factor)
+        } else {
+            k
+        };
+
+        let prepared: Vec<(PreparedQuery, f32)> = queries
+            .chunks_exact(self.dimensions)
+            .map(|q| (self.prepare(q), compute_norm(q)))
+            .collect();
+        let candidates = sharded_top_k(self.count, prepared.len(), fetch, |rows| {
+            self.scan_rows(&prepared, rows, fetch)
+        });
+
+        Ok(match &self.full_precision {
+            Some(full) => queries
+                .chunks_exact(self.dimensions)
+                .zip(candidates)
+                .map(|(query, found)| rescore(full, query, found, k))
+                .collect(),
+            None => candidates,
+        })
+    }
+
+    /// Search the codes only, skipping the rescoring pass
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error at runtime (PyO3-friendly)
+    /// that signifies mismatch of the vector's dimensions
+    pub fn search_approximate(
+        &self,
+        query: &[f32],
+        k: usize,
+    ) -> Result<Vec<SearchResult>, VectorStoreError> {
+        if query.len() != self.dimensions {
+            return Err(VectorStoreError::DimensionMismatch {
+                expected: self.dimensions,
+                actual: query.len(),
+            });
+        }
+        let prepared = [(self.prepare(query), compute_norm(query))];
+        Ok(
+            sharded_top_k(self.count, 1, k, |rows| self.scan_rows(&prepared, rows, k))
+                .pop()
+                .unwrap_or_default(),
+        )
+    }
+
+    fn extend(&mut self, vectors: &[f32]) {
+        let dims = self.dimensions;
+        match &mut self.codes {
+            Codes::F16(codes) => codes.extend(vectors.iter().map(|&x| f32_to_f16(x))),
+            Codes::Int8 { codes, scales } => {
+                for vector in vectors.chunks_exact(dims) {
+                    let scale = quantize_i8(vector, codes);
+                    scales.push(scale);
+                }
+            }
+        }
+        self.norms
+            .extend(vectors.chunks_exact(dims).map(compute_norm));
+        self.count = self.norms.len();
+    }
+
+    fn prepare(&self, query: &[f32]) -> PreparedQuery {
+        match self.codes {
+            Codes::F16(_) => PreparedQuery::F16(query.to_vec()),
+            Codes::Int8 { .. } => {
+                let mut codes = Vec::with_capacity(query.len());
+                let scale = quantize_i8(query, &mut codes);
+                PreparedQuery::Int8 { codes, scale }
+            }
+        }
+    }
+
+    fn scan_rows(
+        &self,
+        queries: &[(PreparedQuery, f32)],
+        rows: Range<usize>,
+        k: usize,
+    ) -> Vec<TopK> {
+        let dims = self.dimensions;
+        let mut heaps: Vec<TopK> = (0..queries.len()).map(|_| BinaryHeap::new()).collect();
+
+        for i in rows {
+            let span = i * dims..(i + 1) * dims;
+            for ((query, query_norm), heap) in queries.iter().zip(heaps.iter_mut()) {
+                let dot = match (&self.codes, query) {
+                    (Codes::F16(codes), PreparedQuery::F16(q)) => dot_f16(q, &codes[span.clone()]),
+                    (Codes::Int8 { codes, scales }, PreparedQuery::Int8 { codes: q, scale }) => {
+                        #[allow(clippy::cast_precision_loss)]
+                        let raw = dot_i8(q, &codes[span.clone()]) as f32;
+                        raw * scale * scales[i]
+                    }
+                    _ => unreachable!("queries are prepared for this store's codes"),
+                };
+                push_top_k(
+                    heap,
+                    SearchResult {
+                        index: self.id(i),
+                        similarity: dot / (query_norm * self.norms[i]),
+                    },
+                    k,
+                );
+            }
+        }
+
+        heaps
+    }
+
+    fn check_batch(&self, block: &[f32]) -> Result<(), VectorStoreError> {
+        if self.dimensions == 0 || !block.len().is_multiple_of(self.dimensions) {
+            return Err(VectorStoreError::RaggedBatch {
+                expected: self.dimensions,
+                len: block.len(),
+            });
+        }
+        Ok(())
+    }
+}
+
+/// Re-rank approximate candidates with exact cosine similarity
+fn rescore(
+    full: &VectorStore,
+    query: &[f32],
+    candidates: Vec<SearchResult>,
+    k: usize,
+) -> Vec<SearchResult> {
+    let dims = full.dimensions;
+    let query_norm = compute_norm(query);
+    let mut rescored: Vec<SearchResult> = candidates
+        .into_iter()
+        .map(|r| {
+            let Some(slot) = full.slot(r.index).filter(|&slot| !full.slot_removed(slot)) else {
+                return r;
+            };
+            let row = &full.data[slot * dims..(slot + 1) * dims];
+            SearchResult {
+                index: r.index,
+                similarity: compute_dot(query, row) / (query_norm * full.norms[slot]),
+            }
+        })
+        .collect();
+    rescored.sort_by(|first, second| second.cmp(first));
+    rescored.truncate(k);
+    rescored
+}
+
+/// Symmetric int8 quantization: codes are `round(x / scale)` with
+/// `scale = max|x| / 127`. Appends the codes and returns the scale.
+#[allow(clippy::cast_possible_truncation)]
+fn quantize_i8(vector: &[f32], out: &mut Vec<i8>) -> f32 {
+    let max_abs = vector.iter().fold(0.0f32, |acc, x| acc.max(x.abs()));
+    if max_abs == 0.0 || !max_abs.is_finite() {
+        out.extend(std::iter::repeat_n(0, vector.len()));
+        return 0.0;
+    }
+    let scale = max_abs / 127.0;
+    // Values are within [-127, 127] after the clamp, so the cast is exact
+    out.extend(
+        vector
+            .iter()
+            .map(|&x| (x / scale).round().clamp(-127.0, 127.0) as i8),
+    );
+    scale
+}
+
+fn dot_i8(a: &[i8], b: &[i8]) -> i32 {
+    // 127 * 127 * 16 lanes cannot overflow i32 until ~8M dimensions
+    const WIDE: usize = LANES * 2;
+    let mut acc = [0i32; WIDE];
+    for (x, y) in a.chunks_exact(WIDE).zip(b.chunks_exact(WIDE)) {
+        for lane in 0..WIDE {
+            acc[lane] += i32::from(x[lane]) * i32::from(y[lane]);
+        }
+    }
+    let tail: i32 = a
+        .chunks_exact(WIDE)
+        .remainder()
+        .iter()
+        .zip(b.chunks_exact(WIDE).remainder())
+        .map(|(&x, &y)| i32::from(x) * i32::from(y))
+        .sum();
+    acc.iter().sum::<i32>() + tail
+}
+
+fn dot_f16(a: &[f32], b: &[u16]) -> f32 {
+    let mut acc = [0.0f32; LANES];
+    for (x, y) in a.chunks_exact(LANES).zip(b.chunks_exact(LANES)) {
+        for lane in 0..LANES {
+            acc[lane] += x[lane] * f16_to_f32(y[lane]);
+        }
+    }
+    let tail: f32 = a
+        .chunks_exact(LANES)
+        .remainder()
+        .iter()
+        .zip(b.chunks_exact(LANES).remainder())
+        .map(|(&x, &y)| x * f16_to_f32(y))
+        .sum();
+    acc.iter().sum::<f32>() + tail
+}
+
+/// IEEE 754 binary16 -> binary32 for the finite values `f32_to_f16` produces.
+///
+/// Shifting the exponent and mantissa into f32 position and multiplying by
+/// 2^112 rebiases the exponent, and handles subnormals too, without branches.
+fn f16_to_f32(half: u16) -> f32 {
+    const REBIAS: f32 = 5.192_297e33; // 2^112
+    let magnitude = f32::from_bits(u32::from(half & 0x7FFF) << 13) * REBIAS;
+    f32::from_bits(magnitude.to_bits() | (u32::from(half & 0x8000) << 16))
+}
+
+/// IEEE 754 binary32 -> binary16, rounding to nearest even.
+/// Out-of-range magnitudes saturate to ±65504 and NaN becomes 0.
+#[allow(clippy::cast_possible_truncation)]
+fn f32_to_f16(value: f32) -> u16 {
+    if value.is_nan() {
+        return 0;
+    }
+    let clamped = value.clamp(-F16_MAX, F16_MAX);
+    let bits = clamped.to_bits();
+    let sign = ((bits >> 16) & 0x8000) as u16;
+    let abs = bits & 0x7FFF_FFFF;
+
+    let magnitude = if abs < (113 << 23) {
+        // Subnormal or zero in f16: let the FPU round by adding a magic
+        // constant whose ulp matches the f16 subnormal step
+        const DENORM_MAGIC: u32 = ((127 - 15) + (23 - 10) + 1) << 23;
+        let sum = f32::from_bits(abs) + f32::from_bits(DENORM_MAGIC);
+        (sum.to_bits() - DENORM_MAGIC) as u16
+    } else {
+        let mantissa_odd = (abs >> 13) & 1;
+        let rebased = abs - ((127 - 15) << 23) + 0xFFF + mantissa_odd;
+        (rebased >> 13) as u16
+    };
+    sign | magnitude
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use approx::assert_relative_eq;
+
+    #[allow(clippy::cast_precision_loss)]
+    fn random_vectors(n: usize, dims: usize, seed: u64) -> Vec<f32> {
+        let mut state = seed;
+        (0..n * dims)
+            .map(|_| {
+                state = state
+                    .wrapping_mul(6_364_136_223_846_793_005)
+                    .wrapping_add(1_442_695_040_888_963_407);
+                ((state >> 40) as f32 / (1u64 << 24) as f32) - 0.5
+            })
+            .collect()
+    }
+
+    #[test]
+    #[allow(clippy::float_cmp)]
+    fn test_f16_round_trip_exact_values() {
+        for value in [
+            0.0,
+            -0.0,
+            1.0,
+            -2.0,
+            0.5,
+            65504.0,
+            -65504.0,
+            6.103_515_6e-5,
+            5.960_464_5e-8,
+        ] {
+            assert_eq!(f16_to_f32(f32_to_f16(value)), value, "{value}");
+        }
+    }
+
+    #[test]
+    #[allow(clippy::float_cmp)]
+    fn test_f16_rounding_and_saturation() {
+        // 1 + 2^-11 is halfway between two f16 values; ties go to even (1.0)
+        assert_eq!(f16_to_f32(f32_to_f16(1.0 + 2f32.powi(-11))), 1.0);
+        assert_eq!(f16_to_f32(f32_to_f16(1e6)), 65504.0);
+        assert_eq!(f16_to_f32(f32_to_f16(f32::NEG_INFINITY)), -65504.0);
+        assert_eq!(f32_to_f16(f32::NAN), 0);
+
+        for &value in &random_vectors(1, 1000, 3) {
+            let back = f16_to_f32(f32_to_f16(value));
+            assert!(
+                (back - value).abs() <= value.abs() * 1e-3 + 1e-7,
+                "{value} -> {back}"
+            );
+        }
+    }
+
+    #[test]
+    #[allow(clippy::float_cmp)]
+    fn test_int8_quantization_scale() {
+        let mut codes = Vec::new();
+        let scale = quantize_i8(&[0.5, -1.0, 0.25], &mut codes);
+
+        assert_relative_eq!(scale, 1.0 / 127.0);
+        assert_eq!(codes, vec![64, -127, 32]);
+        assert_eq!(quantize_i8(&[0.0, 0.0], &mut codes), 0.0);
+    }
+
+    #[test]
+    fn test_kernels_match_scalar_dot() {
+        let a = random_vectors(1, 37, 1);
+        let b = random_vectors(1, 37, 2);
+        let scalar: f32 = a.iter().zip(&b).map(|(x, y)| x * y).sum();
+
+        assert_relative_eq!(compute_dot(&a, &b), scalar);
+        let halves: Vec<u16> = b.iter().map(|&x| f32_to_f16(x)).collect();
+        assert!((dot_f16(&a, &halves) - scalar).abs() < 1e-3);
+
+        let x: Vec<i8> = (0..37).map(|i| i8::try_from(i * 3 - 50).unwrap()).collect();
+        let y: Vec<i8> = (0..37).map(|i| i8::try_from(90 - i * 5).unwrap()).collect();
+        let expected: i32 = x
+            .iter()
+            .zip(&y)
+            .map(|(&p, &q)| i32::from(p) * i32::from(q))
+            .sum();
+        assert_eq!(dot_i8(&x, &y), expected);
+    }
+
+    #[test]
+    fn test_memory_footprint() {
+        let dims = 1536;
+        let data = random_vectors(10, dims, 5);
+        let mut half = QuantizedStore::new(dims, Quantization::F16);
+        let mut int8 = QuantizedStore::new(dims, Quantization::Int8);
+        let _ = half.add_batch(&data).unwrap();
+        let _ = int8.add_batch(&data).unwrap();
+
+        let full = 10 * dims * size_of::<f32>();
+        assert_eq!(half.memory_bytes(), full / 2 + 10 * 4);
+        assert_eq!(int8.memory_bytes(), full / 4 + 10 * 8);
+    }
+
+    #[test]
+    fn test_search_finds_identical_vector() {
+        for quantization in [Quantization::F16, Quantization::Int8] {
+            let mut store = QuantizedStore::new(3, quantization);
+            let _ = store.add(&[3.5, 4.7, 6.8]).unwrap();
+            let _ = store.add(&[4.5, 4.1, 1.8]).unwrap();
+
+            let res = store.search(&[4.5, 4.1, 1.8], 2).unwrap();
+            assert_eq!(res[0].index, 1);
+            assert!((res[0].similarity - 1.0).abs() < 1e-2);
+        }
+    }
+
+    #[test]
+    fn test_rescoring_restores_exact_similarities() {
+        let dims = 64;
+        let data = random_vectors(500, dims, 9);
+        let queries = random_vectors(10, dims, 13);
+        let mut exact = VectorStore::new(dims);
+        let _ = exact.add_batch(&data).unwrap();
+        let truth = exact.search_batch(&queries, 5).unwrap();
+
+        let mut store = QuantizedStore::from_store(&exact, Quantization::Int8);
+        store.attach_full_precision(exact).unwrap();
+        store.set_rescore_factor(8);
+        let rescored = store.search_batch(&queries, 5).unwrap();
+
+        for (found, expected) in rescored.iter().zip(&truth) {
+            assert_eq!(found.len(), 5);
+            let hits = found
+                .iter()
+                .filter(|r| expected.iter().any(|e| e.index == r.index))
+                .count();
+            assert!(hits >= 4, "only {hits}/5 true neighbours after rescoring");
+            // Rescored similarities are exact, not approximate
+            for r in found {
+                if let Some(e) = expected.iter().find(|e| e.index == r.index) {
+                    assert_relative_eq!(r.similarity, e.similarity);
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn test_from_store_skips_removed_and_keeps_ids() {
+        let dims = 16;
+        let data = random_vectors(6, dims, 21);
+        let row = |id: usize| &data[id * dims..(id + 1) * dims];
+        let mut exact = VectorStore::new(dims);
+        let _ = exact.add_batch(&data).unwrap();
+        let _ = exact.remove(1).unwrap();
+        let _ = exact.compact();
+        // One tombstone left in place, after compaction moved ids off slots
+        let _ = exact.remove(4).unwrap();
+
+        for quantization in [Quantization::F16, Quantization::Int8] {
+            let mut store = QuantizedStore::from_store(&exact, quantization);
+            assert_eq!(store.len(), 4);
+            let found = store.search(row(5), 6).unwrap();
+            assert_eq!(found[0].index, 5);
+            let mut ids: Vec<usize> = found.iter().map(|r| r.index).collect();
+            ids.sort_unstable();
+            assert_eq!(ids, vec![0, 2, 3, 5]);
+            assert_eq!(store.add(row(1)).unwrap(), 6);
+            assert_eq!(store.search(row(1), 1).unwrap()[0].index, 6);
+        }
+
+        let truth = exact.search(row(3), 4).unwrap();
+        let mut store = QuantizedStore::from_store(&exact, Quantization::Int8);
+        store.attach_full_precision(exact).unwrap();
+        let rescored = store.search(row(3), 4).unwrap();
+        assert_eq!(rescored.len(), 4);
+        for (found, expected) in rescored.iter().zip(&truth) {
+            assert_eq!(found.index, expected.index);
+            assert_relative_eq!(found.similarity, expected.similarity);
+        }
+    }
+
+    #[test]
+    fn test_attach_rejects_mismatched_store() {
+        let mut store = QuantizedStore::new(2, Quantization::F16);
+        let _ = store.add(&[1.0, 0.0]).unwrap();
+
+        assert!(matches!(
+            store.attach_full_precision(VectorStore::new(3)),
+            Err(VectorStoreError::DimensionMismatch { .. })
+        ));
+        assert!(matches!(
+            store.attach_full_precision(VectorStore::new(2)),
+            Err(VectorStoreError::LengthMismatch {
+                expected: 1,
+                actual: 0
+            })
+        ));
+    }
+}
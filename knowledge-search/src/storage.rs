@@ -0,0 +1,636 @@
+//! On-disk format for `VectorStore`.
+//!
+//! A store is a single flat file: a fixed 64-byte header followed by the
+//! vector data and the norms, both as little-endian f32, so the file can be
+//! memory-mapped and searched in place.
+//!
+//! | offset | size | field                                   |
+//! |--------|------|-----------------------------------------|
+//! | 0      | 8    | magic `KSVSTORE`                        |
+//! | 8      | 4    | format version                          |
+//! | 12     | 4    | flags (bit 0: id section present)       |
+//! | 16     | 8    | dimensions                              |
+//! | 24     | 8    | count                                   |
+//! | 32     | 8    | byte offset of `data` (`count * dims`)  |
+//! | 40     | 8    | byte offset of `norms` (`count`)        |
+//! | 48     | 4    | CRC32 of everything after the header    |
+//! | 52     | 4    | CRC32 of the rest of the header         |
+//! | 56     | 8    | next id (version 2; reserved in 1)      |
+//!
+//! The header checksum covers bytes 0..52 and 56..64; version 1 files have
+//! nothing at 56 and checksum only 0..52.
+//!
+//! Version 2 appends two sections after the norms, read into memory on open:
+//!
+//! - ids: `count` little-endian u64s, the id held by each slot. Written only
+//!   once `compact` has moved vectors off the slots equal to their ids.
+//! - tombstones: `ceil(count / 64)` little-endian u64 words; bit `slot % 64`
+//!   of word `slot / 64` is set for removed vectors.
+//!
+//! Version 1 files have neither: ids equal slots and nothing is removed.
+
+#[cfg(not(target_endian = "little"))]
+compile_error!(
+    "the on-disk VectorStore format is read in place and assumes a little-endian target"
+);
+
+use crate::filter::AttributeIndex;
+use crate::{VectorStore, VectorStoreError};
+use memmap2::Mmap;
+use std::collections::HashMap;
+use std::fs::{self, File};
+use std::io::{BufWriter, Read, Write};
+use std::ops::{Deref, Range};
+use std::path::Path;
+use std::sync::Arc;
+
+const MAGIC: &[u8; 8] = b"KSVSTORE";
+const VERSION: u32 = 2;
+const HEADER_LEN: usize = 64;
+const F32_LEN: usize = size_of::<f32>();
+const U64_LEN: usize = size_of::<u64>();
+const FLAG_IDS: u32 = 1;
+
+/// A run of f32s that lives either on the heap or inside a read-only mapping.
+///
+/// Mapped buffers are copied onto the heap the first time they are mutated,
+/// so an opened store can still take new vectors.
+pub(crate) enum F32Buf {
+    Owned(Vec<f32>),
+    Mapped { map: Arc<Mmap>, bytes: Range<usize> },
+}
+
+impl F32Buf {
+    pub(crate) fn to_mut(&mut self) -> &mut Vec<f32> {
+        if let Self::Mapped { .. } = self {
+            *self = Self::Owned(self.to_vec());
+        }
+        match self {
+            Self::Owned(v) => v,
+            Self::Mapped { .. } => unreachable!("mapped buffer was just copied"),
+        }
+    }
+
+    pub(crate) fn is_mapped(&self) -> bool {
+        matches!(self, Self::Mapped { .. })
+    }
+}
+
+impl Default for F32Buf {
+    fn default() -> Self {
+        Self::Owned(Vec::new())
+    }
+}
+
+impl Deref for F32Buf {
+    type Target = [f32];
+
+    fn deref(&self) -> &[f32] {
+        match self {
+            Self::Owned(v) => v,
+            // Offsets are multiples of 4 from a page-aligned base, so the cast cannot fail
+            Self::Mapped { map, bytes } => bytemuck::cast_slice(&map[bytes.clone()]),
+        }
+    }
+}
+
+struct Header {
+    version: u32,
+    dimensions: usize,
+    count: usize,
+    data_offset: usize,
+    norms_offset: usize,
+    payload_crc: u32,
+    has_ids: bool,
+    next_id: usize,
+}
+
+impl Header {
+    fn new(
+        dimensions: usize,
+        count: usize,
+        has_ids: bool,
+        next_id: usize,
+        payload_crc: u32,
+    ) -> Self {
+        Self {
+            version: VERSION,
+            dimensions,
+            count,
+            data_offset: HEADER_LEN,
+            // Saturating so a garbage header fails the length check instead of overflowing
+            norms_offset: count
+                .saturating_mul(dimensions)
+                .saturating_mul(F32_LEN)
+                .saturating_add(HEADER_LEN),
+            payload_crc,
+            has_ids,
+            next_id,
+        }
+    }
+
+    /// End of the norms, where the version 2 sections start
+    fn ids_offset(&self) -> usize {
+        self.norms_offset
+            .saturating_add(self.count.saturating_mul(F32_LEN))
+    }
+
+    fn tombstones_offset(&self) -> usize {
+        let ids_len = if self.has_ids { self.count } else { 0 };
+        self.ids_offset()
+            .saturating_add(ids_len.saturating_mul(U64_LEN))
+    }
+
+    fn file_len(&self) -> usize {
+        let words = if self.version >= 2 {
+            self.count.div_ceil(64)
+        } else {
+            0
+        };
+        self.tombstones_offset()
+            .saturating_add(words.saturating_mul(U64_LEN))
+    }
+
+    fn encode(&self) -> [u8; HEADER_LEN] {
+        let mut buf = [0u8; HEADER_LEN];
+        buf[0..8].copy_from_slice(MAGIC);
+        buf[8..12].copy_from_slice(&self.version.to_le_bytes());
+        let flags = if self.has_ids { FLAG_IDS } else { 0 };
+        buf[12..16].copy_from_slice(&flags.to_le_bytes());
+        buf[16..24].copy_from_slice(&(self.dimensions as u64).to_le_bytes());
+        buf[24..32].copy_from_slice(&(self.count as u64).to_le_bytes());
+        buf[32..40].copy_from_slice(&(self.data_offset as u64).to_le_bytes());
+        buf[40..48].copy_from_slice(&(self.norms_offset as u64).to_le_bytes());
+        buf[48..52].copy_from_slice(&self.payload_crc.to_le_bytes());
+        if self.version >= 2 {
+            buf[56..64].copy_from_slice(&(self.next_id as u64).to_le_bytes());
+        }
+        let header_crc = header_crc(&buf, self.version);
+        buf[52..56].copy_from_slice(&header_crc.to_le_bytes());
+        buf
+    }
+
+    fn decode(buf: &[u8; HEADER_LEN]) -> Result<Self, VectorStoreError> {
+        if &buf[0..8] != MAGIC {
+            return Err(corrupt("not a vector store file (bad magic)"));
+        }
+        let version = read_u32(buf, 8);
+        if version == 0 || version > VERSION {
+            return Err(VectorStoreError::UnsupportedVersion(version));
+        }
+        if read_u32(buf, 52) != header_crc(buf, version) {
+            return Err(corrupt("header checksum mismatch"));
+        }
+
+        let count = read_usize(buf, 24)?;
+        let header = Self {
+            version,
+            dimensions: read_usize(buf, 16)?,
+            count,
+            data_offset: read_usize(buf, 32)?,
+            norms_offset: read_usize(buf, 40)?,
+            payload_crc: read_u32(buf, 48),
+            has_ids: version >= 2 && read_u32(buf, 12) & FLAG_IDS != 0,
+            next_id: if version >= 2 {
+                read_usize(buf, 56)?
+            } else {
+                count
+            },
+        };
+        let expected = Self::new(
+            header.dimensions,
+            header.count,
+            header.has_ids,
+            header.next_id,
+            header.payload_crc,
+        );
+        if header.data_offset != expected.data_offset
+            || header.norms_offset != expected.norms_offset
+        {
+            return Err(corrupt("section offsets do not match dimensions and count"));
+        }
+        if header.next_id < header.count {
+            return Err(corrupt("next id is below the vector count"));
+        }
+        Ok(header)
+    }
+}
+
+impl VectorStore {
+    /// Write the store to `path`.
+    ///
+    /// The file is written next to `path` and renamed into place, so readers
+    /// never observe a half-written store. Removed vectors are written with
+    /// their tombstones; [`VectorStore::compact`] first to leave them out.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if the file cannot be written
+    pub fn save(&self, path: impl AsRef<Path>) -> Result<(), VectorStoreError> {
+        let path = path.as_ref();
+        let data: &[u8] = bytemuck::cast_slice(&self.data);
+        let norms: &[u8] = bytemuck::cast_slice(&self.norms);
+        let tail = self.encode_tail();
+
+        let mut hasher = crc32fast::Hasher::new();
+        hasher.update(data);
+        hasher.update(norms);
+        hasher.update(&tail);
+        let header = Header::new(
+            self.dimensions,
+            self.count,
+            !self.slot_ids.is_empty(),
+            self.next_id,
+            hasher.finalize(),
+        );
+
+        let tmp = path.with_extension("tmp");
+        {
+            let mut out = BufWriter::new(File::create(&tmp)?);
+            out.write_all(&header.encode())?;
+            out.write_all(data)?;
+            out.write_all(norms)?;
+            out.write_all(&tail)?;
+            out.into_inner()
+                .map_err(std::io::IntoInnerError::into_error)?
+                .sync_all()?;
+        }
+        fs::rename(&tmp, path)?;
+        Ok(())
+    }
+
+    /// Open a store written by [`VectorStore::save`].
+    ///
+    /// With `mmap` the vectors stay on disk and are paged in as searches touch
+    /// them; only the ids and tombstones (a few bytes per vector) are read.
+    /// The header checksum is always checked; the payload checksum needs a
+    /// full read, so for mapped stores it only runs when `verify` is set (see
+    /// [`VectorStore::verify`]).
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if the file cannot be read, is not a vector store,
+    /// was written by a newer format version or fails its checksums
+    pub fn open(
+        path: impl AsRef<Path>,
+        mmap: bool,
+        verify: bool,
+    ) -> Result<Self, VectorStoreError> {
+        let mut file = File::open(path)?;
+        let mut raw = [0u8; HEADER_LEN];
+        file.read_exact(&mut raw)?;
+        let header = Header::decode(&raw)?;
+
+        let file_len = usize::try_from(file.metadata()?.len())
+            .map_err(|_| corrupt("file too large for this platform"))?;
+        if file_len != header.file_len() {
+            return Err(corrupt(&format!(
+                "expected {} bytes, found {file_len}",
+                header.file_len()
+            )));
+        }
+
+        let (data, norms, tail) = if mmap {
+            // SAFETY: the mapping is read-only and never handed out mutably.
+            // `save` replaces files by rename rather than writing in place, so
+            // a store we wrote will not change under the mapping.
+            #[allow(unsafe_code)]
+            let mapping = Arc::new(unsafe { Mmap::map(&file)? });
+            if verify && crc32fast::hash(&mapping[HEADER_LEN..]) != header.payload_crc {
+                return Err(corrupt("payload checksum mismatch"));
+            }
+            let tail = mapping[header.ids_offset()..].to_vec();
+            (
+                F32Buf::Mapped {
+                    map: Arc::clone(&mapping),
+                    bytes: header.data_offset..header.norms_offset,
+                },
+                F32Buf::Mapped {
+                    map: mapping,
+                    bytes: header.norms_offset..header.ids_offset(),
+                },
+                tail,
+            )
+        } else {
+            let mut data = vec![0f32; header.count * header.dimensions];
+            let mut norms = vec![0f32; header.count];
+            let mut tail = vec![0u8; header.file_len() - header.ids_offset()];
+            file.read_exact(bytemuck::cast_slice_mut(&mut data))?;
+            file.read_exact(bytemuck::cast_slice_mut(&mut norms))?;
+            file.read_exact(&mut tail)?;
+
+            let mut hasher = crc32fast::Hasher::new();
+            hasher.update(bytemuck::cast_slice(&data));
+            hasher.update(bytemuck::cast_slice(&norms));
+            hasher.update(&tail);
+            if hasher.finalize() != header.payload_crc {
+                return Err(corrupt("payload checksum mismatch"));
+            }
+            (F32Buf::Owned(data), F32Buf::Owned(norms), tail)
+        };
+
+        let mut store = Self {
+            dimensions: header.dimensions,
+            data,
+            norms,
+            count: header.count,
+            removed: Vec::new(),
+            removed_count: 0,
+            attributes: AttributeIndex::default(),
+            slot_ids: Vec::new(),
+            id_slots: HashMap::new(),
+            next_id: header.next_id,
+        };
+        store.decode_tail(&header, &tail)?;
+        Ok(store)
+    }
+
+    /// Re-read a mapped store and check it against the checksum in its file.
+    /// Stores that were built in memory always verify.
+    ///
+    /// # Errors
+    ///
+    /// Returns an Error if the mapped data does not match its checksum
+    pub fn verify(&self) -> Result<(), VectorStoreError> {
+        if let F32Buf::Mapped { map, .. } = &self.data {
+            let mut raw = [0u8; HEADER_LEN];
+            raw.copy_from_slice(&map[..HEADER_LEN]);
+            if crc32fast::hash(&map[HEADER_LEN..]) != Header::decode(&raw)?.payload_crc {
+                return Err(corrupt("payload checksum mismatch"));
+            }
+        }
+        Ok(())
+    }
+
+    /// Whether the vectors are being read from a memory-mapped file.
+    #[must_use]
+    pub fn is_mapped(&self) -> bool {
+        self.data.is_mapped()
+    }
+
+    /// The version 2 sections: slot ids when they differ from slots, then
+    /// the tombstone bitmap
+    fn encode_tail(&self) -> Vec<u8> {
+        let words = self.count.div_ceil(64);
+        let mut tail = Vec::with_capacity((self.slot_ids.len() + words) * U64_LEN);
+        for &id in &self.slot_ids {
+            tail.extend_from_slice(&(id as u64).to_le_bytes());
+        }
+        let mut tombstones = vec![0u64; words];
+        for (slot, _) in self.removed.iter().enumerate().filter(|(_, r)| **r) {
+            tombstones[slot / 64] |= 1 << (slot % 64);
+        }
+        for word in tombstones {
+            tail.extend_from_slice(&word.to_le_bytes());
+        }
+        tail
+    }
+
+    fn decode_tail(&mut self, header: &Header, tail: &[u8]) -> Result<(), VectorStoreError> {
+        let (ids, tombstones) = tail.split_at(header.tombstones_offset() - header.ids_offset());
+        if header.has_ids {
+            let slot_ids = ids
+                .chunks_exact(U64_LEN)
+                .map(|chunk| read_usize(chunk, 0))
+                .collect::<Result<Vec<_>, _>>()?;
+            if slot_ids.iter().any(|&id| id >= self.next_id) {
+                return Err(corrupt("slot id at or above the next id"));
+            }
+            self.set_slot_ids(slot_ids);
+            if !self.slot_ids.is_empty() && self.id_slots.len() != self.count {
+                return Err(corrupt("duplicate slot ids"));
+            }
+        }
+
+        for (i, chunk) in tombstones.chunks_exact(U64_LEN).enumerate() {
+            let mut word = u64::from_le_bytes(chunk.try_into().expect("8-byte word"));
+            while word != 0 {
+                let slot = i * 64 + word.trailing_zeros() as usize;
+                word &= word - 1;
+                // Padding bits of the last word are ignored; the payload
+                // checksum is what catches a damaged section
+                if slot >= self.count {
+                    break;
+                }
+                if self.removed.is_empty() {
+                    self.removed.resize(self.count, false);
+                }
+                self.removed[slot] = true;
+                self.removed_count += 1;
+            }
+        }
+        Ok(())
+    }
+}
+
+/// Checksum of every header field but the checksum itself
+fn header_crc(buf: &[u8; HEADER_LEN], version: u32) -> u32 {
+    let mut hasher = crc32fast::Hasher::new();
+    hasher.update(&buf[0..52]);
+    if version >= 2 {
+        hasher.update(&buf[56..64]);
+    }
+    hasher.finalize()
+}
+
+fn corrupt(reason: &str) -> VectorStoreError {
+    VectorStoreError::Corrupt(reason.to_string())
+}
+
+fn read_u32(buf: &[u8], at: usize) -> u32 {
+    u32::from_le_bytes(buf[at..at + 4].try_into().expect("4-byte field"))
+}
+
+fn read_usize(buf: &[u8], at: usize) -> Result<usize, VectorStoreError> {
+    let value = u64::from_le_bytes(buf[at..at + 8].try_into().expect("8-byte field"));
+    usize::try_from(value).map_err(|_| corrupt("field does not fit in usize"))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::path::PathBuf;
+
+    fn temp_path(name: &str) -> PathBuf {
+        std::env::temp_dir().join(format!("ks-{}-{name}.ksvs", std::process::id()))
+    }
+
+    fn sample_store() -> VectorStore {
+        let mut store = VectorStore::new(3);
+        let _ = store
+            .add_batch(&[3.5, 4.7, 6.8, 4.5, 4.1, 1.8, 1.5, 2.7, 1.7])
+            .unwrap();
+        store
+    }
+
+    #[test]
+    fn test_round_trip_owned_and_mapped() {
+        let path = temp_path("round-trip");
+        let store = sample_store();
+        store.save(&path).unwrap();
+
+        for mmap in [false, true] {
+            let opened = VectorStore::open(&path, mmap, true).unwrap();
+            assert_eq!(opened.is_mapped(), mmap);
+            assert_eq!(opened.len(), 3);
+            assert_eq!(&opened.data[..], &store.data[..]);
+            assert_eq!(
+                opened.search(&[4.2, 3.5, 1.0], 3).unwrap(),
+                store.search(&[4.2, 3.5, 1.0], 3).unwrap()
+            );
+        }
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_mapped_store_accepts_new_vectors() {
+        let path = temp_path("append");
+        sample_store().save(&path).unwrap();
+
+        let mut opened = VectorStore::open(&path, true, false).unwrap();
+        assert_eq!(opened.add(&[1.0, 0.0, 0.0]).unwrap(), 3);
+        assert!(!opened.is_mapped());
+        assert_eq!(opened.search(&[1.0, 0.0, 0.0], 1).unwrap()[0].index, 3);
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_corrupt_payload_detected() {
+        let path = temp_path("corrupt");
+        sample_store().save(&path).unwrap();
+        let mut bytes = fs::read(&path).unwrap();
+        bytes[HEADER_LEN + 5] ^= 0xFF;
+        fs::write(&path, bytes).unwrap();
+
+        assert!(matches!(
+            VectorStore::open(&path, false, false),
+            Err(VectorStoreError::Corrupt(_))
+        ));
+        // Mapped opens skip the payload pass unless asked
+        let mapped = VectorStore::open(&path, true, false).unwrap();
+        assert!(matches!(mapped.verify(), Err(VectorStoreError::Corrupt(_))));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_bad_header_detected() {
+        let path = temp_path("header");
+        sample_store().save(&path).unwrap();
+        let mut bytes = fs::read(&path).unwrap();
+
+        bytes[17] ^= 0x01; // dimensions
+        fs::write(&path, &bytes).unwrap();
+        assert!(matches!(
+            VectorStore::open(&path, true, false),
+            Err(VectorStoreError::Corrupt(_))
+        ));
+
+        bytes[0] = b'X';
+        fs::write(&path, &bytes).unwrap();
+        assert!(matches!(
+            VectorStore::open(&path, true, false),
+            Err(VectorStoreError::Corrupt(_))
+        ));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_corrupt_next_id_detected() {
+        let path = temp_path("next-id");
+        sample_store().save(&path).unwrap();
+        let mut bytes = fs::read(&path).unwrap();
+        // Still at least the count, so only the checksum can catch it
+        bytes[60] ^= 0x01;
+        fs::write(&path, &bytes).unwrap();
+
+        assert!(matches!(
+            VectorStore::open(&path, true, false),
+            Err(VectorStoreError::Corrupt(_))
+        ));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_truncated_file_detected() {
+        let path = temp_path("truncated");
+        sample_store().save(&path).unwrap();
+        let bytes = fs::read(&path).unwrap();
+        fs::write(&path, &bytes[..bytes.len() - 4]).unwrap();
+
+        assert!(matches!(
+            VectorStore::open(&path, true, false),
+            Err(VectorStoreError::Corrupt(_))
+        ));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_tombstones_and_ids_round_trip() {
+        let path = temp_path("tombstones");
+        let mut store = sample_store();
+        let _ = store.remove(0).unwrap();
+        let _ = store.compact();
+        let _ = store.add(&[1.0, 0.0, 0.0]).unwrap();
+        let _ = store.remove(2).unwrap();
+        store.save(&path).unwrap();
+
+        for mmap in [false, true] {
+            let opened = VectorStore::open(&path, mmap, true).unwrap();
+            assert_eq!(opened.len(), 3);
+            assert_eq!(opened.next_id(), 4);
+            assert_eq!(opened.removed_count(), 1);
+            assert!(opened.is_removed(0) && opened.is_removed(2));
+            assert_eq!(
+                opened.search(&[4.2, 3.5, 1.0], 5).unwrap(),
+                store.search(&[4.2, 3.5, 1.0], 5).unwrap()
+            );
+        }
+
+        // Removing from a mapped store leaves the file, and its checksum, alone
+        let mut mapped = VectorStore::open(&path, true, false).unwrap();
+        let _ = mapped.remove(1).unwrap();
+        mapped.verify().unwrap();
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_version_1_files_open() {
+        let path = temp_path("v1");
+        let store = sample_store();
+        let mut hasher = crc32fast::Hasher::new();
+        hasher.update(bytemuck::cast_slice(&store.data));
+        hasher.update(bytemuck::cast_slice(&store.norms));
+        let mut header = Header::new(3, 3, false, 3, hasher.finalize());
+        header.version = 1;
+        let mut bytes = header.encode().to_vec();
+        bytes.extend_from_slice(bytemuck::cast_slice(&store.data));
+        bytes.extend_from_slice(bytemuck::cast_slice(&store.norms));
+        fs::write(&path, bytes).unwrap();
+
+        let opened = VectorStore::open(&path, false, true).unwrap();
+        assert_eq!(opened.next_id(), 3);
+        assert_eq!(opened.removed_count(), 0);
+        assert_eq!(
+            opened.search(&[4.2, 3.5, 1.0], 3).unwrap(),
+            store.search(&[4.2, 3.5, 1.0], 3).unwrap()
+        );
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_newer_version_rejected() {
+        let path = temp_path("version");
+        sample_store().save(&path).unwrap();
+        let mut bytes = fs::read(&path).unwrap();
+        bytes[8..12].copy_from_slice(&(VERSION + 1).to_le_bytes());
+        let crc = header_crc(bytes[..HEADER_LEN].try_into().unwrap(), VERSION + 1);
+        bytes[52..56].copy_from_slice(&crc.to_le_bytes());
+        fs::write(&path, bytes).unwrap();
+
+        assert!(matches!(
+            VectorStore::open(&path, true, false),
+            Err(VectorStoreError::UnsupportedVersion(v)) if v == VERSION + 1
+        ));
+        fs::remove_file(&path).unwrap();
+    }
+}
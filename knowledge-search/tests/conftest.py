@@ -1,7 +1,21 @@
 """Pytest configuration - runs before test collection"""
 import sys
 from pathlib import Path
+import pytest
 
 # Add project root to path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """A fake OpenAI endpoint making 8-dim embeddings. Clients created
+    without arguments talk to it."""
+    from fake_openai import FakeEmbeddingServer
+
+    with FakeEmbeddingServer(dimensions=8) as server:
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-key")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+        yield server
+
@@ -0,0 +1,117 @@
+"""On-disk embedding cache, shared across generators, threads and processes"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pytest
+from embedding_cache import EmbeddingCache
+from embedding_backends import OpenAIBackend
+from embeddings import EmbeddingGenerator
+from fake_openai import FakeEmbeddingServer, fake_embedding
+
+
+@pytest.fixture
+def server():
+    with FakeEmbeddingServer(dimensions=16) as server:
+        yield server
+
+
+def _write_from_process(path: str, worker: int) -> int:
+    cache = EmbeddingCache(path)
+    cache.put_many("model", [(f"w{worker} t{i}", [float(i)] * 4) for i in range(50)])
+    return len(cache.get_many("model", [f"w{worker} t{i}" for i in range(50)]))
+
+
+class TestEmbeddingCache:
+    def test_round_trip_float32(self, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+        vector = fake_embedding("rust", 16).tolist()
+        cache.put("model", "rust", vector)
+
+        assert cache.get("model", "rust") == vector
+        assert cache.get("model", "python") is None
+        assert cache.size_bytes() == 16 * 4
+
+    def test_key_includes_model(self, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+        cache.put("small", "rust", [1.0, 2.0])
+
+        assert cache.get("large", "rust") is None
+
+    def test_persists_across_instances(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        EmbeddingCache(path).put("model", "rust", [1.0, 2.0])
+
+        assert EmbeddingCache(path).get("model", "rust") == [1.0, 2.0]
+
+    def test_evicts_least_recently_used_over_cap(self, tmp_path):
+        # Room for 10 four-dim vectors
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=160)
+        for i in range(10):
+            cache.put("model", f"t{i}", [float(i)] * 4)
+        cache.get("model", "t0")  # t0 is now the most recently used
+        cache.put("model", "t10", [10.0] * 4)
+
+        # Evicted down to 90% of the cap: two of the untouched entries go
+        assert cache.size_bytes() <= 160
+        assert len(cache) == 9
+        assert cache.get("model", "t0") is not None
+        assert cache.get("model", "t10") is not None
+
+    def test_concurrent_threads(self, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+
+        def work(worker):
+            for i in range(20):
+                cache.put("model", f"w{worker} t{i}", [float(i)] * 4)
+                assert cache.get("model", f"w{worker} t{i}") == [float(i)] * 4
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(8)))
+        assert len(cache) == 160
+
+    def test_concurrent_processes(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        EmbeddingCache(path)
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            counts = list(executor.map(_write_from_process, [path] * 4, range(4)))
+
+        assert counts == [50] * 4
+        assert len(EmbeddingCache(path)) == 200
+
+
+class TestGeneratorWithDiskCache:
+    def test_warm_run_makes_no_requests(self, server, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        texts = [f"chunk {i}" for i in range(30)]
+        cold = EmbeddingGenerator(client=server.client(), disk_cache=EmbeddingCache(path))
+        first = cold.embed_batch(texts)
+        sent = len(server.requests)
+
+        warm = EmbeddingGenerator(client=server.client(), disk_cache=EmbeddingCache(path))
+        second = warm.embed_batch(texts)
+        single = warm.embed_text("Chunk 3")
+
+        assert len(server.requests) == sent
+        assert warm.get_cache_stats()["disk_hits"] == 30
+        assert np.allclose(second, first)
+        assert np.allclose(single, first[3])
+
+    def test_embed_text_writes_through(self, server, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+        embed_gen = EmbeddingGenerator(client=server.client(), disk_cache=cache)
+        embed_gen.embed_text("rust")
+
+        assert np.allclose(cache.get(embed_gen.model, "rust"), fake_embedding("rust", 16))
+
+    def test_shortened_vectors_cached_apart(self, server, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        full = EmbeddingGenerator(client=server.client(), disk_cache=EmbeddingCache(path))
+        full.embed_batch(["rust", "zig"])
+        sent = len(server.requests)
+
+        backend = OpenAIBackend(server.client(), dimensions=8)
+        short = EmbeddingGenerator(disk_cache=EmbeddingCache(path), backend=backend)
+        short.embed_batch(["rust", "zig"])
+
+        assert backend.cache_key == "text-embedding-3-small:8"
+        assert short.get_cache_stats()["disk_hits"] == 0
+        assert len(server.requests) == sent + 1
@@ -0,0 +1,274 @@
+"""Batch embedding against the local fake endpoint (no API key needed)"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import numpy as np
+import pytest
+from openai import BadRequestError
+from embeddings import EmbeddingGenerator, LRUCache
+from embedding_backends import EmbeddingBackend, HashingBackend, OpenAIBackend, make_backend
+from fake_openai import FakeEmbeddingServer, fake_embedding, latency_distribution
+
+
+@pytest.fixture
+def server():
+    with FakeEmbeddingServer(dimensions=16) as server:
+        yield server
+
+
+class TestEmbedBatch:
+    def test_one_request_for_whole_batch(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client())
+        texts = ["rust", "python", "zig", "go"]
+        embeds = embed_gen.embed_batch(texts)
+
+        assert len(server.requests) == 1
+        for text, vector in zip(texts, embeds):
+            assert np.allclose(vector, fake_embedding(text, 16))
+
+    def test_results_in_input_order_with_cache_hits(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client())
+        cached = embed_gen.embed_text("python")
+        embeds = embed_gen.embed_batch(["rust", "Python", "go", "  RUST "])
+
+        assert server.requests[-1] == ["rust", "go"]  # cached and repeated texts not resent
+        assert embeds[1] == cached
+        assert embeds[3] == embeds[0]
+        assert embed_gen.cache_hits == 2
+        assert embed_gen.cache_misses == 3
+
+    def test_fills_cache(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client())
+        embed_gen.embed_batch(["rust", "python"])
+        embed_gen.embed_text("RUST")
+
+        assert len(server.requests) == 1
+        assert embed_gen.get_cache_stats()["hits"] == 1
+
+    def test_batch_larger_than_cache(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client())
+        embed_gen.cache_max_size = 2
+        texts = [f"note {i}" for i in range(5)]
+        embeds = embed_gen.embed_batch(texts)
+
+        assert len(embeds) == 5
+        assert len(embed_gen.cache) == 2
+        assert np.allclose(embeds[0], fake_embedding("note 0", 16))
+
+    def test_splits_at_input_limit(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client(), max_batch_inputs=2)
+        embed_gen.embed_batch(["a1", "a2", "a3", "a4", "a5"])
+
+        assert [len(r) for r in server.requests] == [2, 2, 1]
+
+    def test_splits_at_token_budget(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client(), max_batch_tokens=25)
+        embed_gen.embed_batch(["x" * 30, "y" * 30, "z" * 30])
+
+        # 11 estimated tokens each: two fit under 25, the third starts a new request
+        assert [len(r) for r in server.requests] == [2, 1]
+
+    def test_rejected_batch_is_halved_and_retried(self, server):
+        server.max_tokens = 10
+        embed_gen = EmbeddingGenerator(client=server.client())
+        texts = ["alpha", "beta gamma delta epsilon zeta", "x" * 30, "beta"]
+        embeds = embed_gen.embed_batch(texts)
+
+        assert [len(r) for r in server.requests] == [4, 2, 2]
+        for text, vector in zip(texts, embeds):
+            assert np.allclose(vector, fake_embedding(text, 16))
+
+    def test_single_oversized_input_raises(self, server):
+        server.max_tokens = 10
+        embed_gen = EmbeddingGenerator(client=server.client())
+
+        with pytest.raises(BadRequestError):
+            embed_gen.embed_batch(["y" * 100])
+
+    def test_empty_text_rejected_before_any_request(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client())
+
+        with pytest.raises(ValueError, match="Text cannot be empty or whitespace"):
+            embed_gen.embed_batch(["rust", "   "])
+        assert server.requests == []
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.put("a", [1.0])
+        cache.put("b", [2.0])
+        cache.get("a")
+        cache.put("c", [3.0])
+
+        assert cache.keys() == ["a", "c"]
+        assert cache.evictions == 1
+
+    def test_bounded_by_bytes(self):
+        one = LRUCache.entry_bytes("k0", [0.0] * 100)
+        cache = LRUCache(max_bytes=3 * one)
+        for i in range(5):
+            cache.put(f"k{i}", [0.0] * 100)
+
+        assert len(cache) == 3
+        assert cache.bytes == 3 * one
+        assert "k0" not in cache
+
+    def test_replacing_entry_keeps_byte_count(self):
+        cache = LRUCache()
+        cache.put("a", [1.0, 2.0])
+        cache.put("a", [1.0, 2.0])
+
+        assert cache.bytes == LRUCache.entry_bytes("a", [1.0, 2.0])
+
+
+class TestConcurrentEmbedding:
+    def test_identical_texts_share_one_request(self, server):
+        server.latency = 0.2
+        embed_gen = EmbeddingGenerator(client=server.client())
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            embeds = list(executor.map(embed_gen.embed_text, ["Rust"] * 8))
+
+        assert len(server.requests) == 1
+        assert all(vector == embeds[0] for vector in embeds)
+        stats = embed_gen.get_cache_stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 7
+
+    def test_counters_consistent_under_threads(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client())
+        texts = [f"note {i % 10}" for i in range(100)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(embed_gen.embed_text, texts))
+
+        stats = embed_gen.get_cache_stats()
+        assert stats["hits"] + stats["misses"] == 100
+        assert stats["misses"] == 10
+        assert stats["size"] == 10
+        assert stats["bytes"] == embed_gen.cache.bytes > 0
+
+    def test_failed_request_reaches_waiters(self, server):
+        server.latency = 0.2
+        server.max_tokens = 10
+        embed_gen = EmbeddingGenerator(client=server.client())
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(embed_gen.embed_text, "y" * 100) for _ in range(4)]
+
+        for future in futures:
+            with pytest.raises(BadRequestError):
+                future.result()
+        assert embed_gen._inflight == {}
+
+
+class TestAsyncEmbedding:
+    def test_aembed_batch_one_request(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client(), async_client=server.async_client())
+        texts = ["rust", "python", "zig"]
+        embeds = asyncio.run(embed_gen.aembed_batch(texts))
+
+        assert len(server.requests) == 1
+        for text, vector in zip(texts, embeds):
+            assert np.allclose(vector, fake_embedding(text, 16))
+
+    def test_shares_cache_with_blocking_path(self, server):
+        embed_gen = EmbeddingGenerator(client=server.client(), async_client=server.async_client())
+        cached = embed_gen.embed_text("rust")
+        vector = asyncio.run(embed_gen.aembed_text("RUST"))
+
+        assert vector == cached
+        assert len(server.requests) == 1
+        assert embed_gen.cache_hits == 1
+
+    def test_concurrent_identical_texts_coalesce(self, server):
+        server.latency = 0.2
+        embed_gen = EmbeddingGenerator(client=server.client(), async_client=server.async_client())
+
+        async def run():
+            return await asyncio.gather(*(embed_gen.aembed_text("Rust") for _ in range(8)))
+
+        embeds = asyncio.run(run())
+        assert len(server.requests) == 1
+        assert all(vector == embeds[0] for vector in embeds)
+        assert embed_gen.get_cache_stats()["coalesced"] == 7
+
+    def test_async_failure_raises(self, server):
+        server.max_tokens = 10
+        embed_gen = EmbeddingGenerator(client=server.client(), async_client=server.async_client())
+
+        with pytest.raises(BadRequestError):
+            asyncio.run(embed_gen.aembed_batch(["y" * 100]))
+        assert embed_gen._inflight == {}
+
+
+class TestHashingBackend:
+    def test_unit_vectors_independent_of_batch(self):
+        backend = HashingBackend(64)
+        vectors = backend.embed_array(["Rust ownership", "naïve café", "x"])
+
+        assert vectors.shape == (3, 64) and vectors.dtype == np.float32
+        assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+        # A text embeds the same alone, in another batch or in another instance
+        assert np.array_equal(HashingBackend(64).embed_array(["naïve café"])[0], vectors[1])
+        assert backend.embed(["Rust ownership"])[0] == vectors[0].tolist()
+
+    def test_shared_spelling_is_closer(self):
+        a, b, c = HashingBackend().embed_array(
+            ["Ownership and borrowing in Rust", "rust ownership & borrowing", "Baking cookies at 350F"])
+
+        assert a @ b > 0.5
+        assert a @ b > a @ c + 0.3
+
+    def test_make_backend_specs(self, monkeypatch):
+        assert make_backend("hashing", dimensions=32).dimensions == 32
+        assert make_backend("hashing:16", dimensions=32).model == "hashing-3-4-5-16"
+        backend = make_backend("openai:text-embedding-3-large:256")
+        assert isinstance(backend, OpenAIBackend)
+        assert (backend.model, backend.dimensions) == ("text-embedding-3-large", 256)
+        monkeypatch.setenv("EMBEDDING_BACKEND", "hashing:8")
+        assert make_backend().dimensions == 8
+        with pytest.raises(ValueError, match="unknown embedding backend"):
+            make_backend("word2vec")
+        # A backend must say how it embeds
+        with pytest.raises(TypeError):
+            EmbeddingBackend()
+
+    def test_generator_offline(self, monkeypatch):
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        embed_gen = EmbeddingGenerator(backend=HashingBackend(16))
+        embeds = embed_gen.embed_batch(["rust", "zig", "RUST"])
+        asyncio.run(embed_gen.aembed_batch(["go", "zig"]))
+
+        assert embeds[0] == embeds[2] == HashingBackend(16).embed(["rust"])[0]
+        assert embed_gen.model == "hashing-3-4-5-16" and embed_gen.dimensions == 16
+        stats = embed_gen.get_cache_stats()
+        assert stats["requests"] == 2
+        assert (stats["hits"], stats["misses"]) == (2, 3)
+
+
+class TestLatencyDistribution:
+    def test_seeded_draws_repeat(self):
+        first = latency_distribution("lognormal:0.05:0.3", seed=3)
+        second = latency_distribution("lognormal:0.05:0.3", seed=3)
+        draws = [first() for _ in range(2000)]
+
+        assert draws[:10] == [second() for _ in range(10)]
+        assert np.percentile(draws, 50) == pytest.approx(0.05, rel=0.15)
+        assert np.percentile(draws, 99) == pytest.approx(0.3, rel=0.3)
+
+    def test_constant_and_uniform(self):
+        assert latency_distribution("0.25")() == 0.25
+        draws = [latency_distribution("uniform:0.1:0.2", seed=i)() for i in range(50)]
+        assert all(0.1 <= d < 0.2 for d in draws)
+
+    def test_unknown_spec_rejected(self):
+        with pytest.raises(ValueError):
+            latency_distribution("gamma:1:2")
+        with pytest.raises(ValueError):
+            latency_distribution("lognormal:0.3:0.05")
+
+    def test_server_draws_per_request(self, server):
+        server.latency = latency_distribution("uniform:0.05:0.1")
+        embed_gen = EmbeddingGenerator(client=server.client())
+        embed_gen.embed_text("rust")
+        embed_gen.embed_text("zig")
+
+        assert len(server.requests) == 2
@@ -1,11 +1,25 @@
 """Comprehensive FFI integration tests"""
+import array
+import asyncio
+import copy
+import contextlib
+import threading
+import time
+import numpy as np
 import pytest
-from knowledge_search import VectorStore
+from knowledge_search import VectorStore, HnswIndex, QuantizedVectorStore, Bm25Index, hybrid_search
 from docstore import DocStore
 from embeddings import EmbeddingGenerator
-from openai import RateLimitError, AuthenticationError, APIConnectionError
+from openai import RateLimitError, AuthenticationError, APIConnectionError, BadRequestError
 from rag_pipeline import RAGPipeline
-from obsidian_ingestion import MarkdownChunker
+from obsidian_ingestion import MarkdownChunker, ObsidianIngestion
+from fake_openai import FakeEmbeddingServer, latency_distribution
+from answer_cache import AnswerCache
+from query_batcher import QueryBatcher
+from metrics import Metrics
+from context_packing import count_tokens, pack_context, trim_to_tokens
+from evaluation import TestQuery as EvalQuery, retrieval_scores, run_evaluation
+from parameter_sweep import SweepConfig, ground_truth_texts, grid, pareto_front, run_sweep
 
 
 class TestVectorStoreBasics:
@@ -34,6 +48,17 @@ class TestVectorStoreBasics:
         results = store.search([1.0, 0.0], k=10)
         assert len(results) == 2  # Only returns what's available
 
+    def test_removed_vector_not_returned(self):
+        store = VectorStore(dimensions=2)
+        store.add_many([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]])
+        assert store.remove(0)
+        assert not store.remove(0)
+        assert [r.index for r in store.search([1.0, 0.0], k=3)] == [1, 2]
+        assert len(store) == 3
+        assert store.removed_count == 1
+        with pytest.raises(IndexError):
+            store.remove(3)
+
 
 class TestErrorHandling:
     def test_dimension_mismatch_on_add(self):
@@ -95,6 +120,407 @@ class TestResultOrdering:
             assert results[i].similarity >= results[i+1].similarity
 
 
+class TestBufferProtocol:
+    def test_add_numpy_float32(self):
+        store = VectorStore(dimensions=3)
+        idx = store.add(np.array([1.0, 0.0, 0.0], dtype=np.float32))
+        assert idx == 0
+
+    def test_add_array_and_memoryview(self):
+        store = VectorStore(dimensions=3)
+        store.add(array.array('f', [1.0, 0.0, 0.0]))
+        store.add(memoryview(array.array('f', [0.0, 1.0, 0.0])))
+        results = store.search(np.array([0.0, 1.0, 0.0], dtype=np.float32), k=1)
+        assert results[0].index == 1
+
+    def test_float64_array_still_accepted(self):
+        store = VectorStore(dimensions=2)
+        store.add(np.array([1.0, 0.0]))  # float64 falls back to element-wise conversion
+        assert store.search([1.0, 0.0], k=1)[0].index == 0
+
+    def test_search_as_numpy(self):
+        store = VectorStore(dimensions=2)
+        store.add([1.0, 0.0])
+        store.add([0.5, 0.5])
+        store.add([0.0, 1.0])
+
+        indices, similarities = store.search(
+            np.array([1.0, 0.0], dtype=np.float32), k=2, as_numpy=True)
+
+        assert isinstance(indices, np.ndarray)
+        assert similarities.dtype == np.float32
+        assert indices.tolist() == [0, 1]
+        assert abs(similarities[0] - 1.0) < 0.0001
+
+    def test_dimension_mismatch_on_buffer(self):
+        store = VectorStore(dimensions=3)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            store.add(np.zeros(2, dtype=np.float32))
+
+
+class TestBatchOperations:
+    def test_add_many_returns_sequential_indices(self):
+        store = VectorStore(dimensions=2)
+        store.add([1.0, 0.0])
+        indices = store.add_many([[0.0, 1.0], [0.5, 0.5]])
+        assert indices == [1, 2]
+
+    def test_add_many_numpy_matrix(self):
+        store = VectorStore(dimensions=3)
+        indices = store.add_many(np.eye(3, dtype=np.float32))
+        assert indices == [0, 1, 2]
+
+    def test_add_many_ragged_rows(self):
+        store = VectorStore(dimensions=3)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            store.add_many([[1.0, 0.0, 0.0], [1.0, 0.0]])
+
+    @pytest.mark.parametrize("cls", [VectorStore, HnswIndex, QuantizedVectorStore])
+    def test_misshaped_matrix_rejected(self, cls):
+        store = cls(16)
+        # 4 x 8 holds as many floats as 2 x 16, but its rows are not vectors
+        block = np.ones((4, 8), dtype=np.float32)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            store.add_many(block)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            store.search_many(block, k=1)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            store.add_many([[1.0] * 8] * 4)
+        with pytest.raises(ValueError, match="2-D"):
+            store.add_many(np.ones(32, dtype=np.float32))
+        with pytest.raises(ValueError, match="C-contiguous"):
+            store.add_many(np.ones((16, 2), dtype=np.float32).T)
+        assert len(store) == 0
+
+    def test_search_many_matches_search(self):
+        store = VectorStore(dimensions=2)
+        store.add_many([[1.0, 0.0], [0.5, 0.5], [0.0, 1.0]])
+        queries = [[1.0, 0.0], [0.0, 1.0]]
+
+        batched = store.search_many(queries, k=2)
+
+        assert len(batched) == 2
+        for query, results in zip(queries, batched):
+            single = store.search(query, k=2)
+            assert [r.index for r in results] == [r.index for r in single]
+
+    def test_search_many_as_numpy(self):
+        store = VectorStore(dimensions=2)
+        store.add_many(np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+
+        indices, similarities = store.search_many(
+            np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32), k=1, as_numpy=True)
+
+        assert indices.shape == (2, 1)
+        assert indices[:, 0].tolist() == [0, 1]
+        assert similarities.shape == (2, 1)
+
+
+class TestPersistence:
+    def test_save_and_open_round_trip(self, tmp_path):
+        path = str(tmp_path / "vectors.ksvs")
+        store = VectorStore(dimensions=2)
+        store.add_many([[1.0, 0.0], [0.5, 0.5], [0.0, 1.0]])
+        store.save(path)
+
+        for mmap in (True, False):
+            opened = VectorStore.open(path, mmap=mmap)
+            assert opened.is_mapped == mmap
+            assert opened.dimensions == 2
+            assert len(opened) == 3
+            assert opened.search([0.0, 1.0], k=1)[0].index == 2
+
+    def test_opened_store_accepts_new_vectors(self, tmp_path):
+        path = str(tmp_path / "vectors.ksvs")
+        store = VectorStore(dimensions=2)
+        store.add([1.0, 0.0])
+        store.save(path)
+
+        opened = VectorStore.open(path)
+        assert opened.add([0.0, 1.0]) == 1
+
+    def test_corrupt_file_rejected(self, tmp_path):
+        path = tmp_path / "vectors.ksvs"
+        store = VectorStore(dimensions=2)
+        store.add([1.0, 0.0])
+        store.save(str(path))
+
+        raw = bytearray(path.read_bytes())
+        raw[-1] ^= 0xFF
+        path.write_bytes(bytes(raw))
+
+        with pytest.raises(ValueError, match="checksum"):
+            VectorStore.open(str(path), mmap=False)
+        with pytest.raises(ValueError, match="checksum"):
+            VectorStore.open(str(path), mmap=True).verify()
+
+    def test_removals_and_ids_persist(self, tmp_path):
+        path = str(tmp_path / "vectors.ksvs")
+        store = VectorStore(dimensions=2)
+        store.add_many([[1.0, 0.0], [0.5, 0.5], [0.0, 1.0]])
+        store.remove(0)
+        store.compact()
+        store.remove(2)
+        store.save(path)
+
+        for mmap in (True, False):
+            opened = VectorStore.open(path, mmap=mmap)
+            assert opened.next_id == 3
+            assert opened.is_removed(0) and opened.is_removed(2)
+            assert [r.index for r in opened.search([1.0, 0.0], k=3)] == [1]
+
+    def test_missing_file_raises_os_error(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            VectorStore.open(str(tmp_path / "missing.ksvs"))
+
+    def test_docstore_save_and_load(self, tmp_path):
+        path = str(tmp_path / "docs.ksds")
+        store = DocStore()
+        store.add_document("prompt one", "file1.md")
+        store.add_document("prompt two", "file2.md")
+        store.save(path)
+
+        loaded = DocStore.load(path)
+        assert loaded.get_document(1) == "file2.md: prompt two\n"
+        assert loaded.add_document("prompt three", "file3.md") == 2
+
+
+class TestFilteredSearch:
+    @pytest.fixture
+    def store(self):
+        store = VectorStore(dimensions=2)
+        store.add_many(
+            [[1.0, 0.0], [0.9, 0.1], [0.8, 0.2], [0.0, 1.0]],
+            [{"folder": "week-14", "tags": ["rust", "async"], "modified": 100},
+             {"folder": "week-15", "tags": "rust", "modified": 200},
+             {"folder": "week-15", "modified": 300},
+             None])
+        return store
+
+    def test_filter_keeps_top_k_full(self, store):
+        results = store.search([1.0, 0.0], k=2, filter={"folder": "week-15"})
+        assert [r.index for r in results] == [1, 2]
+
+    def test_conditions(self, store):
+        def hits(filter):
+            return sorted(r.index for r in store.search([1.0, 0.0], k=4, filter=filter))
+
+        assert hits({"tags": "rust"}) == [0, 1]
+        assert hits({"tags": ["async", "python"]}) == [0]
+        assert hits({"modified": {"gt": 100, "lte": 300}}) == [1, 2]
+        assert hits({"folder": "week-15", "tags": "rust"}) == [1]
+        assert hits({"$or": [{"folder": "week-14"}, {"modified": {"gte": 300}}]}) == [0, 2]
+        assert hits({"$not": {"tags": "rust"}}) == [2, 3]
+        assert hits({"author": "me"}) == []
+        assert store.count({"folder": "week-15"}) == 2
+
+    def test_removed_vectors_never_match(self, store):
+        store.remove(1)
+        assert store.count({"tags": "rust"}) == 1
+        assert [r.index for r in store.search([1.0, 0.0], k=2, filter={"tags": "rust"})] == [0]
+
+    def test_attributes_round_trip(self, store):
+        assert store.get_attributes(0) == {
+            "folder": "week-14", "modified": 100, "tags": ["async", "rust"]}
+        assert store.get_attributes(3) == {}
+        store.set_attributes(3, {"folder": "archive"})
+        assert store.count({"folder": "archive"}) == 1
+        with pytest.raises(IndexError):
+            store.set_attributes(9, {"folder": "archive"})
+
+    def test_invalid_attributes(self, store):
+        with pytest.raises(ValueError, match="str or int"):
+            store.add([1.0, 1.0], {"score": 0.5})
+        with pytest.raises(ValueError, match="length mismatch"):
+            store.add_many([[1.0, 1.0]], [{"folder": "a"}, {"folder": "b"}])
+        with pytest.raises(ValueError, match="unknown comparison"):
+            store.search([1.0, 0.0], k=1, filter={"modified": {"after": 100}})
+
+
+class TestUpdateAndCompact:
+    def test_update_in_place(self):
+        store = VectorStore(dimensions=2)
+        store.add_many([[1.0, 0.0], [0.0, 1.0]], [{"folder": "a"}, {"folder": "b"}])
+        store.update(0, np.array([0.0, 3.0], dtype=np.float32))
+
+        results = store.search([0.0, 1.0], k=2)
+        assert abs(results[0].similarity - 1.0) < 1e-6
+        assert abs(results[1].similarity - 1.0) < 1e-6
+        assert store.get_attributes(0) == {"folder": "a"}
+        store.remove(1)
+        with pytest.raises(IndexError, match="removed"):
+            store.update(1, [1.0, 0.0])
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            store.update(0, [1.0])
+
+    def test_compact_keeps_ids(self):
+        store = VectorStore(dimensions=2)
+        store.add_many([[1.0, 0.0], [0.9, 0.1], [0.1, 0.9], [0.0, 1.0]])
+        store.remove(0)
+        store.remove(2)
+        stats = store.fragmentation()
+        assert stats["slots"] == 4 and stats["live"] == 2
+        assert stats["removed_fraction"] == 0.5
+        assert stats["reclaimable_bytes"] == 2 * 3 * 4
+
+        assert store.compact() == 2
+        assert len(store) == 2
+        assert store.fragmentation()["removed"] == 0
+        assert [r.index for r in store.search([1.0, 0.0], k=4)] == [1, 3]
+        assert store.add([1.0, 0.0]) == 4
+        assert not store.remove(0)
+
+
+class TestHnswIndex:
+    def test_add_returns_sequential_indices(self):
+        index = HnswIndex(dimensions=2)
+        assert index.add([1.0, 0.0]) == 0
+        assert index.add_many([[0.0, 1.0], [0.5, 0.5]]) == [1, 2]
+        assert len(index) == 3
+
+    def test_search_finds_identical_vector(self):
+        index = HnswIndex(dimensions=3, m=8, ef_construction=50)
+        index.add_many([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+        results = index.search([0.0, 1.0, 0.0], k=1)
+        assert results[0].index == 1
+        assert abs(results[0].similarity - 1.0) < 0.0001
+
+    def test_recall_matches_flat_store(self):
+        rng = np.random.default_rng(0)
+        data = rng.standard_normal((500, 16)).astype(np.float32)
+        queries = rng.standard_normal((10, 16)).astype(np.float32)
+
+        flat = VectorStore(dimensions=16)
+        flat.add_many(data)
+        index = HnswIndex(dimensions=16, m=12, ef_construction=100)
+        index.add_many(data)
+
+        hits = 0
+        for truth, approx in zip(flat.search_many(queries, k=10),
+                                 index.search_many(queries, k=10, ef_search=200)):
+            hits += len({r.index for r in truth} & {r.index for r in approx})
+        assert hits / 100 >= 0.9
+
+    def test_ef_search_is_adjustable(self):
+        index = HnswIndex(dimensions=2, ef_search=10)
+        index.ef_search = 128
+        assert index.ef_search == 128
+
+    def test_dimension_mismatch(self):
+        index = HnswIndex(dimensions=3)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            index.add([1.0, 0.0])
+
+
+class TestQuantizedVectorStore:
+    @pytest.mark.parametrize("mode", ["f16", "int8"])
+    def test_search_finds_identical_vector(self, mode):
+        store = QuantizedVectorStore(dimensions=3, mode=mode)
+        assert store.mode == mode
+        store.add_many([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.3, 0.3, 0.9]])
+        results = store.search([0.0, 1.0, 0.0], k=1)
+        assert results[0].index == 1
+        assert abs(results[0].similarity - 1.0) < 0.01
+
+    def test_memory_is_smaller_than_f32(self):
+        data = np.random.default_rng(0).standard_normal((100, 1536)).astype(np.float32)
+        f16 = QuantizedVectorStore(dimensions=1536, mode="f16")
+        int8 = QuantizedVectorStore(dimensions=1536, mode="int8")
+        f16.add_many(data)
+        int8.add_many(data)
+        assert f16.memory_bytes() < data.nbytes / 2 + 1024
+        assert int8.memory_bytes() < data.nbytes / 4 + 1024
+
+    def test_rescoring_with_full_precision_on_disk(self, tmp_path):
+        rng = np.random.default_rng(1)
+        data = rng.standard_normal((300, 32)).astype(np.float32)
+        query = rng.standard_normal(32).astype(np.float32)
+        flat = VectorStore(dimensions=32)
+        flat.add_many(data)
+        flat.save(tmp_path / "vectors.ksvs")
+
+        store = QuantizedVectorStore.from_store(flat, mode="int8", rescore_factor=8)
+        store.attach_full_precision(tmp_path / "vectors.ksvs")
+        assert store.has_full_precision
+
+        exact = flat.search(query, k=5)
+        rescored = store.search(query, k=5)
+        assert [r.index for r in rescored] == [r.index for r in exact]
+        for got, want in zip(rescored, exact):
+            assert abs(got.similarity - want.similarity) < 1e-5
+
+    def test_attach_rejects_different_store(self, tmp_path):
+        flat = VectorStore(dimensions=2)
+        flat.add([1.0, 0.0])
+        flat.save(tmp_path / "vectors.ksvs")
+        store = QuantizedVectorStore(dimensions=2)
+        with pytest.raises(ValueError, match="length mismatch"):
+            store.attach_full_precision(tmp_path / "vectors.ksvs")
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError, match="quantization mode"):
+            QuantizedVectorStore(dimensions=2, mode="int4")
+
+
+class TestBm25Index:
+    def test_exact_term_ranks_first(self):
+        index = Bm25Index()
+        index.add_many([
+            "async runtimes poll futures",
+            "tokio spawns tasks on a thread pool",
+            "Error E0502: cannot borrow as mutable",
+        ])
+        results = index.search("E0502", k=3)
+        assert [r.index for r in results] == [2]
+        assert results[0].similarity > 0
+
+    def test_remove_hides_document(self):
+        index = Bm25Index(k1=1.5, b=0.5)
+        index.add("rust borrow checker")
+        index.add("rust lifetimes")
+        assert index.remove(0)
+        assert not index.remove(0)
+        assert index.is_removed(0)
+        assert index.removed_count == 1
+        assert [r.index for r in index.search("rust", k=5)] == [1]
+        with pytest.raises(IndexError):
+            index.remove(7)
+
+    def test_numpy_results(self):
+        index = Bm25Index()
+        index.add_many(["alpha beta", "beta gamma", "gamma delta"])
+        assert len(index) == 3
+        assert index.vocabulary_size == 4
+        indices, scores = index.search("gamma", k=2, as_numpy=True)
+        assert sorted(indices.tolist()) == [1, 2]
+        assert scores.dtype == np.float32
+
+    def test_hybrid_search_combines_rankings(self):
+        texts = ["vector search with cosine", "keyword E0502 borrow error", "unrelated"]
+        vectors = [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]]
+        store = VectorStore(dimensions=2)
+        store.add_many(vectors)
+        keywords = Bm25Index()
+        keywords.add_many(texts)
+
+        fused = hybrid_search(store, keywords, [1.0, 0.0], "E0502", k=3)
+        # Doc 1 is last by vector but the only keyword hit
+        assert {r.index for r in fused[:2]} == {0, 1}
+
+        semantic = hybrid_search(store, keywords, [1.0, 0.0], "E0502", k=1,
+                                 fusion="weighted", alpha=1.0)
+        lexical = hybrid_search(store, keywords, [1.0, 0.0], "E0502", k=1,
+                                fusion="weighted", alpha=0.0)
+        assert semantic[0].index == 0
+        assert lexical[0].index == 1
+
+    def test_hybrid_search_rejects_unknown_fusion(self):
+        store = VectorStore(dimensions=2)
+        keywords = Bm25Index()
+        with pytest.raises(ValueError, match="unknown fusion"):
+            hybrid_search(store, keywords, [1.0, 0.0], "query", k=1, fusion="max")
+
+
 class TestDocStore:
     def test_docstore_initialized(self):
         store = DocStore()
@@ -140,6 +566,72 @@ class TestDocStore:
 
         assert list(store.store.keys()) == [0, 1, 2, 3]
 
+    def test_add_documents_batch(self):
+        store = DocStore()
+        store.add_document("prompt one", "file1.md")
+
+        assert store.add_documents(["prompt two", "prompt three"], ["file2.md", "file1.md"]) == [1, 2]
+        assert store.get_documents([2, 0]) == ["file1.md: prompt three\n", "file1.md: prompt one\n"]
+        with pytest.raises(ValueError):
+            store.add_documents(["prompt four"], [])
+
+    def test_removed_ids_are_not_reused(self):
+        store = DocStore()
+        store.add_documents(["one", "two", "three"], ["a.md"] * 3)
+
+        assert store.remove_document(2)
+        assert not store.remove_document(2)
+        assert store.add_document("four", "a.md") == 3
+        assert store.get_documents([0, 1, 2, 3]) == ["a.md: one\n", "a.md: two\n", "a.md: four\n"]
+        assert 2 not in store.store
+        assert len(store.store) == 3
+
+    def test_get_documents_accepts_numpy_ids(self):
+        store = DocStore()
+        store.add_documents(["one", "two"], ["a.md", "b.md"])
+
+        assert store.get_documents(np.array([1, 5, -1])) == ["b.md: two\n"]
+
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_save_and_load_binary(self, tmp_path, mmap):
+        path = str(tmp_path / "docs.ksds")
+        store = DocStore()
+        store.add_documents(["naïve text", "two", "three"], ["a.md", "b.md", "a.md"])
+        store.remove_document(1)
+        store.save(path)
+
+        loaded = DocStore.load(path, mmap=mmap)
+        assert loaded.get_documents([0, 1, 2]) == ["a.md: naïve text\n", "a.md: three\n"]
+        assert loaded.removed_ids() == [1]
+        # Appending to a mapped store copies it first
+        assert loaded.add_document("four", "c.md") == 3
+        assert loaded.get_document(3) == "c.md: four\n"
+
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_token_counts_saved_and_format_1_loads(self, tmp_path, mmap):
+        path = tmp_path / "docs.ksds"
+        store = DocStore()
+        store.add_documents(["naïve text", "two words here", "three"], ["a.md", "b.md", "a.md"])
+        expected = [count_tokens(document) for document in store.get_documents([0, 1, 2])]
+        assert store.token_counts([0, 1, 2]) == expected
+        store.save(str(path))
+        assert DocStore.load(str(path), mmap=mmap).token_counts([2, 0]) == [expected[2], expected[0]]
+
+        # Format 1 is the same file without the token_counts column
+        raw = path.read_bytes()
+        tokens_at = 64 + 8 * 4 + 4 * 3
+        path.write_bytes(b"KSDOCS01" + raw[8:tokens_at] + raw[tokens_at + 4 * 3:])
+        old = DocStore.load(str(path), mmap=mmap)
+        assert old.get_documents([0, 1, 2]) == store.get_documents([0, 1, 2])
+        assert old.add_document("four", "c.md") == 3
+        assert old.token_counts([0, 1, 2, 3]) == expected + [count_tokens("c.md: four\n")]
+
+    def test_load_rejects_other_files(self, tmp_path):
+        path = tmp_path / "docs.ksds"
+        path.write_bytes(b"not a docstore".ljust(64, b"\0"))
+        with pytest.raises(ValueError, match="not a document store"):
+            DocStore.load(str(path))
+
 
 class TestEmbeddingGenerator:
     def test_embed_gen(self):
@@ -218,6 +710,601 @@ class TestRAGPipeline:
                    for word in ["tcp", "tokio", "server", "connection"])
 
 
+class TestAnswerCache:
+    @pytest.fixture
+    def rag(self, fake_server):
+        rag = RAGPipeline(dimensions=8)
+        rag.answer_cache = AnswerCache(8)
+        for i in range(3):
+            rag.add_document(f"note {i} about Rust", f"note{i}.md")
+        return rag
+
+    def result(self, chunk_ids):
+        return {"answer": "cached", "context": ["text"] * len(chunk_ids),
+                "chunk_ids": chunk_ids, "query": "q"}
+
+    def test_hit_above_threshold_only(self):
+        cache = AnswerCache(2, threshold=0.99)
+        cache.put([1.0, 0.0], self.result([0]))
+
+        assert cache.get([1.0, 0.01])["answer"] == "cached"
+        assert cache.get([0.9, 0.4]) is None
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    def test_expired_entry_is_dropped(self):
+        cache = AnswerCache(2, ttl=0.0)
+        cache.put([1.0, 0.0], self.result([0]))
+
+        assert cache.get([1.0, 0.0]) is None
+        assert len(cache) == 0
+        assert cache.get_stats()["expirations"] == 1
+
+    def test_least_recently_used_evicted(self):
+        cache = AnswerCache(2, max_entries=2)
+        cache.put([1.0, 0.0], self.result([0]))
+        cache.put([0.0, 1.0], self.result([1]))
+        cache.get([1.0, 0.0])
+        cache.put([-1.0, 0.0], self.result([2]))
+
+        assert cache.get([1.0, 0.0]) is not None
+        assert cache.get([0.0, 1.0]) is None
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_invalidate_by_chunk_id(self):
+        cache = AnswerCache(2)
+        cache.put([1.0, 0.0], self.result([0, 1]))
+        cache.put([0.0, 1.0], self.result([2]))
+
+        assert cache.invalidate([1, 7]) == 1
+        assert cache.get([1.0, 0.0]) is None
+        assert cache.get([0.0, 1.0]) is not None
+
+    def test_compacts_removed_rows(self):
+        cache = AnswerCache(2, max_entries=4)
+        for i in range(200):
+            angle = i * 0.01
+            cache.put([np.cos(angle), np.sin(angle)], self.result([i]))
+
+        assert len(cache) == 4
+        assert cache._index.removed_count <= 64
+        assert cache.get([np.cos(1.99), np.sin(1.99)])["chunk_ids"] == [199]
+
+    def test_repeated_question_skips_llm(self, rag, fake_server):
+        first = rag.query("What about Rust?", top_k=2)
+        second = rag.query("what about  rust?", top_k=2)
+
+        assert fake_server.chat_requests == 1
+        assert second["answer"] == first["answer"]
+        assert second["query"] == "what about  rust?"
+        # The cached answer cost no LLM tokens this time
+        assert first["tokens"]["prompt_tokens"] > 0 and "cached" not in first["tokens"]
+        assert (second["tokens"]["prompt_tokens"], second["tokens"]["completion_tokens"]) == (0, 0)
+        assert second["tokens"]["cached"]
+        assert second["tokens"]["context_tokens"] == first["tokens"]["context_tokens"]
+        assert asyncio.run(rag.aquery("What about Rust?", top_k=2))["chunk_ids"] == first["chunk_ids"]
+        assert fake_server.chat_requests == 1
+
+    def test_streamed_answer_is_cached(self, rag, fake_server):
+        streamed = list(rag.query_stream("What about Rust?", top_k=2))[-1]
+        replayed = list(rag.query_stream("What about Rust?", top_k=2))
+
+        assert fake_server.chat_requests == 1
+        assert [e["type"] for e in replayed] == ["context", "token", "done"]
+        assert replayed[-1]["answer"] == streamed["answer"]
+        assert replayed[-1]["tokens"]["prompt_tokens"] == 0
+
+    def test_retired_chunks_invalidate_answer(self, rag, fake_server):
+        first = rag.query("What about Rust?", top_k=2)
+        rag.remove_documents(first["chunk_ids"][:1])
+        second = rag.query("What about Rust?", top_k=2)
+
+        assert fake_server.chat_requests == 2
+        assert first["chunk_ids"][0] not in second["chunk_ids"]
+
+
+class TestAsyncQuery:
+    @pytest.fixture
+    def rag(self, fake_server):
+        fake_server.chat_latency = 0.2
+        rag = RAGPipeline(dimensions=8, max_concurrency=4)
+        for i in range(3):
+            rag.add_document(f"note {i} about Rust", f"note{i}.md")
+        return rag
+
+    def test_aquery_matches_query(self, rag):
+        expected = rag.query("What about Rust?", top_k=2)
+        answer = asyncio.run(rag.aquery("What about Rust?", top_k=2))
+
+        assert answer == expected
+
+    def test_concurrency_is_bounded(self, rag, fake_server):
+        async def run():
+            try:
+                return await asyncio.gather(*(rag.aquery(f"question {i}") for i in range(8)))
+            finally:
+                await rag.aclose()
+
+        answers = asyncio.run(run())
+
+        assert len(answers) == 8
+        assert fake_server.chat_requests == 8
+        # 8 queries, at most 4 of them holding a request open at once
+        assert 1 < fake_server.max_in_flight <= 4
+
+    def test_separate_event_loops(self, rag, fake_server):
+        async def run():
+            return await asyncio.gather(*(rag.aquery(f"question {i}") for i in range(6)))
+
+        # The second loop must not reuse the first one's pool or query slots
+        first = asyncio.run(run())
+        second = asyncio.run(run())
+
+        assert [a["answer"] for a in first] == [a["answer"] for a in second]
+        assert fake_server.chat_requests == 12
+
+    def test_query_stream_events(self, rag):
+        events = list(rag.query_stream("What about Rust?", top_k=2))
+        expected = rag.query("What about Rust?", top_k=2)
+
+        assert events[0]["type"] == "context"
+        assert events[0]["chunk_ids"] == expected["chunk_ids"]
+        tokens = [e["text"] for e in events if e["type"] == "token"]
+        assert len(tokens) > 1
+        done = events[-1]
+        assert done["type"] == "done"
+        assert done["answer"] == "".join(tokens) == expected["answer"]
+        assert [e["type"] for e in events] == ["context"] + ["token"] * len(tokens) + ["done"]
+        timings = done["timings"]
+        assert timings["retrieve_s"] <= timings["first_token_s"] <= timings["total_s"]
+
+    @staticmethod
+    def wait_idle(server, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while server.in_flight and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return server.in_flight == 0
+
+    def test_stream_closed_when_consumer_stops(self, rag, fake_server):
+        fake_server.chat_latency = 6
+        events = rag.query_stream("What about Rust?", top_k=2)
+        assert next(events)["type"] == "context"
+        assert next(events)["type"] == "token"
+        events.close()
+
+        # The abandoned answer is not left streaming for its full 6 s
+        assert self.wait_idle(fake_server)
+
+    def test_async_stream_frees_slot_and_connection_early(self, fake_server):
+        fake_server.chat_latency = 6
+        rag = RAGPipeline(dimensions=8, max_concurrency=1)
+        rag.add_document("note about Rust", "note.md")
+
+        async def run():
+            try:
+                async with contextlib.aclosing(rag.aquery_stream("What about Rust?", top_k=2)) as events:
+                    async for event in events:
+                        if event["type"] == "token":
+                            break
+                assert self.wait_idle(fake_server)
+                fake_server.chat_latency = 0
+                # The one query slot is free again
+                return await asyncio.wait_for(rag.aquery("What about Rust?", top_k=2), 3)
+            finally:
+                await rag.aclose()
+
+        assert asyncio.run(run())["answer"]
+
+    def test_aquery_stream_matches_sync(self, rag):
+        async def run():
+            try:
+                return [event async for event in rag.aquery_stream("What about Rust?", top_k=2)]
+            finally:
+                await rag.aclose()
+
+        events = asyncio.run(run())
+        sync_events = list(rag.query_stream("What about Rust?", top_k=2))
+
+        assert [e["type"] for e in events] == [e["type"] for e in sync_events]
+        assert events[-1]["answer"] == sync_events[-1]["answer"]
+        assert events[-1]["chunk_ids"] == sync_events[-1]["chunk_ids"]
+
+
+class TestQueryBatcher:
+    @pytest.fixture
+    def rag(self, fake_server):
+        rag = RAGPipeline(dimensions=8)
+        for i in range(6):
+            rag.add_document(f"note {i} about Rust", f"note{i}.md",
+                             {"folder": "even" if i % 2 == 0 else "odd"})
+        fake_server.requests.clear()
+        return rag
+
+    @staticmethod
+    def gather(rag, calls):
+        async def run():
+            try:
+                return await asyncio.gather(*(call() for call in calls))
+            finally:
+                await rag.aclose()
+        return asyncio.run(run())
+
+    def test_burst_shares_one_embedding_request(self, rag, fake_server):
+        batcher = QueryBatcher(rag, max_batch=16, max_delay=0.05)
+        questions = [f"question {i}" for i in range(8)]
+        answers = self.gather(rag, [lambda q=q: batcher.aquery(q, top_k=2) for q in questions])
+
+        assert fake_server.requests == [questions]
+        assert batcher.get_stats() == {"batches": 1, "queries": 8, "mean_batch_size": 8.0}
+        for question, answer in zip(questions, answers):
+            assert answer == rag.query(question, top_k=2)
+
+    def test_max_batch_splits_burst(self, rag):
+        batcher = QueryBatcher(rag, max_batch=4, max_delay=10.0)
+        started = time.perf_counter()
+        answers = self.gather(rag, [lambda i=i: batcher.aquery(f"question {i}") for i in range(8)])
+
+        assert len(answers) == 8
+        assert batcher.batches == 2
+        # Full batches go at once rather than after max_delay
+        assert time.perf_counter() - started < 5.0
+
+    def test_mixed_top_k_and_filters(self, rag):
+        batcher = QueryBatcher(rag)
+        answers = self.gather(rag, [
+            lambda: batcher.aquery("What about Rust?", top_k=1),
+            lambda: batcher.aquery("What about Rust?", top_k=3),
+            lambda: batcher.aquery("What about Rust?", top_k=3, filter={"folder": "odd"}),
+        ])
+
+        assert answers[0]["chunk_ids"] == rag.query("What about Rust?", top_k=1)["chunk_ids"]
+        assert answers[1]["chunk_ids"] == rag.query("What about Rust?", top_k=3)["chunk_ids"]
+        assert all(doc_id % 2 == 1 for doc_id in answers[2]["chunk_ids"])
+        assert len(answers[2]["chunk_ids"]) == 3
+
+    def test_texts_stay_with_their_ids(self, rag):
+        questions = [rag.embed_gen.embed_text(q) for q in ["What about Rust?", "note 5", "Tokio"]]
+        # A vector whose document is gone, e.g. retired without its tombstone
+        retired = rag.vec_store.search(questions[0], 1)[0].index
+        rag.doc_store.remove_document(retired)
+
+        retrieved = rag.retrieve_many(questions, top_k=6, filters=[None, None, {"folder": "even"}])
+
+        assert [len(hits) for hits in retrieved] == [5, 5, 3 - (retired % 2 == 0)]
+        for hits in retrieved:
+            for doc_id, text, _ in hits:
+                assert text == rag.doc_store.get_document(doc_id)
+        assert retrieved[0] == rag._retrieve(questions[0], 6)
+
+    def test_bad_question_fails_alone(self, rag):
+        batcher = QueryBatcher(rag)
+
+        async def run():
+            try:
+                return await asyncio.gather(batcher.aquery("   "), batcher.aquery("What about Rust?"),
+                                            return_exceptions=True)
+            finally:
+                await rag.aclose()
+
+        error, answer = asyncio.run(run())
+        assert isinstance(error, ValueError)
+        assert answer["chunk_ids"]
+
+    def test_invalid_settings(self, rag):
+        with pytest.raises(ValueError):
+            QueryBatcher(rag, max_batch=0)
+        with pytest.raises(ValueError):
+            QueryBatcher(rag, max_delay=-1.0)
+
+
+class TestPipelineMetrics:
+    @pytest.fixture
+    def rag(self, fake_server):
+        rag = RAGPipeline(dimensions=8, metrics=Metrics())
+        for i in range(3):
+            rag.add_document(f"note {i} about Rust", f"note{i}.md")
+        rag.metrics.reset()
+        return rag
+
+    def test_query_records_each_stage(self, rag):
+        rag.answer_cache = AnswerCache(8)
+        rag.query("What about Rust?", top_k=2)
+        rag.query("What about Rust?", top_k=2)
+
+        summary = rag.metrics.summary()
+        stages = summary["stages"]
+        for stage in ["query", "embed", "search", "fetch", "prompt", "llm"]:
+            assert stage in stages
+        assert stages["query"]["count"] == 2
+        # The second answer came from the cache, without search or the LLM
+        assert stages["llm"]["count"] == stages["search"]["count"] == 1
+        assert summary["counters"]["answer_cache_miss"] == 1
+        assert summary["counters"]["answer_cache_hit"] == 1
+        assert summary["counters"]["llm_prompt_tokens"] > 0
+
+    def test_stream_times_first_token(self, rag):
+        async def run():
+            try:
+                return [event async for event in rag.aquery_stream("What about Rust?", top_k=2)]
+            finally:
+                await rag.aclose()
+
+        asyncio.run(run())
+        stages = rag.metrics.summary()["stages"]
+        assert stages["llm_first_token"]["count"] == 1
+        assert stages["llm_first_token"]["sum_s"] <= stages["llm"]["sum_s"]
+        # Streamed answers report usage in a closing chunk
+        assert rag.metrics.summary()["counters"]["llm_completion_tokens"] > 0
+
+
+class TestLocalEmbeddings:
+    def test_ingest_and_query_without_api(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        for i in range(4):
+            write_note(tmp_path / f"note{i}.md", f"note {i}", 2)
+        (tmp_path / "tokio.md").write_text(
+            "## Tokio\nTokio schedules async tasks on a work-stealing pool of threads, "
+            "and its runtime drives futures to completion with an I/O reactor.\n")
+        rag = RAGPipeline(dimensions=64, embedding_backend="hashing")
+        stats = ObsidianIngestion(rag).ingest_directory(str(tmp_path))
+
+        assert stats["embeddings_generated"] == len(rag.vec_store) == 9
+        hits = rag._retrieve(rag.embed_gen.embed_text("tokio work-stealing async runtime"), 1)
+        assert hits[0][1].startswith("tokio.md: Tokio")
+
+    def test_dimensions_checked_against_store(self, tmp_path):
+        with pytest.raises(ValueError, match="16-dim vectors but the vector store holds 8"):
+            RAGPipeline(dimensions=8, embedding_backend="hashing:16")
+
+        RAGPipeline(dimensions=16, embedding_backend="hashing").save(str(tmp_path))
+        assert RAGPipeline.load(str(tmp_path), embedding_backend="hashing").embed_gen.dimensions == 16
+        with pytest.raises(ValueError):
+            RAGPipeline.load(str(tmp_path), embedding_backend="hashing:32")
+
+
+class TestContextPacking:
+    def test_count_and_trim_tokens(self):
+        assert count_tokens("") == 0
+        assert count_tokens("Hello world") == 2
+        assert count_tokens("I'm here, 2024!") == 7
+        # Long words take more than one token
+        assert count_tokens("internationalization") == 5
+        text = PARAGRAPH * 4
+        trimmed = trim_to_tokens(text, 30)
+        assert text.startswith(trimmed) and count_tokens(trimmed) <= 30 < count_tokens(text)
+        assert trim_to_tokens("short", 30) == "short"
+
+    def test_drops_near_duplicates(self):
+        hits = [(0, f"a.md: {PARAGRAPH}", 0.9), (1, f"b.md: {PARAGRAPH} And more.", 0.8),
+                (2, "c.md: Tokio schedules tasks on a work-stealing pool of threads.", 0.7)]
+        packed = pack_context(hits, [count_tokens(text) for _, text, _ in hits], budget=1000)
+
+        assert packed.doc_ids == [0, 2]
+        assert packed.duplicates == 1
+
+    def test_greedy_within_budget(self):
+        texts = [" ".join(f"word{i}x{j}" for j in range(n)) for i, n in enumerate([40, 300, 20, 20, 20])]
+        hits = [(i, text, similarity) for i, (text, similarity)
+                in enumerate(zip(texts, [0.9, 0.85, 0.5, 0.4, 0.3]))]
+        counts = [count_tokens(text) for text in texts]
+        packed = pack_context(hits, counts, budget=400)
+
+        # The long second hit would not fit; the short ones after it do, in rank order
+        assert packed.doc_ids == [0, 2, 3, 4]
+        assert packed.tokens == counts[0] + sum(counts[2:]) <= 400
+        assert packed.unpacked_tokens == sum(counts)
+        report = packed.report()
+        assert report["context_tokens_saved"] == counts[1]
+
+        assert pack_context(hits, counts, budget=None).doc_ids == [0, 1, 2, 3, 4]
+        assert pack_context(hits, counts, budget=20).texts == [trim_to_tokens(texts[0], 20)]
+
+    def test_never_costs_more_than_unpacked(self):
+        # The top 6 are one short note six times; longer distinct notes rank below
+        texts = ["a.md: Tokio schedules tasks on a pool of threads."] * 6 + \
+                [f"b.md: {PARAGRAPH} Part {i}." for i in range(4)]
+        hits = [(i, text, 0.9 - i * 0.01) for i, text in enumerate(texts)]
+        packed = pack_context(hits, [count_tokens(text) for text in texts], budget=1000)
+
+        assert packed.doc_ids == [0]
+        assert packed.duplicates == 5
+        assert packed.report()["context_tokens_saved"] == 5 * count_tokens(texts[0])
+
+    def test_budget_too_small_for_any_chunk(self):
+        texts = ["internationalization and localization", "globalization of software"]
+        hits = [(0, texts[0], 0.9), (1, texts[1], 0.8)]
+        counts = [count_tokens(text) for text in texts]
+
+        # Not even the best hit's first word fits, so nothing is sent
+        packed = pack_context(hits, counts, budget=1)
+        assert packed.id_text_pairs == [] and packed.tokens == 0
+        with pytest.raises(ValueError, match="at least 1"):
+            pack_context(hits, counts, budget=0)
+        with pytest.raises(ValueError, match="at least 1"):
+            RAGPipeline(dimensions=8, context_tokens=0)
+
+    @pytest.fixture
+    def build(self, fake_server):
+        def build(context_tokens):
+            rag = RAGPipeline(dimensions=8, context_tokens=context_tokens)
+            for i in range(10):
+                # Every other note repeats the one before it
+                words = " ".join(f"idea{i // 2}x{j}" for j in range(40))
+                rag.add_document(f"Note {i // 2} on ownership: {words}", f"note{i}.md")
+            return rag
+        return build
+
+    def test_query_reports_savings(self, build):
+        unpacked = build(None).query("What about ownership?", top_k=10)
+        packed = build(300).query("What about ownership?", top_k=10)
+
+        assert len(unpacked["chunk_ids"]) == 6
+        assert "prompt_tokens" in unpacked["tokens"]
+        tokens = packed["tokens"]
+        assert tokens["context_tokens"] <= 300
+        assert tokens["duplicates_removed"] == 3
+        assert tokens["context_tokens_saved"] == unpacked["tokens"]["context_tokens"] - tokens["context_tokens"] > 0
+        assert tokens["prompt_tokens"] < unpacked["tokens"]["prompt_tokens"]
+
+    def test_empty_context_skips_llm(self, fake_server):
+        rag = RAGPipeline(dimensions=8, context_tokens=1)
+        rag.add_document("Ownership rules", "internationalization.md")
+
+        assert rag.query("What about ownership?")["chunk_ids"] == []
+        events = list(rag.query_stream("What about ownership?"))
+        assert [e["type"] for e in events] == ["context", "token", "done"]
+        assert fake_server.chat_requests == 0
+
+    def test_stream_reports_savings(self, build):
+        rag = build(300)
+        done = list(rag.query_stream("What about ownership?", top_k=10))[-1]
+
+        assert done["chunk_ids"] == rag.query("What about ownership?", top_k=10)["chunk_ids"]
+        assert done["tokens"]["context_tokens"] <= 300
+        assert done["tokens"]["prompt_tokens"] > 0
+
+
+class TestEvaluation:
+    @pytest.fixture
+    def rag(self, fake_server):
+        rag = RAGPipeline(dimensions=8)
+        for i in range(30):
+            rag.add_document(f"note {i} about Rust", f"note{i}.md")
+        fake_server.requests.clear()
+        return rag
+
+    def test_scores_at_several_cutoffs(self):
+        scores = retrieval_scores([5, 1, 7, 2], [1, 2, 9], [1, 2, 4])
+
+        assert scores["precision@1"] == 0.0
+        assert scores["precision@2"] == 0.5
+        assert scores["recall@4"] == pytest.approx(2 / 3)
+        assert scores["rr"] == 0.5
+        # Hits at ranks 2 and 4 against an ideal of ranks 1-3
+        ideal = 1 + 1 / np.log2(3) + 1 / np.log2(4)
+        assert scores["ndcg@4"] == pytest.approx((1 / np.log2(3) + 1 / np.log2(5)) / ideal)
+        assert retrieval_scores([1, 2], [], [2])["ndcg@2"] == 0.0
+
+    def test_retrieval_only_batches_and_skips_chat(self, rag, fake_server):
+        queries = [f"question {i}" for i in range(40)]
+        expected = [rag.vec_store.search(rag.embed_gen.embed_text(q), 3) for q in queries]
+        fake_server.requests.clear()
+        ground_truth = [EvalQuery(q, [hits[0].index], "test") for q, hits in zip(queries, expected)]
+
+        evals = run_evaluation(rag, ground_truth, k=3, ks=[1, 10], verbose=False)
+
+        assert fake_server.chat_requests == 0
+        # Every query was embedded already, so not even one embedding request
+        assert fake_server.requests == []
+        assert evals["mrr"] == evals["precision@1"] == evals["recall@1"] == 1.0
+        assert evals["precision@k"] == evals["precision@3"] == pytest.approx(1 / 3)
+        assert evals["recall@10"] == 1.0
+
+    def test_no_queries_rejected(self, rag, fake_server):
+        with pytest.raises(ValueError, match="at least one test query"):
+            run_evaluation(rag, [], verbose=False)
+        assert fake_server.requests == []
+
+    def test_one_embedding_request_for_all_queries(self, rag, fake_server):
+        ground_truth = [EvalQuery(f"fresh question {i}", [i], "test") for i in range(25)]
+        run_evaluation(rag, ground_truth, verbose=False)
+
+        assert len(fake_server.requests) == 1
+        assert len(fake_server.requests[0]) == 25
+
+    def test_judge_answers_concurrently(self, rag, fake_server):
+        fake_server.chat_latency = 0.2
+        ground_truth = [EvalQuery(f"question {i}", [i], "test") for i in range(8)]
+
+        evals = run_evaluation(rag, ground_truth, judge=True, verbose=False)
+
+        # An answer and a grade per query, several of them at once
+        assert fake_server.chat_requests == 16
+        assert fake_server.max_in_flight > 1
+        # The fake server's answer holds no grade
+        assert evals["judge_score"] is None
+
+    def test_pipeline_usable_after_judging(self, rag, fake_server):
+        async def ask():
+            try:
+                return await rag.aquery("What about Rust?", top_k=2)
+            finally:
+                await rag.aclose()
+
+        before = asyncio.run(ask())
+        run_evaluation(rag, [EvalQuery("question 0", [0], "test")], judge=True, verbose=False)
+
+        assert asyncio.run(ask()) == before
+        assert fake_server.chat_requests == 4
+
+
+class TestParameterSweep:
+    @pytest.fixture
+    def vault(self, tmp_path):
+        for i in range(4):
+            body = "".join(f"## Topic {i}.{j}\n{PARAGRAPH}\n### Detail {i}.{j}\n{PARAGRAPH}\n"
+                           for j in range(3))
+            (tmp_path / f"note{i}.md").write_text(f"# Note {i}\n{body}")
+        return tmp_path
+
+    def test_ground_truth_texts_from_index(self):
+        doc_store = DocStore()
+        doc_store.add_documents(["first chunk", "second  chunk\nwith lines"], ["a.md", "b.md"])
+        truth = ground_truth_texts(doc_store, [EvalQuery("q", [1, 0], "test")])
+
+        assert truth == [[("b.md", "second chunk with lines"), ("a.md", "first chunk")]]
+
+    def test_grid_and_pareto_front(self):
+        configs = grid([(2,), (2, 3)], [40, 100], [0.7], [50], [6], ["off", "rrf", "0.3"])
+        assert len(configs) == 12
+        assert configs[-1] == SweepConfig((2, 3), 100, 0.7, 50, 6, "weighted", 0.3)
+
+        results = [{"ndcg": 0.9, "search_p50_ms": 2.0, "memory_mb": 5.0},
+                   {"ndcg": 0.5, "search_p50_ms": 1.0, "memory_mb": 5.0},
+                   {"ndcg": 0.5, "search_p50_ms": 2.0, "memory_mb": 5.0},
+                   {"ndcg": 0.1, "search_p50_ms": 3.0, "memory_mb": 1.0}]
+        assert pareto_front(results, "ndcg") == [results[0], results[1], results[3]]
+
+    def test_embeds_once_and_scores_each_setting(self, vault, fake_server):
+        embed_gen = EmbeddingGenerator(client=fake_server.client())
+        # Each query is the text of a level-2 chunk, so it finds that chunk first
+        chunks = MarkdownChunker().chunk_file(str(vault / "note1.md"))
+        queries = [EvalQuery(chunks[j], [], "test") for j in range(3)]
+        truth = [[("note1.md", " ".join(chunks[j].split()))] for j in range(3)]
+        configs = grid([(2,), (2, 3)], [100, 10_000], [0.7], [50], [1], ["off", "rrf"])
+
+        results = run_sweep(str(vault), embed_gen, configs, queries, truth, processes=1)
+
+        # 12 + 24 chunks and 3 queries; the queries were already embedded as chunks
+        assert sum(len(inputs) for inputs in fake_server.requests) == 36
+        assert len(results) == 8
+        by_config = {(r["config"]["split_levels"], r["config"]["min_chars"], r["config"]["fusion"]): r
+                     for r in results}
+        best = by_config[(2,), 100, None]
+        assert results[0]["ndcg"] == best["ndcg"] == best["precision"] == best["mrr"] == 1.0
+        assert best["chunks"] == 12 and best["memory_mb"] > 0
+        # Finer chunks split each answer in two, neither embedding like the query
+        finer = by_config[(2, 3), 100, None]
+        assert finer["chunks"] == 24 and finer["recall"] <= 0.5
+        empty = [r for r in results if r["config"]["min_chars"] == 10_000]
+        assert all(r["chunks"] == 0 and r["ndcg"] == 0.0 and r["memory_mb"] == 0 for r in empty)
+        assert results[0]["pareto"] and any(r["pareto"] for r in empty)
+
+    def test_worker_processes_agree_with_inline(self, vault, fake_server):
+        embed_gen = EmbeddingGenerator(client=fake_server.client())
+        chunks = MarkdownChunker().chunk_file(str(vault / "note2.md"))
+        queries = [EvalQuery(chunks[0], [], "test")]
+        truth = [[("note2.md", " ".join(chunks[0].split()))]]
+        configs = grid([(2,), (2, 3)], [100], [0.7], [50], [1, 3], ["off", "0.5"])
+
+        def quality(results):
+            return sorted((str(r["config"]), r["ndcg"], r["recall"], r["chunks"]) for r in results)
+
+        inline = run_sweep(str(vault), embed_gen, configs, queries, truth, processes=1)
+        pooled = run_sweep(str(vault), embed_gen, configs, queries, truth, processes=2)
+        assert quality(pooled) == quality(inline)
+
+
 class TestMarkdownChunker:
     def test_single_file_walk(self):
         md_chunk = MarkdownChunker()
@@ -225,6 +1312,237 @@ class TestMarkdownChunker:
             '/Users/hectorcryo/Documents/Knowledge Engineering Vault/Knowledge-Engineering/Patterns/FFI-Rust-Python.md')
         assert len(results) > 1
 
+    def test_splits_at_level_two_headings(self):
+        text = ("# Title\nintro line that is long enough to keep around\n"
+                "## First\n" + PARAGRAPH + "\n## Tiny\nx\n"
+                "## Code\n```rust\nfn main() { println!(\"borrow checker\"); }\n```\n")
+        chunks = MarkdownChunker().chunk_text(text)
+
+        assert len(chunks) == 3
+        assert chunks[0].startswith("Title\nintro line")
+        assert chunks[1].startswith("First\nOwnership")
+        assert chunks[2] == "Code\nrust\nfn main() { println!(\"borrow checker\"); }\n\n"
+
+    def test_split_levels(self):
+        text = f"## Part\n{PARAGRAPH}\n### Detail\n{PARAGRAPH}\n#### Aside\n{PARAGRAPH}\n"
+
+        assert len(MarkdownChunker().chunk_text(text)) == 1
+        chunks = MarkdownChunker(split_levels=(2, 3)).chunk_text(text)
+        assert [chunk.split("\n", 1)[0] for chunk in chunks] == ["Part", "Detail"]
+
+    def test_large_note_flattens_quickly(self):
+        text = "".join(f"## Section {i}\n{PARAGRAPH}\n" for i in range(5000))
+        chunks = MarkdownChunker().chunk_text(text)
+
+        assert len(chunks) == 5000
+        assert chunks[-1] == f"Section 4999\n{PARAGRAPH.strip()}\n"
+
+    def test_chunk_files_across_processes(self, tmp_path):
+        paths = list()
+        for i in range(6):
+            write_note(tmp_path / f"note{i}.md", f"note {i}", i % 3 + 1)
+            paths.append(str(tmp_path / f"note{i}.md"))
+        chunker = MarkdownChunker()
+
+        results = list(chunker.chunk_files(paths, processes=2))
+
+        assert [path for path, _ in results] == paths
+        assert all(chunks == chunker.chunk_file(path) for path, chunks in results)
+
+
+PARAGRAPH = ("Ownership and borrowing let Rust free memory without a garbage "
+             "collector, and lifetimes tell the compiler how long references live. ")
+
+
+def write_note(path, title, sections):
+    body = "".join(f"## {title} {i}\n{PARAGRAPH}\n" for i in range(sections))
+    path.write_text(f"# {title}\n{body}")
+
+
+class TestIncrementalIngestion:
+    @pytest.fixture
+    def server(self):
+        with FakeEmbeddingServer(dimensions=8) as server:
+            yield server
+
+    @pytest.fixture
+    def vault(self, tmp_path):
+        vault = tmp_path / "vault"
+        (vault / "sub").mkdir(parents=True)
+        write_note(vault / "a.md", "alpha", 3)
+        write_note(vault / "b.md", "beta", 2)
+        write_note(vault / "sub" / "c.md", "gamma", 1)
+        return vault
+
+    def make_rag(self, server, monkeypatch, index_dir=None):
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-key")
+        rag = RAGPipeline.load(index_dir) if index_dir else RAGPipeline(dimensions=8)
+        rag.embed_gen = EmbeddingGenerator(client=server.client())
+        return rag
+
+    def test_unchanged_vault_makes_no_requests(self, server, vault, tmp_path, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        first = ObsidianIngestion(rag).ingest_directory(str(vault))
+        assert first["files_processed"] == 3
+        assert first["embeddings_generated"] == 6
+        rag.save(str(tmp_path / "index"))
+
+        sent = len(server.requests)
+        rag = self.make_rag(server, monkeypatch, str(tmp_path / "index"))
+        second = ObsidianIngestion(rag).ingest_directory(str(vault))
+        assert second["files_unchanged"] == 3
+        assert second["embeddings_generated"] == 0
+        assert len(server.requests) == sent
+
+    def test_edited_and_deleted_files_retire_chunks(self, server, vault, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        ingestor = ObsidianIngestion(rag)
+        ingestor.ingest_directory(str(vault))
+        old_b = rag.manifest["b.md"]["chunk_ids"]
+
+        write_note(vault / "b.md", "beta edited", 1)
+        (vault / "sub" / "c.md").unlink()
+        stats = ingestor.ingest_directory(str(vault))
+
+        assert stats["files_processed"] == 1
+        assert stats["files_removed"] == 1
+        assert stats["chunks_retired"] == 3
+        assert "sub/c.md" not in rag.manifest
+        assert rag.manifest["b.md"]["chunk_ids"] == [6]
+        assert all(rag.doc_store.get_document(i) is None for i in old_b)
+        assert rag.vec_store.removed_count == 3
+        assert len(rag.doc_store.store) == 4
+
+    def test_removals_survive_save_and_load(self, server, vault, tmp_path, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        ingestor = ObsidianIngestion(rag)
+        ingestor.ingest_directory(str(vault))
+        (vault / "a.md").unlink()
+        ingestor.ingest_directory(str(vault))
+        rag.save(str(tmp_path / "index"))
+
+        loaded = self.make_rag(server, monkeypatch, str(tmp_path / "index"))
+        assert loaded.vec_store.removed_count == 3
+        assert loaded.manifest == rag.manifest
+        query = loaded.embed_gen.embed_text("anything")
+        hits = loaded.vec_store.search(query, k=10)
+        assert {r.index for r in hits} == {3, 4, 5}
+
+    def test_filter_by_folder_and_tag(self, server, vault, tmp_path, monkeypatch):
+        (vault / "sub" / "c.md").write_text(f"# gamma\n## tagged\n#Tokio and #async: {PARAGRAPH}\n")
+        rag = self.make_rag(server, monkeypatch)
+        ObsidianIngestion(rag).ingest_directory(str(vault))
+        c_ids = rag.manifest["sub/c.md"]["chunk_ids"]
+        assert rag.manifest["sub/c.md"]["tags"] == ["tokio", "async"]
+
+        query = rag.embed_gen.embed_text("anything")
+        hits = rag.vec_store.search(query, k=10, filter={"folder": "sub"})
+        assert sorted(r.index for r in hits) == c_ids
+        assert rag.vec_store.count({"tags": "tokio"}) == len(c_ids)
+        assert rag.vec_store.count({"source": "a.md"}) == 3
+
+        # Attributes are not in the vector file; load rebuilds them from the manifest
+        rag.save(str(tmp_path / "index"))
+        loaded = self.make_rag(server, monkeypatch, str(tmp_path / "index"))
+        assert loaded.vec_store.get_attributes(c_ids[0]) == rag.vec_store.get_attributes(c_ids[0])
+
+    def test_compacted_index_reloads(self, server, vault, tmp_path, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        ingestor = ObsidianIngestion(rag)
+        ingestor.ingest_directory(str(vault))
+        (vault / "a.md").unlink()
+        ingestor.ingest_directory(str(vault))
+        assert rag.compact(min_removed_fraction=0.9) == 0
+        assert rag.compact() == 3
+        rag.save(str(tmp_path / "index"))
+
+        loaded = self.make_rag(server, monkeypatch, str(tmp_path / "index"))
+        assert len(loaded.vec_store) == 3
+        query = loaded.embed_gen.embed_text("anything")
+        assert {r.index for r in loaded.vec_store.search(query, k=10)} == {3, 4, 5}
+        write_note(vault / "d.md", "delta", 1)
+        stats = ObsidianIngestion(loaded).ingest_directory(str(vault))
+        assert stats["files_processed"] == 1
+        assert loaded.manifest["d.md"]["chunk_ids"] == [6]
+
+    def test_stage_stats_reported(self, server, vault, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        stats = ObsidianIngestion(rag).ingest_directory(str(vault))
+
+        stages = stats["stages"]
+        assert list(stages) == ["discover", "chunk", "filter", "embed", "add"]
+        assert stages["discover"]["items"] == 3
+        assert stages["chunk"]["items"] == stats["chunks_created"] == 6
+        assert stages["embed"]["items"] == stages["add"]["items"] == 6
+
+    def test_batches_span_files(self, server, vault, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        ObsidianIngestion(rag, batch_size=4, embed_workers=1).ingest_directory(str(vault))
+
+        assert sorted(len(r) for r in server.requests) == [2, 4]
+        assert sorted(i for e in rag.manifest.values() for i in e["chunk_ids"]) == list(range(6))
+
+    def test_chunk_ids_follow_file_order(self, server, vault, monkeypatch):
+        # One chunk per request, answered in a random order by several workers
+        server.latency = latency_distribution("uniform:0.0:0.05", seed=7)
+        write_note(vault / "a.md", "alpha", 8)
+        rag = self.make_rag(server, monkeypatch)
+        ObsidianIngestion(rag, batch_size=1, embed_workers=4).ingest_directory(str(vault))
+
+        chunker = MarkdownChunker()
+        for key, entry in rag.manifest.items():
+            texts = rag.doc_store.get_documents(entry["chunk_ids"])
+            assert entry["chunk_ids"] == sorted(entry["chunk_ids"])
+            assert [text.split(": ", 1)[1] for text in texts] == \
+                [f"{chunk}\n" for chunk in chunker.chunk_file(str(vault / key))]
+
+    def test_process_pool_chunking_matches_threaded(self, server, vault, monkeypatch):
+        threaded = self.make_rag(server, monkeypatch)
+        ObsidianIngestion(threaded, embed_workers=1).ingest_directory(str(vault))
+        pooled = self.make_rag(server, monkeypatch)
+        stats = ObsidianIngestion(pooled, embed_workers=1, chunk_processes=2).ingest_directory(str(vault))
+
+        assert stats["chunks_created"] == 6
+        assert pooled.manifest == threaded.manifest
+        assert pooled.doc_store.get_documents(range(6)) == threaded.doc_store.get_documents(range(6))
+
+    def test_embedding_failure_stops_pipeline(self, server, vault, monkeypatch):
+        server.max_tokens = 10
+        rag = self.make_rag(server, monkeypatch)
+
+        with pytest.raises(BadRequestError):
+            ObsidianIngestion(rag, queue_size=1).ingest_directory(str(vault))
+        assert not [t for t in threading.enumerate() if t.name.startswith("ingest-")]
+        assert rag.manifest == {}
+        assert len(rag.vec_store) == 0
+        assert len(rag.doc_store) == 0
+
+    def test_failure_mid_file_leaves_stores_unchanged(self, server, vault, monkeypatch):
+        rag = self.make_rag(server, monkeypatch)
+        ObsidianIngestion(rag).ingest_directory(str(vault))
+        manifest = copy.deepcopy(rag.manifest)
+        slots, docs = len(rag.vec_store), len(rag.doc_store)
+
+        write_note(vault / "a.md", "delta", 3)
+        write_note(vault / "b.md", "epsilon", 2)
+        embed_batch = rag.embed_gen.embed_batch
+        calls = list()
+
+        def second_call_fails(texts):
+            calls.append(texts)
+            if len(calls) == 2:
+                raise RuntimeError("embeddings endpoint went away")
+            return embed_batch(texts)
+
+        monkeypatch.setattr(rag.embed_gen, "embed_batch", second_call_fails)
+        # Batches [a0, a1] then [a2, b0]: a.md is two-thirds embedded when it fails
+        with pytest.raises(RuntimeError):
+            ObsidianIngestion(rag, batch_size=2, embed_workers=1).ingest_directory(str(vault))
+
+        assert rag.manifest == manifest
+        assert (len(rag.vec_store), len(rag.doc_store)) == (slots, docs)
+        assert "delta" not in " ".join(rag.doc_store.get_documents(range(docs)))
+
 
 class TestEmbeddingCache:
     def test_cache_hit_on_identical_query(self):
@@ -0,0 +1,111 @@
+"""Stage histograms and their export; the embedding hooks run against the fake endpoint"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import pytest
+from embeddings import EmbeddingGenerator
+from fake_openai import FakeEmbeddingServer
+from metrics import DISABLED, Histogram, Metrics, exponential_buckets
+
+
+class TestHistogram:
+    def test_quantiles_within_bucket_width(self):
+        histogram = Histogram(exponential_buckets(1e-3, 2 ** 0.5, 30))
+        for i in range(1, 1001):
+            histogram.observe(i / 1000)
+
+        assert histogram.count == 1000
+        assert histogram.sum == pytest.approx(500.5)
+        assert histogram.quantile(0.5) == pytest.approx(0.5, rel=0.2)
+        assert histogram.quantile(0.99) == pytest.approx(0.99, rel=0.2)
+
+    def test_overflow_and_empty(self):
+        histogram = Histogram([0.1, 1.0])
+        assert histogram.quantile(0.5) == 0.0
+        histogram.observe(50.0)
+        assert histogram.counts == [0, 0, 1]
+        assert histogram.quantile(0.99) == 1.0
+
+
+class TestMetrics:
+    def test_timer_and_counters(self):
+        metrics = Metrics()
+        with metrics.time("search"):
+            pass
+        metrics.count("answer_cache_hit")
+        metrics.count("llm_prompt_tokens", 120)
+
+        summary = metrics.summary()
+        assert summary["stages"]["search"]["count"] == 1
+        assert summary["counters"] == {"answer_cache_hit": 1, "llm_prompt_tokens": 120}
+        metrics.reset()
+        assert metrics.summary() == {"stages": {}, "counters": {}}
+
+    def test_threads_lose_no_observations(self):
+        metrics = Metrics()
+
+        def work(_):
+            for _ in range(1000):
+                metrics.observe("embed", 0.01)
+                metrics.count("embedding_cache_hit")
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(8)))
+
+        assert metrics.histograms["embed"].count == 8000
+        assert metrics.counters["embedding_cache_hit"] == 8000
+
+    def test_prometheus_text(self):
+        metrics = Metrics(buckets=[0.01, 0.1])
+        metrics.observe("llm", 0.05)
+        metrics.observe("llm", 0.5)
+        metrics.count("answer_cache_miss", 2)
+        lines = metrics.to_prometheus().splitlines()
+
+        assert "# TYPE knowledge_search_stage_seconds histogram" in lines
+        assert 'knowledge_search_stage_seconds_bucket{stage="llm",le="0.01"} 0' in lines
+        assert 'knowledge_search_stage_seconds_bucket{stage="llm",le="0.1"} 1' in lines
+        assert 'knowledge_search_stage_seconds_bucket{stage="llm",le="+Inf"} 2' in lines
+        assert 'knowledge_search_stage_seconds_count{stage="llm"} 2' in lines
+        assert 'knowledge_search_events_total{event="answer_cache_miss"} 2' in lines
+
+    def test_prometheus_counters_keep_every_digit(self):
+        metrics = Metrics()
+        metrics.count("llm_prompt_tokens", 12_345_678)
+        metrics.count("llm_prompt_tokens", 1)
+        metrics.count("embedding_cost_usd", 0.1234567891)
+        lines = metrics.to_prometheus().splitlines()
+
+        assert 'knowledge_search_events_total{event="llm_prompt_tokens"} 12345679' in lines
+        assert 'knowledge_search_events_total{event="embedding_cost_usd"} 0.1234567891' in lines
+
+    def test_json_lines(self):
+        metrics = Metrics()
+        metrics.observe("fetch", 0.002)
+        metrics.count("embedding_tokens", 7)
+        records = [json.loads(line) for line in metrics.to_json_lines().splitlines()]
+
+        assert records[0]["stage"] == "fetch" and records[0]["count"] == 1
+        assert records[1]["event"] == "embedding_tokens" and records[1]["value"] == 7
+
+    def test_disabled_records_nothing(self):
+        with DISABLED.time("query"):
+            DISABLED.observe("search", 1.0)
+            DISABLED.count("answer_cache_hit")
+
+        assert DISABLED.time("a") is DISABLED.time("b")
+        assert DISABLED.summary() == {"stages": {}, "counters": {}}
+
+
+class TestEmbeddingHooks:
+    def test_requests_hits_and_tokens(self):
+        metrics = Metrics()
+        with FakeEmbeddingServer(dimensions=16) as server:
+            embed_gen = EmbeddingGenerator(client=server.client(), metrics=metrics)
+            embed_gen.embed_batch(["rust", "zig"])
+            embed_gen.embed_batch(["rust", "go"])
+
+        summary = metrics.summary()
+        assert summary["stages"]["embedding_request"]["count"] == 2
+        assert summary["counters"]["embedding_cache_hit"] == 1
+        assert summary["counters"]["embedding_cache_miss"] == 3
+        assert summary["counters"]["embedding_tokens"] > 0